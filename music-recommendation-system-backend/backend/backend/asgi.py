@@ -3,6 +3,9 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn backend.asgi:application``) to run
+the async recommendation endpoints under ``/api/async/`` on the event loop.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
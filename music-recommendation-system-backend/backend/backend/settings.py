@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+from datetime import timedelta
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'music.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,13 +81,52 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# WAL lets readers run alongside the single writer; synchronous=NORMAL is
+# durable across application crashes in WAL mode and avoids an fsync per
+# commit. Writes take the lock up front (BEGIN IMMEDIATE) and wait up to
+# "timeout" seconds for it instead of failing with "database is locked".
+SQLITE_INIT_COMMAND = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA cache_size=-20000;"
+    "PRAGMA mmap_size=134217728"
+)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds to keep connections open between requests (None: forever)
+        'CONN_MAX_AGE': int(os.getenv("DATABASE_CONN_MAX_AGE", "600")),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_INIT_COMMAND,
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
+# Read-only database for listening history and catalog reads (music.routers),
+# e.g. a replica kept in sync with litestream, or the primary file itself to
+# give reads their own connections. Unset, everything uses "default".
+DATABASE_REPLICA_NAME = os.getenv("DATABASE_REPLICA_NAME")
+DATABASE_READ_ALIAS = None
+if DATABASE_REPLICA_NAME:
+    DATABASE_READ_ALIAS = 'replica'
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': DATABASE_REPLICA_NAME,
+        'OPTIONS': {
+            **DATABASES['default']['OPTIONS'],
+            'init_command': SQLITE_INIT_COMMAND + ";PRAGMA query_only=ON",
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['music.routers.ReadWriteRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -131,7 +172,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        # orjson when installed, DRF's JSONRenderer otherwise
+        'music.renderers.ORJSONRenderer',
     ],
 }
 
@@ -139,4 +181,161 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+
+# Alternative API endpoint, e.g. a local fake server for load testing
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+
+# Maximum outstanding LLM requests per event loop for the async views
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+
+# Seconds before the OpenAI client gives up on a request, including one left
+# running in the background after its view's deadline
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+
+# Seconds the recommendation views wait for the LLM before answering with a
+# local fallback marked as degraded (music.deadline); 0 waits indefinitely.
+# Keys are endpoints: "recommendations" (time of day, LLM or hybrid backend),
+# "filter", "search" and "batch" (each user of a batch request).
+LLM_DEADLINES = {
+    'recommendations': float(os.getenv("LLM_DEADLINE_RECOMMENDATIONS", "3")),
+    'filter': float(os.getenv("LLM_DEADLINE_FILTER", "3")),
+    'search': float(os.getenv("LLM_DEADLINE_SEARCH", "5")),
+    'batch': float(os.getenv("LLM_DEADLINE_BATCH", "5")),
+}
+
+# Circuit breaker in front of the LLM: after FAILURES consecutive timeouts or
+# API errors the views serve fallbacks without calling it, and every
+# RESET_TIMEOUT seconds one request probes whether it has recovered
+LLM_BREAKER = {
+    'FAILURES': int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+    'RESET_TIMEOUT': float(os.getenv("LLM_BREAKER_RESET_TIMEOUT", "30")),
+}
+
+# Batch recommendation endpoint: users per request and LLM calls in flight per
+# request (still subject to LLM_MAX_CONCURRENCY)
+BATCH_MAX_USERS = int(os.getenv("BATCH_MAX_USERS", "5000"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+
+# Recommendation backend for RecommendationView: "llm", "vector", "hybrid"
+# (the LLM re-ranks the vector engine's top RECOMMENDER_RERANK_TOP_K songs) or
+# "similar" (co-listening neighbours from SIMILARITY_INDEX_PATH).
+RECOMMENDER_BACKEND = os.getenv("RECOMMENDER_BACKEND", "llm")
+
+RECOMMENDER_RERANK_TOP_K = 50
+
+# Default and largest number of songs per page of the songs listing (music.browse)
+SONGS_PAGE_SIZE = 50
+SONGS_MAX_PAGE_SIZE = 200
+
+# Latest listens included in a user's profile (UserProfileView)
+PROFILE_HISTORY_SIZE = 20
+
+# Longest Cache-Control max-age in seconds of a recommendation response
+# (music.conditional); it never outlives the time-of-day slot either
+RECOMMENDATION_MAX_AGE = int(os.getenv("RECOMMENDATION_MAX_AGE", "300"))
+
+# Users whose liked and skipped songs are kept in memory per process
+# (music.feedback); the least recently used are evicted beyond this
+FEEDBACK_CACHE_USERS = int(os.getenv("FEEDBACK_CACHE_USERS", "100000"))
+
+# Seconds a user's liked and skipped songs stay cached; changes made by other
+# workers are only seen once they expire (0 keeps them until evicted)
+FEEDBACK_CACHE_TTL = float(os.getenv("FEEDBACK_CACHE_TTL", "30"))
+
+# Seconds the catalog's genre and mood counts stay cached per process (see
+# music.browse); bulk inserts and other workers' writes show up once they
+# expire (0 keeps them until a song is saved or deleted in this process)
+FACETS_CACHE_TTL = float(os.getenv("FACETS_CACHE_TTL", "60"))
+
+# Rebuild the catalog indexes (grounding, BM25, vector recommender) on a
+# background thread after songs change and swap them in, serving the old ones
+# meanwhile; off drops them so the next request rebuilds (see music.rebuild)
+CATALOG_REBUILD_IN_BACKGROUND = os.getenv("CATALOG_REBUILD_IN_BACKGROUND", "1") == "1"
+
+# Item-item co-listening index written by `manage.py build_similarity` and
+# memory-mapped by the web workers
+SIMILARITY_INDEX_PATH = os.getenv("SIMILARITY_INDEX_PATH", str(BASE_DIR / "similarity.npy"))
+
+# Match songs returned by the LLM to the catalog (music.grounding), returning
+# catalog songs with their ids and "id": null for songs we do not have
+LLM_GROUNDING = True
+
+# SearchRecommendationView: "candidates" puts the best local full-text matches
+# (music.search) in the LLM prompt, "local" returns them without the LLM and
+# "llm" sends the bare query. SEARCH_BACKEND is "auto" (FTS5 on SQLite, BM25 in
+# memory elsewhere), "fts" or "bm25".
+SEARCH_MODE = os.getenv("SEARCH_MODE", "candidates")
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+SEARCH_CANDIDATES = 20
+
+# RecommendationView serves rows written by `manage.py precompute_recommendations`
+# while they are younger than PRECOMPUTED_MAX_AGE and the user has no newer listens
+PRECOMPUTED_RECOMMENDATIONS = True
+PRECOMPUTED_MAX_AGE = timedelta(hours=int(os.getenv("PRECOMPUTED_MAX_AGE_HOURS", "24")))
+
+# Signed bearer tokens returned by the login endpoints: lifetime in seconds, and
+# whether recommendation endpoints reject requests without one (requests that
+# carry a token are always checked)
+AUTH_TOKEN_MAX_AGE = int(os.getenv("AUTH_TOKEN_MAX_AGE", str(24 * 3600)))
+AUTH_TOKEN_REQUIRED = os.getenv("AUTH_TOKEN_REQUIRED", "") == "1"
+
+# Threads verifying password hashes for the async login view
+PASSWORD_HASHING_WORKERS = int(os.getenv("PASSWORD_HASHING_WORKERS", str(os.cpu_count() or 1)))
+
+# Add a Server-Timing header with per-stage durations (db, llm, parse, ground,
+# search, render) to every response, for browser developer tools
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "") == "1"
+
+# Estimated input tokens per LLM prompt (music.prompts). Song lists that do not
+# fit are deduplicated, then their oldest entries summarized. Prompts listing
+# catalog candidates (hybrid re-rank, candidate search) get
+# PROMPT_TOKENS_PER_CANDIDATE more per candidate, enough for a typical
+# "id: title by artist (genre, mood)" entry, so RECOMMENDER_RERANK_TOP_K and
+# SEARCH_CANDIDATES are listed in full.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "200"))
+PROMPT_TOKENS_PER_CANDIDATE = int(os.getenv("PROMPT_TOKENS_PER_CANDIDATE", "16"))
+
+# Listening event ingestion (music.ingest): events held in memory at most,
+# buffered events that trigger a write, seconds between writes of a partial
+# buffer, rows per write transaction and events per request
+INGEST_BUFFER_ROWS = int(os.getenv("INGEST_BUFFER_ROWS", "200000"))
+INGEST_FLUSH_ROWS = 10000
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))
+INGEST_CHUNK_SIZE = 5000
+INGEST_MAX_EVENTS = 50000
+
+# Fold ingested listens into the taste profiles as they are written. This
+# costs more than the inserts themselves; turned off, profiles catch up when
+# the rebuild_profiles command runs.
+INGEST_UPDATE_PROFILES = os.getenv("INGEST_UPDATE_PROFILES", "1") == "1"
+
+# Seconds an event's listened_at may lie in the future, for client clock skew
+INGEST_MAX_CLOCK_SKEW = 300
+
+# Age in seconds after which the cached user and song ids are reloaded when an
+# event references an unknown one (rows from bulk_create send no signals)
+INGEST_IDS_MAX_AGE = 60
+
+# Ask the chat completions API for JSON matching a strict schema (music.schemas).
+# Turn off for OpenAI-compatible servers without structured output support.
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1") == "1"
+
+# Age in days after which a listen counts half in a user's taste profile
+TASTE_PROFILE_HALF_LIFE_DAYS = 30
+
+# Days of raw listening history to keep. The compact_history command rolls older
+# listens up into per-day counts (music.compaction) and deletes them.
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "90"))
+
+# Cache of parsed LLM responses keyed on the normalized prompt and model.
+# BACKEND is "memory" (per-process LRU), "django" (the CACHES alias in ALIAS,
+# shared across workers) or "none".
+LLM_CACHE = {
+    'BACKEND': os.getenv("LLM_CACHE_BACKEND", "memory"),
+    'TTL': 3600,
+    'MAX_ENTRIES': 1024,
+    'ALIAS': 'default',
+}
+
 CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
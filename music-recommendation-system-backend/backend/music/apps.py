@@ -10,3 +10,7 @@ class MusicConfig(AppConfig):
     """
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'music'
+
+    def ready(self):
+        """Connect signal handlers that keep in-memory indexes in sync with the database and time queries."""
+        from . import browse, feedback, ingest, metrics, profiles, recommender  # noqa: F401
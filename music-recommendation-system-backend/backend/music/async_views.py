@@ -0,0 +1,341 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404
+from django.views import View
+
+from . import llm, metrics, schemas
+from .auth import averify_password, request_user_id, token_error, token_payload
+from .batch import batch_jobs, recommend_batch
+from .conditional import cache_headers, etag_matches, history_version, not_modified, recommendation_etag
+from .deadline import (
+    CIRCUIT_OPEN, LLMUnavailable, arecommend_within, astream_events, get_breaker, mark_degraded,
+)
+from .feedback import skipped_ids
+from .grounding import get_grounding_index, ground_items
+from .models import User
+from .recommender import recommend_song_ids, songs_in_order
+from .renderers import dumps, json_response
+from .serializers import SongSerializer
+from .sse import asong_events, event_stream_response, wants_event_stream
+from .prompts import candidate_search_prompt, filtered_prompt, rerank_prompt, search_prompt
+from .views import (
+    fallback_filtered,
+    fallback_recommendations,
+    fallback_search,
+    filtered_songs,
+    fresh_precomputed,
+    get_time_of_day,
+    local_recommendations,
+    merge_ranking,
+    search_candidates,
+    time_of_day_prompt,
+)
+
+# Async counterparts of the recommendation views in views.py. Served under ASGI
+# (backend/asgi.py) they wait on the LLM without holding a worker thread; the
+# number of outstanding LLM requests is capped by settings.LLM_MAX_CONCURRENCY
+# and concurrent identical prompts share a single upstream request. LLM calls
+# have the same deadlines, circuit breaker and local fallbacks as the sync
+# views (music.deadline).
+
+
+def _vector_songs(user, current_time_of_day, k=20):
+    return songs_in_order(recommend_song_ids(user, current_time_of_day, k=k))
+
+
+def _songs_response(request, songs):
+    if wants_event_stream(request):
+        return event_stream_response(asong_events(songs))
+    return json_response({"recommended_songs": songs})
+
+
+def _degraded_response(request, songs, reason):
+    metrics.count_fallback(reason)
+    if wants_event_stream(request):
+        response = event_stream_response(asong_events(songs))
+    else:
+        response = json_response({"recommended_songs": songs, "degraded": True})
+    return mark_degraded(response, reason)
+
+
+async def _aground(songs, skipped):
+    # Grounding only reads the in-memory index, so just building it needs a thread
+    index = await sync_to_async(get_grounding_index)()
+    seen = set()
+    async for song in songs:
+        for grounded in ground_items([song], skipped, index):
+            song_id = grounded.get("id") if isinstance(grounded, dict) else None
+            if song_id is None or song_id not in seen:
+                seen.add(song_id)
+                yield grounded
+
+
+async def _respond(request, prompt, endpoint, fallback, skipped=()):
+    grounding = settings.LLM_GROUNDING
+    if wants_event_stream(request):
+        breaker = get_breaker()
+        if not breaker.allow():
+            return _degraded_response(request, await sync_to_async(fallback)(), CIRCUIT_OPEN)
+        songs = llm.astream_recommend(prompt)
+        if grounding:
+            songs = _aground(songs, skipped)
+        return event_stream_response(astream_events(breaker, songs, fallback))
+
+    try:
+        recommendations = await arecommend_within(prompt, endpoint)
+    except LLMUnavailable as exc:
+        return _degraded_response(request, await sync_to_async(fallback)(), exc.reason)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Failed to parse recommendations as JSON"}, status=400)
+    if grounding:
+        recommendations = await sync_to_async(ground_items)(recommendations, skipped)
+    return json_response({"recommended_songs": recommendations})
+
+
+class AsyncLoginView(View):
+    """
+    Async variant of LoginView.
+
+    The password hash is verified on the bounded hashing pool of music.auth,
+    so slow key derivation never blocks the event loop.
+
+    POST (JSON):
+        - username: str
+        - password: str
+
+    Returns:
+        - 200 OK with user_id and a bearer token if credentials are valid.
+        - 400 if the body is invalid or the credentials are wrong.
+        - 404 if the user does not exist.
+    """
+
+    async def post(self, request):
+        try:
+            body = json.loads(request.body or b"{}")
+            username, password = body.get("username"), body.get("password")
+        except (json.JSONDecodeError, AttributeError):
+            return JsonResponse({"error": "Request body must be a JSON object."}, status=400)
+
+        user = await aget_object_or_404(User, username=username)
+        if not isinstance(password, str):
+            return JsonResponse({"error": "Invalid credentials"}, status=400)
+        valid, rehashed = await averify_password(password, user.password)
+        if not valid:
+            return JsonResponse({"error": "Invalid credentials"}, status=400)
+        if rehashed:
+            await User.objects.filter(pk=user.pk).aupdate(password=rehashed)
+        return JsonResponse(token_payload(user), status=200)
+
+
+class AsyncRecommendationView(View):
+    """
+    Async variant of RecommendationView.
+
+    GET:
+        - user_id: int
+
+    Returns:
+        - 200 OK with a list of recommended songs in JSON.
+        - 200 OK text/event-stream of "song" events and a final "done" event when
+          requested with Accept: text/event-stream or ?format=sse.
+        - 304 Not Modified, without recomputing, when If-None-Match holds the
+          current ETag (see music.conditional); JSON responses carry ETag and
+          Cache-Control.
+        - 200 OK with "degraded": true and an X-Degraded header, not cacheable,
+          when the LLM misses settings.LLM_DEADLINES["recommendations"] or is
+          unavailable.
+        - 400 if recommendation parsing fails.
+    """
+
+    async def get(self, request, user_id):
+        denied = token_error(request, user_id)
+        if denied:
+            return JsonResponse({"error": denied[1]}, status=denied[0])
+        user = await aget_object_or_404(User.objects.annotate(history_version=history_version()), id=user_id)
+        current_time_of_day = get_time_of_day()
+
+        if wants_event_stream(request):
+            return await self.recommend(request, user, current_time_of_day)
+        etag = await sync_to_async(recommendation_etag)(user, current_time_of_day)
+        if etag_matches(request, etag):
+            return not_modified(request, etag, current_time_of_day)
+        response = await self.recommend(request, user, current_time_of_day)
+        return cache_headers(request, response, etag, current_time_of_day)
+
+    async def recommend(self, request, user, current_time_of_day):
+        precomputed = await sync_to_async(fresh_precomputed)(user, current_time_of_day)
+        if precomputed is not None:
+            return _songs_response(request, precomputed.songs)
+
+        backend = settings.RECOMMENDER_BACKEND
+        if backend == "hybrid":
+            candidates = await sync_to_async(_vector_songs)(
+                user, current_time_of_day, k=settings.RECOMMENDER_RERANK_TOP_K
+            )
+            try:
+                ranked_ids = await arecommend_within(
+                    rerank_prompt(candidates, current_time_of_day), "recommendations", kind=schemas.IDS,
+                )
+            except json.JSONDecodeError:
+                ranked_ids = []
+            except LLMUnavailable as exc:
+                songs = merge_ranking(candidates, [])
+                return _degraded_response(request, SongSerializer(songs, many=True).data, exc.reason)
+            songs = merge_ranking(candidates, ranked_ids)
+            return _songs_response(request, SongSerializer(songs, many=True).data)
+
+        songs = await sync_to_async(local_recommendations)(user, current_time_of_day)
+        if songs is not None:
+            return _songs_response(request, songs)
+
+        prompt = await sync_to_async(time_of_day_prompt)(user, current_time_of_day)
+        return await _respond(
+            request, prompt, "recommendations", lambda: fallback_recommendations(user, current_time_of_day),
+            await sync_to_async(skipped_ids)(user),
+        )
+
+
+class AsyncFilteredRecommendationView(View):
+    """
+    Async variant of FilteredRecommendationView.
+
+    GET:
+        - user_id: int
+        - genre: str (optional)
+        - mood: str (optional)
+
+    Returns:
+        - 200 OK with filtered recommendations.
+        - 200 OK text/event-stream of "song" events and a final "done" event when
+          requested with Accept: text/event-stream or ?format=sse.
+        - 304 Not Modified, without recomputing, when If-None-Match holds the
+          current ETag (see music.conditional); JSON responses carry ETag and
+          Cache-Control.
+        - 200 OK with "degraded": true and an X-Degraded header, not cacheable,
+          when the LLM misses settings.LLM_DEADLINES["filter"] or is unavailable.
+        - 400 if no filters or JSON parsing fails.
+    """
+
+    async def get(self, request, user_id):
+        denied = token_error(request, user_id)
+        if denied:
+            return JsonResponse({"error": denied[1]}, status=denied[0])
+        user = await aget_object_or_404(User.objects.annotate(history_version=history_version()), id=user_id)
+        genre = request.GET.get("genre")
+        mood = request.GET.get("mood")
+
+        if not genre and not mood:
+            return JsonResponse({"error": "At least one filter (genre or mood) is required."}, status=400)
+
+        if wants_event_stream(request):
+            return await self.recommend(request, user, genre, mood)
+        current_time_of_day = get_time_of_day()
+        etag = await sync_to_async(recommendation_etag)(user, current_time_of_day, genre=genre, mood=mood)
+        if etag_matches(request, etag):
+            return not_modified(request, etag, current_time_of_day)
+        response = await self.recommend(request, user, genre, mood)
+        return cache_headers(request, response, etag, current_time_of_day)
+
+    async def recommend(self, request, user, genre, mood):
+        songs = await sync_to_async(filtered_songs)(user, genre, mood)
+        return await _respond(
+            request, filtered_prompt(songs, genre, mood), "filter", lambda: fallback_filtered(user, genre, mood, songs),
+            await sync_to_async(skipped_ids)(user),
+        )
+
+
+class AsyncSearchRecommendationView(View):
+    """
+    Async variant of SearchRecommendationView.
+
+    POST:
+        - query: str (e.g., "Relaxing music for evening walks")
+
+    Returns:
+        - 200 OK with song recommendations based on query.
+        - 200 OK text/event-stream of "song" events and a final "done" event when
+          requested with Accept: text/event-stream or ?format=sse.
+        - 200 OK with "degraded": true and an X-Degraded header when the LLM
+          misses settings.LLM_DEADLINES["search"] or is unavailable.
+        - 400 if query is missing or parsing fails.
+    """
+
+    async def post(self, request):
+        try:
+            query = json.loads(request.body or b"{}").get("query", "")
+        except (json.JSONDecodeError, AttributeError):
+            return JsonResponse({"error": "Request body must be a JSON object."}, status=400)
+
+        if not query:
+            return JsonResponse({"error": "Query is required."}, status=400)
+
+        mode = settings.SEARCH_MODE
+        skipped = await sync_to_async(skipped_ids)(request_user_id(request))
+        if mode == "llm":
+            return await _respond(
+                request, search_prompt(query), "search", lambda: fallback_search(query, skipped), skipped,
+            )
+
+        candidates = await sync_to_async(search_candidates)(query, skipped)
+        if mode == "local":
+            return _songs_response(request, SongSerializer(candidates, many=True).data)
+        return await _respond(
+            request, candidate_search_prompt(query, candidates), "search",
+            lambda: SongSerializer(candidates[:20], many=True).data, skipped,
+        )
+
+
+class AsyncBatchRecommendationView(View):
+    """
+    Recommendations for many users in one request.
+
+    POST (JSON):
+        - user_ids: list[int], at most settings.BATCH_MAX_USERS
+        - genre: str (optional)
+        - mood: str (optional)
+        - concurrency: int (optional), LLM calls in flight, capped by
+          settings.BATCH_MAX_CONCURRENCY
+
+    Returns:
+        - 200 OK application/x-ndjson, one line per user as soon as it is done:
+          {"user_id", "recommended_songs"} or {"user_id", "status", "error"}
+          for users that are unknown or whose recommendation failed. Users
+          the LLM could not answer for within settings.LLM_DEADLINES["batch"]
+          get local recommendations with "degraded": true.
+        - 400 if the body is invalid.
+        - 401/403 if a token is missing while required, invalid, or issued
+          for a user other than every one in user_ids.
+    """
+
+    async def post(self, request):
+        try:
+            body = json.loads(request.body or b"{}")
+            user_ids = list(dict.fromkeys(int(user_id) for user_id in body.get("user_ids", [])))
+            concurrency = int(body.get("concurrency") or settings.BATCH_MAX_CONCURRENCY)
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+            return JsonResponse({"error": "Request body must be a JSON object with a list of user_ids."}, status=400)
+
+        if not user_ids:
+            return JsonResponse({"error": "user_ids is required."}, status=400)
+        if len(user_ids) > settings.BATCH_MAX_USERS:
+            return JsonResponse({"error": f"At most {settings.BATCH_MAX_USERS} user_ids per request."}, status=400)
+        # A token only covers its own user, like on the single-user endpoints
+        for user_id in user_ids:
+            denied = token_error(request, user_id)
+            if denied:
+                return JsonResponse({"error": denied[1]}, status=denied[0])
+
+        genre, mood = body.get("genre"), body.get("mood")
+        jobs = await sync_to_async(batch_jobs)(user_ids, get_time_of_day(), genre, mood)
+        concurrency = max(1, min(concurrency, settings.BATCH_MAX_CONCURRENCY))
+
+        async def lines():
+            async for result in recommend_batch(jobs, concurrency):
+                yield dumps(result) + b"\n"
+
+        response = StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+        response["X-Accel-Buffering"] = "no"
+        return response
@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core import signing
+
+# Login and request authentication. Password verification is deliberately slow
+# (PBKDF2 with hundreds of thousands of iterations), so it runs once per login
+# on a bounded thread pool, and the signed token returned by the login views
+# authenticates later requests with a single HMAC instead.
+
+TOKEN_SALT = "music.auth.token"
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def get_hasher_pool():
+    """
+    Return the process-wide executor for password hashing.
+
+    hashlib releases the GIL while deriving keys, so up to
+    settings.PASSWORD_HASHING_WORKERS logins hash in parallel on separate cores
+    while the event loop keeps serving other requests. Further logins queue.
+
+    Returns:
+        ThreadPoolExecutor: The executor.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_WORKERS, thread_name_prefix="password-hasher"
+            )
+        return _pool
+
+
+def verify_password(raw_password, encoded):
+    """
+    Check a password against its stored hash, rehashing it if outdated.
+
+    When the hash was produced by a non-preferred hasher or with other
+    parameters than the current ones (e.g. fewer PBKDF2 iterations after a
+    Django upgrade), a new hash is computed with the current settings.
+
+    Args:
+        raw_password (str): The password given by the client.
+        encoded (str): The stored hash.
+
+    Returns:
+        tuple[bool, str | None]: Whether the password matches, and the new hash
+        to store if it must be updated.
+    """
+    rehashed = []
+    valid = check_password(raw_password, encoded, setter=lambda raw: rehashed.append(make_password(raw)))
+    return valid, rehashed[0] if valid and rehashed else None
+
+
+async def averify_password(raw_password, encoded):
+    """Run verify_password() on the hashing pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hasher_pool(), verify_password, raw_password, encoded)
+
+
+def _signer():
+    return signing.TimestampSigner(salt=TOKEN_SALT)
+
+
+def issue_token(user):
+    """
+    Create a signed token identifying a user.
+
+    Args:
+        user (User): The authenticated user.
+
+    Returns:
+        str: "<user id>:<timestamp>:<signature>", valid for settings.AUTH_TOKEN_MAX_AGE.
+    """
+    return _signer().sign(str(user.id))
+
+
+def token_payload(user):
+    """
+    Build the body of a successful login response.
+
+    Args:
+        user (User): The authenticated user.
+
+    Returns:
+        dict: The user id, a bearer token and its lifetime in seconds.
+    """
+    return {"user_id": user.id, "token": issue_token(user), "expires_in": settings.AUTH_TOKEN_MAX_AGE}
+
+
+def verify_token(token):
+    """
+    Return the user id a token was issued for.
+
+    Args:
+        token (str): Token from issue_token().
+
+    Returns:
+        int: The user id.
+
+    Raises:
+        signing.BadSignature: If the token was tampered with or has expired.
+    """
+    return int(_signer().unsign(token, max_age=settings.AUTH_TOKEN_MAX_AGE))
+
+
+def request_token(request):
+    """Return the bearer token of a request, or None without an Authorization header."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return token.strip()
+
+
+def token_error(request, user_id):
+    """
+    Check that a request may act for a user.
+
+    A request carrying a bearer token must carry a valid one issued to that
+    user. Requests without a token are let through unless
+    settings.AUTH_TOKEN_REQUIRED is set.
+
+    Args:
+        request (HttpRequest): The request.
+        user_id (int): The user the request is for.
+
+    Returns:
+        tuple[int, str] | None: HTTP status and error message, or None if allowed.
+    """
+    token = request_token(request)
+    if token is None:
+        if settings.AUTH_TOKEN_REQUIRED:
+            return 401, "Authentication token required"
+        return None
+    try:
+        token_user_id = verify_token(token)
+    except (signing.BadSignature, ValueError):
+        return 401, "Invalid or expired authentication token"
+    if token_user_id != user_id:
+        return 403, "Token was issued for another user"
+    return None
+
+
+def request_user_id(request):
+    """
+    Return the user a request's bearer token was issued for, if any.
+
+    For endpoints open to anonymous requests, which personalize results for
+    signed-in users.
+
+    Args:
+        request (HttpRequest): The request.
+
+    Returns:
+        int | None: The user id, or None without a valid token.
+    """
+    token = request_token(request)
+    if token is None:
+        return None
+    try:
+        return verify_token(token)
+    except (signing.BadSignature, ValueError):
+        return None
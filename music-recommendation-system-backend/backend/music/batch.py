@@ -0,0 +1,177 @@
+import asyncio
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import metrics
+from .deadline import LLMUnavailable, arecommend_within
+from .feedback import get_feedback_cache
+from .grounding import ground_items
+from .models import TasteProfile, User, latest_listened_songs_per_user
+from .prompts import filtered_prompt, history_prompt, taste_prompt
+from .views import fallback_filtered, fallback_recommendations, filtered_songs
+
+# Recommendations for many users in one request. Prompts for the whole batch
+# are built from a constant number of queries, then LLM calls fan out with a
+# bounded number in flight and results are reported as each user finishes.
+# Each call gets settings.LLM_DEADLINES["batch"] seconds and goes through the
+# shared circuit breaker; users whose call misses it, fails or is skipped get
+# the local fallback of the matching single-user view, marked as degraded.
+
+
+def batch_prompts(user_ids, current_time_of_day, genre=None, mood=None):
+    """
+    Build the recommendation prompt of every user in a batch.
+
+    Without filters the prompts match RecommendationView's, read from the
+    users' taste profiles; users without one fall back to their recent history
+    in the slot. With a genre and/or mood they match FilteredRecommendationView's.
+    Either way history is loaded in one windowed query for the whole batch.
+
+    Args:
+        user_ids (list[int]): Users to recommend for.
+        current_time_of_day (str): One of "Morning", "Afternoon", or "Evening".
+        genre (str): Genre filter, optional.
+        mood (str): Mood filter, optional.
+
+    Returns:
+        dict[int, str]: Prompt per existing user; unknown ids are left out.
+    """
+    known = set(User.objects.filter(id__in=user_ids).values_list("id", flat=True))
+
+    if genre or mood:
+        songs = latest_listened_songs_per_user(known, genre=genre, mood=mood)
+        return {user_id: filtered_prompt(songs.get(user_id, []), genre, mood) for user_id in known}
+
+    tastes = {
+        taste.user_id: taste
+        for taste in TasteProfile.objects.filter(user_id__in=known, time_of_day=current_time_of_day)
+    }
+    missing = known - tastes.keys()
+    songs = latest_listened_songs_per_user(missing, time_of_day=current_time_of_day)
+    return {
+        user_id: taste_prompt(tastes[user_id], current_time_of_day) if user_id in tastes
+        else history_prompt(songs.get(user_id, []), current_time_of_day)
+        for user_id in known
+    }
+
+
+def batch_skipped(user_ids):
+    """
+    Load the skipped songs of every user in a batch.
+
+    Args:
+        user_ids (list[int]): Existing users.
+
+    Returns:
+        dict[int, set[int]]: Skipped song ids per user, from one query for the
+        users missing from the feedback cache.
+    """
+    feedback = get_feedback_cache().get_many(user_ids)
+    return {user_id: set(songs.skipped.tolist()) for user_id, songs in feedback.items()}
+
+
+def batch_fallback(user_id, current_time_of_day, genre=None, mood=None):
+    """
+    Recommend without the LLM for one user of a batch.
+
+    Args:
+        user_id (int): The user.
+        current_time_of_day (str): One of "Morning", "Afternoon", or "Evening".
+        genre (str): Genre filter, optional.
+        mood (str): Mood filter, optional.
+
+    Returns:
+        list[dict]: Songs from views.fallback_filtered() with a filter,
+        views.fallback_recommendations() without.
+    """
+    user = User(id=user_id)
+    if genre or mood:
+        return fallback_filtered(user, genre, mood, filtered_songs(user, genre, mood))
+    return fallback_recommendations(user, current_time_of_day)
+
+
+def batch_jobs(user_ids, current_time_of_day, genre=None, mood=None):
+    """
+    Prepare the recommendation jobs of a batch for recommend_batch().
+
+    Args:
+        user_ids (list[int]): Users to recommend for.
+        current_time_of_day (str): One of "Morning", "Afternoon", or "Evening".
+        genre (str): Genre filter, optional.
+        mood (str): Mood filter, optional.
+
+    Returns:
+        list[tuple]: (user_id, prompt, skipped, fallback) per user, see recommend_for().
+    """
+    prompts = batch_prompts(user_ids, current_time_of_day, genre, mood)
+    skipped = batch_skipped(list(prompts))
+    return [
+        (
+            user_id, prompts.get(user_id), skipped.get(user_id, ()),
+            functools.partial(batch_fallback, user_id, current_time_of_day, genre, mood),
+        )
+        for user_id in user_ids
+    ]
+
+
+async def recommend_for(user_id, prompt, skipped, fallback):
+    """
+    Get one user's recommendations, turning failures into an error result.
+
+    Args:
+        user_id (int): The user.
+        prompt (str): Their prompt, or None if the user does not exist.
+        skipped (Collection[int]): Their skipped songs, dropped after grounding.
+        fallback (Callable[[], list[dict]]): Computes local recommendations when
+            the LLM is unavailable; run in a worker thread.
+
+    Returns:
+        dict: {"user_id", "recommended_songs"}, with "degraded": true for
+        fallback songs, or {"user_id", "status", "error"}.
+    """
+    if prompt is None:
+        return {"user_id": user_id, "status": 404, "error": "User not found."}
+    try:
+        songs = await arecommend_within(prompt, "batch")
+        if settings.LLM_GROUNDING:
+            songs = await sync_to_async(ground_items)(songs, skipped)
+    except LLMUnavailable as exc:
+        metrics.count_fallback(exc.reason)
+        return {"user_id": user_id, "recommended_songs": await sync_to_async(fallback)(), "degraded": True}
+    except json.JSONDecodeError:
+        return {"user_id": user_id, "status": 502, "error": "Failed to parse recommendations as JSON"}
+    except Exception:
+        return {"user_id": user_id, "status": 502, "error": "Recommendation request failed"}
+    return {"user_id": user_id, "recommended_songs": songs}
+
+
+async def recommend_batch(jobs, concurrency):
+    """
+    Run recommendation jobs with at most `concurrency` in flight.
+
+    Args:
+        jobs (list[tuple]): (user_id, prompt, skipped, fallback) tuples, see
+            batch_jobs() and recommend_for().
+        concurrency (int): Maximum simultaneous jobs.
+
+    Yields:
+        dict: Each user's result from recommend_for(), in completion order.
+    """
+    results = asyncio.Queue()
+    pending = iter(jobs)
+
+    async def worker():
+        for job in pending:
+            results.put_nowait(await recommend_for(*job))
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(jobs))))]
+    try:
+        for _ in range(len(jobs)):
+            yield await results.get()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
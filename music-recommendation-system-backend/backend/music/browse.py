@@ -0,0 +1,182 @@
+import base64
+import binascii
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import GENRES, MOODS, Song
+
+# Catalog browsing. Songs are listed by descending popularity with keyset
+# pagination: a cursor holds the (popularity, id) of the last song returned and
+# the next page starts right after it, so every page is one range scan of the
+# song_*_popularity_idx index matching the filters, however deep it is. Genre
+# and mood counts for the filter UI come from one GROUP BY, cached per process
+# until a song is saved or deleted there, and for at most
+# settings.FACETS_CACHE_TTL seconds so that bulk inserts and changes made by
+# other workers, which send no signal here, show up too.
+
+# Page order; id breaks ties between songs of equal popularity
+ORDERING = ("-popularity", "-id")
+
+
+def encode_cursor(song):
+    """
+    Build the opaque cursor of the page that follows a song.
+
+    Args:
+        song (Song): Last song of the current page.
+
+    Returns:
+        str: URL-safe cursor.
+    """
+    raw = json.dumps([song.popularity, song.id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor):
+    """
+    Read a cursor built by encode_cursor().
+
+    Args:
+        cursor (str): The cursor.
+
+    Returns:
+        tuple[int, int]: Popularity and id of the last song of the previous page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        popularity, song_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor.") from exc
+    if not isinstance(popularity, int) or not isinstance(song_id, int):
+        raise ValueError("Invalid cursor.")
+    return popularity, song_id
+
+
+def song_page(genre=None, mood=None, cursor=None, limit=50):
+    """
+    Fetch one page of songs by descending popularity.
+
+    Args:
+        genre (str): Keep only this genre, optional.
+        mood (str): Keep only this mood, optional.
+        cursor (str): Cursor from the previous page, None for the first page.
+        limit (int): Songs per page.
+
+    Returns:
+        tuple[list[Song], str | None]: The songs and the cursor of the next
+        page, None on the last page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    songs = Song.objects.all()
+    if genre:
+        songs = songs.filter(genre=genre)
+    if mood:
+        songs = songs.filter(mood=mood)
+    if cursor:
+        popularity, song_id = decode_cursor(cursor)
+        # The redundant popularity__lte lets the database seek into the index
+        # instead of scanning it from the top to evaluate the OR
+        songs = songs.filter(Q(popularity__lt=popularity) | Q(id__lt=song_id), popularity__lte=popularity)
+    # One extra row tells whether there is a next page
+    page = list(songs.order_by(*ORDERING)[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
+
+
+def popular_songs(genre=None, mood=None, exclude=(), limit=20):
+    """
+    Fetch the most popular songs matching filters.
+
+    Args:
+        genre (str): Keep only this genre, optional.
+        mood (str): Keep only this mood, optional.
+        exclude (Collection[int]): Ids of songs to leave out.
+        limit (int): Number of songs.
+
+    Returns:
+        list[Song]: Up to `limit` songs by descending popularity.
+    """
+    songs = Song.objects.all()
+    if genre:
+        songs = songs.filter(genre=genre)
+    if mood:
+        songs = songs.filter(mood=mood)
+    # Excluded ids are dropped here rather than in SQL, so the query stays one
+    # range scan of the popularity index
+    page = songs.order_by(*ORDERING)[:limit + len(exclude)]
+    return [song for song in page if song.id not in exclude][:limit]
+
+
+class Facets:
+    """
+    Song counts per genre, per mood and per genre/mood pair.
+
+    Attributes:
+        total (int): Number of songs.
+        genres (dict[str, int]): Songs per genre, every GENRES entry included.
+        moods (dict[str, int]): Songs per mood, every MOODS entry included.
+        genre_moods (dict[str, dict[str, int]]): Songs per mood within each genre,
+            only non-zero counts.
+    """
+
+    def __init__(self, rows):
+        self.genres = dict.fromkeys(GENRES, 0)
+        self.moods = dict.fromkeys(MOODS, 0)
+        self.genre_moods = {}
+        for genre, mood, count in rows:
+            self.genres[genre] = self.genres.get(genre, 0) + count
+            self.moods[mood] = self.moods.get(mood, 0) + count
+            self.genre_moods.setdefault(genre, {})[mood] = count
+        self.total = sum(self.genres.values())
+
+    @classmethod
+    def from_database(cls):
+        return cls(Song.objects.values_list("genre", "mood").annotate(count=Count("id")).order_by())
+
+    def as_dict(self):
+        return {"total": self.total, "genres": self.genres, "moods": self.moods, "genre_moods": self.genre_moods}
+
+
+_lock = threading.Lock()
+_facets = None
+_counted_at = None
+
+
+def get_facets():
+    """
+    Return the process-wide facet counts, counting them on first use and once expired.
+
+    Returns:
+        Facets: Counts at most settings.FACETS_CACHE_TTL seconds old.
+    """
+    global _facets, _counted_at
+    with _lock:
+        ttl = settings.FACETS_CACHE_TTL
+        if _facets is None or (ttl and time.monotonic() - _counted_at >= ttl):
+            _facets = Facets.from_database()
+            _counted_at = time.monotonic()
+        return _facets
+
+
+def invalidate_facets():
+    """Drop the cached counts so the next request recounts them."""
+    global _facets
+    with _lock:
+        _facets = None
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def _song_changed(sender, **kwargs):
+    invalidate_facets()
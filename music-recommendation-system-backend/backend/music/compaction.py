@@ -0,0 +1,86 @@
+from collections import Counter
+
+from django.db import connections, router, transaction
+
+from .models import ListeningDailyCount, ListeningHistory, time_of_day_for_hour
+
+# Retention for listening history. Raw ListeningHistory rows older than the
+# retention window are rolled up into ListeningDailyCount, one row per user,
+# song, day and time-of-day slot, and deleted. Every batch adds its counts and
+# deletes its rows in one transaction, so an interrupted run loses nothing and
+# the next run simply continues with the rows that are left.
+
+
+def roll_up(rows):
+    """
+    Count listens per user, song, day and time-of-day slot.
+
+    Args:
+        rows (Iterable[tuple[int, int, datetime]]): (user_id, song_id, listened_at) rows.
+
+    Returns:
+        Counter: (user_id, song_id, day, time_of_day) to number of listens.
+    """
+    return Counter(
+        (user_id, song_id, listened_at.date(), time_of_day_for_hour(listened_at.hour))
+        for user_id, song_id, listened_at in rows
+    )
+
+
+def add_counts(counts):
+    """
+    Add listen counts to ListeningDailyCount, creating missing rows.
+
+    A single executemany() of INSERT ... ON CONFLICT DO UPDATE adds to existing
+    rows in place, so the current counts are never read into Python and
+    concurrent compactions cannot lose each other's additions.
+
+    Args:
+        counts (Counter): (user_id, song_id, day, time_of_day) to number of listens.
+    """
+    database = router.db_for_write(ListeningDailyCount)
+    connection = connections[database]
+    meta = ListeningDailyCount._meta
+    quote = connection.ops.quote_name
+    columns = [quote(meta.get_field(name).column) for name in ("user", "song", "day", "time_of_day", "plays")]
+    unique = ", ".join(quote(meta.get_field(name).column) for name in ("user", "time_of_day", "day", "song"))
+    plays = columns[-1]
+    sql = (
+        f"INSERT INTO {quote(meta.db_table)} ({', '.join(columns)}) VALUES (%s, %s, %s, %s, %s) "
+        f"ON CONFLICT ({unique}) DO UPDATE SET {plays} = {quote(meta.db_table)}.{plays} + excluded.{plays}"
+    )
+    day_field = meta.get_field("day")
+    params = [
+        (user_id, song_id, day_field.get_db_prep_save(day, connection), time_of_day, count)
+        for (user_id, song_id, day, time_of_day), count in counts.items()
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def compact_history(cutoff, batch_size=10000):
+    """
+    Roll up and delete the listens older than cutoff, in id order.
+
+    Args:
+        cutoff (datetime): Listens before this instant are compacted.
+        batch_size (int): Raw rows per transaction.
+
+    Yields:
+        int: Number of raw rows compacted so far, after each batch.
+    """
+    after, done = 0, 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                ListeningHistory.objects.filter(id__gt=after, listened_at__lt=cutoff).order_by("id").values_list(
+                    "id", "user_id", "song_id", "listened_at"
+                )[:batch_size]
+            )
+            if not rows:
+                return
+            add_counts(roll_up(row[1:] for row in rows))
+            ListeningHistory.objects.filter(id__in=[row[0] for row in rows]).delete()
+        after = rows[-1][0]
+        done += len(rows)
+        yield done
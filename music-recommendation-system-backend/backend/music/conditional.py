@@ -0,0 +1,139 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.timezone import now
+
+from .deadline import DEGRADED_HEADER
+from .feedback import get_feedback
+from .models import TIME_OF_DAY_HOURS, ListeningHistory
+
+# Conditional GET for the recommendation views. Their weak ETag is derived from
+# what a recommendation depends on and is cheap to know up front: the user's
+# history version (newest ListeningHistory id, read in the same query as the
+# user), the time-of-day slot, the backend, the filters and the user's liked
+# and skipped songs, which every backend leaves out of its recommendations. A poll that presents the
+# current ETag in If-None-Match gets a 304 before any recommendation work.
+# Catalog changes are not part of the ETag; Cache-Control max-age bounds how
+# long a response is reused without revalidation.
+
+
+def history_version():
+    """
+    Build the expression of a user's history version, to annotate User querysets.
+
+    Returns:
+        Subquery: Newest ListeningHistory id of the user, None without history.
+    """
+    return Subquery(ListeningHistory.objects.filter(user=OuterRef("pk")).order_by("-id").values("id")[:1])
+
+
+def recommendation_etag(user, time_of_day, **params):
+    """
+    Derive the ETag of a user's recommendations.
+
+    Args:
+        user (User): The user, annotated with history_version().
+        time_of_day (str): The time-of-day slot.
+        **params: Request parameters the recommendations depend on, e.g. filters.
+
+    Returns:
+        str: A weak ETag, quoted.
+    """
+    backend = settings.RECOMMENDER_BACKEND
+    parts = [user.pk, user.history_version or 0, time_of_day, backend, sorted(params.items())]
+    feedback = get_feedback(user)
+    parts.append(hashlib.blake2b(feedback.liked.tobytes() + b"|" + feedback.skipped.tobytes()).hexdigest())
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request, etag):
+    """
+    Tell whether the request's If-None-Match holds an ETag, by weak comparison.
+
+    Args:
+        request (HttpRequest): The request.
+        etag (str): The current ETag.
+
+    Returns:
+        bool: True if the client's copy is current.
+    """
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(candidate.removeprefix("W/") == current for candidate in parse_etags(header))
+
+
+def max_age(time_of_day, moment=None):
+    """
+    Seconds a response may be reused: until the slot ends, at most
+    settings.RECOMMENDATION_MAX_AGE.
+
+    Args:
+        time_of_day (str): The slot the response is for.
+        moment (datetime): The current time, now() by default.
+
+    Returns:
+        int: Seconds, 0 once the slot is over.
+    """
+    moment = moment or now()
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    remaining = (midnight + timedelta(hours=TIME_OF_DAY_HOURS[time_of_day][1]) - moment).total_seconds()
+    return max(0, min(settings.RECOMMENDATION_MAX_AGE, int(remaining)))
+
+
+def cache_headers(request, response, etag, time_of_day):
+    """
+    Set ETag, Cache-Control and Vary on a successful response.
+
+    Degraded responses (see music.deadline) are left uncacheable and without
+    an ETag, so the next poll gets the LLM's answer once it is available.
+
+    Responses to requests carrying an Authorization header are private; the
+    others are per-user by URL and may be stored by shared caches.
+
+    Args:
+        request (HttpRequest): The request.
+        response (HttpResponse): The response, left untouched unless it is a
+            200 that is not degraded.
+        etag (str): The ETag from recommendation_etag().
+        time_of_day (str): The slot the response is for.
+
+    Returns:
+        HttpResponse: The response.
+    """
+    if response.status_code == 200 and not response.has_header(DEGRADED_HEADER):
+        _set_cache_headers(request, response, etag, time_of_day)
+    return response
+
+
+def _set_cache_headers(request, response, etag, time_of_day):
+    response["ETag"] = etag
+    visibility = {"private": True} if "Authorization" in request.headers else {"public": True}
+    patch_cache_control(response, max_age=max_age(time_of_day), **visibility)
+    patch_vary_headers(response, ["Accept", "Authorization"])
+
+
+def not_modified(request, etag, time_of_day):
+    """
+    Build the 304 answer to a request whose copy is current.
+
+    Args:
+        request (HttpRequest): The request.
+        etag (str): The current ETag.
+        time_of_day (str): The slot the response is for.
+
+    Returns:
+        HttpResponseNotModified: The response, with the headers of a 200.
+    """
+    response = HttpResponseNotModified()
+    _set_cache_headers(request, response, etag, time_of_day)
+    return response
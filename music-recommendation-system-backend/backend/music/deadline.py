@@ -0,0 +1,343 @@
+import asyncio
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import llm, metrics, schemas
+from .sse import format_event
+
+# Latency budget for the LLM-backed recommendation views. Each call to the LLM
+# is bounded by the deadline of its endpoint in settings.LLM_DEADLINES; a call
+# that misses it is left running, so its completion still fills the LLM
+# response cache for the next request, while the view answers at once with a
+# local fallback marked as degraded. Timeouts and API errors feed a
+# process-wide circuit breaker: after settings.LLM_BREAKER["FAILURES"]
+# consecutive ones the LLM is skipped altogether, and every
+# settings.LLM_BREAKER["RESET_TIMEOUT"] seconds a single request is let
+# through to probe whether it has recovered. Streamed responses have no
+# deadline but go through the same breaker, and switch to the fallback songs
+# if the LLM fails mid-stream.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Reasons for serving a fallback, in the X-Degraded header and the metrics
+TIMEOUT = "timeout"
+ERROR = "error"
+CIRCUIT_OPEN = "circuit_open"
+
+DEGRADED_HEADER = "X-Degraded"
+
+BREAKER_DEFAULTS = {"FAILURES": 5, "RESET_TIMEOUT": 30.0}
+
+
+class LLMUnavailable(Exception):
+    """
+    The LLM could not answer within the deadline, failed or is skipped by the breaker.
+
+    Attributes:
+        reason (str): TIMEOUT, ERROR or CIRCUIT_OPEN.
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Closed, every call is allowed. After `failures` consecutive failures it
+    opens and rejects calls for `reset_timeout` seconds, then lets one probe
+    call through (half-open): its success closes the breaker, its failure
+    opens it again for another `reset_timeout`.
+
+    Args:
+        failures (int): Consecutive failures that open the breaker.
+        reset_timeout (float): Seconds the breaker stays open before a probe.
+        clock (Callable[[], float]): Monotonic time source.
+    """
+
+    def __init__(self, failures=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.consecutive_failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return CLOSED
+            if self._probing or self.clock() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return OPEN
+
+    def allow(self):
+        """
+        Tell whether a call may go to the LLM, claiming the probe when one is due.
+
+        Returns:
+            bool: False while open, and while half-open with the probe in flight.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or self.clock() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        """Close the breaker and reset the failure count."""
+        with self._lock:
+            self.consecutive_failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        """Count a failure, opening the breaker on a failed probe or at the threshold."""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._probing or self.consecutive_failures >= self.failures:
+                self._opened_at = self.clock()
+                self._probing = False
+
+
+_lock = threading.Lock()
+_breaker = None
+_executor = None
+
+
+def get_breaker():
+    """
+    Return the process-wide circuit breaker, creating it on first use.
+
+    Returns:
+        CircuitBreaker: Breaker configured by settings.LLM_BREAKER.
+    """
+    global _breaker
+    with _lock:
+        if _breaker is None:
+            config = {**BREAKER_DEFAULTS, **getattr(settings, "LLM_BREAKER", {})}
+            _breaker = CircuitBreaker(config["FAILURES"], config["RESET_TIMEOUT"])
+        return _breaker
+
+
+def reset_breaker():
+    """Forget the breaker so the next get_breaker() starts closed with current settings."""
+    global _breaker
+    with _lock:
+        _breaker = None
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+        return _executor
+
+
+def deadline(endpoint):
+    """
+    Return the LLM latency budget of an endpoint.
+
+    Args:
+        endpoint (str): A key of settings.LLM_DEADLINES, e.g. "recommendations".
+
+    Returns:
+        float | None: Seconds, or None to wait for the LLM indefinitely.
+    """
+    return settings.LLM_DEADLINES.get(endpoint) or None
+
+
+def recommend_within(prompt, endpoint, kind=schemas.SONGS):
+    """
+    Call llm.recommend() within the deadline of an endpoint, guarded by the breaker.
+
+    The call runs on a shared thread pool; past the deadline the request stops
+    waiting but the call completes in the background and caches its result.
+
+    Args:
+        prompt (str): The prompt to send.
+        endpoint (str): Key of settings.LLM_DEADLINES.
+        kind (str): schemas.SONGS or schemas.IDS.
+
+    Returns:
+        list: Recommended items, see llm.recommend().
+
+    Raises:
+        LLMUnavailable: On timeout, API error or while the breaker is open.
+        json.JSONDecodeError: If the completion does not contain an array.
+
+    Any other exception is counted as a failure by the breaker and re-raised.
+    """
+    breaker = get_breaker()
+    if not breaker.allow():
+        raise LLMUnavailable(CIRCUIT_OPEN)
+    future = _get_executor().submit(contextvars.copy_context().run, llm.recommend, prompt, None, kind)
+    try:
+        recommendations = future.result(timeout=deadline(endpoint))
+    except FutureTimeout:
+        breaker.record_failure()
+        raise LLMUnavailable(TIMEOUT) from None
+    except json.JSONDecodeError:
+        # The LLM answered; an unusable completion is not an outage
+        breaker.record_success()
+        raise
+    except openai.APIError as exc:
+        breaker.record_failure()
+        raise LLMUnavailable(ERROR) from exc
+    except BaseException:
+        # Cancelled or failed unexpectedly: still settle the call, or a probe
+        # would keep the breaker half-open forever
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return recommendations
+
+
+async def arecommend_within(prompt, endpoint, kind=schemas.SONGS):
+    """
+    Async variant of recommend_within().
+
+    llm.arecommend() shields the upstream request from its callers, so a call
+    past the deadline keeps running for the other waiters and the cache.
+
+    Args:
+        prompt (str): The prompt to send.
+        endpoint (str): Key of settings.LLM_DEADLINES.
+        kind (str): schemas.SONGS or schemas.IDS.
+
+    Returns:
+        list: Recommended items, see llm.arecommend().
+
+    Raises:
+        LLMUnavailable: On timeout, API error or while the breaker is open.
+        json.JSONDecodeError: If the completion does not contain an array.
+    """
+    breaker = get_breaker()
+    if not breaker.allow():
+        raise LLMUnavailable(CIRCUIT_OPEN)
+    try:
+        recommendations = await asyncio.wait_for(llm.arecommend(prompt, kind=kind), deadline(endpoint))
+    except asyncio.TimeoutError:
+        breaker.record_failure()
+        raise LLMUnavailable(TIMEOUT) from None
+    except json.JSONDecodeError:
+        breaker.record_success()
+        raise
+    except openai.APIError as exc:
+        breaker.record_failure()
+        raise LLMUnavailable(ERROR) from exc
+    except BaseException:
+        # Cancelled or failed unexpectedly: still settle the call, or a probe
+        # would keep the breaker half-open forever
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return recommendations
+
+
+def stream_events(breaker, songs, fallback):
+    """
+    Encode the songs of an LLM stream as events, settling the breaker when it ends.
+
+    Like sse.song_events(), for a stream the breaker allowed. The LLM is only
+    called once the response is under way, so a stream failing with an API
+    error or timeout cannot change the response status: a "degraded" event
+    with the reason and the songs of `fallback` follow the songs already sent,
+    and the response still ends with a "done" event.
+
+    Args:
+        breaker (CircuitBreaker): The breaker whose allow() admitted the stream.
+        songs (Iterable[dict]): Songs, typically from llm.stream_recommend().
+        fallback (Callable[[], list[dict]]): Computes local recommendations.
+
+    Yields:
+        str: Encoded events.
+    """
+    count = 0
+    try:
+        for song in songs:
+            count += 1
+            yield format_event("song", song)
+    except openai.APIError:
+        breaker.record_failure()
+        metrics.count_fallback(ERROR)
+        yield format_event("degraded", {"reason": ERROR})
+        for song in fallback():
+            count += 1
+            yield format_event("song", song)
+    except BaseException:
+        # Includes the client going away mid-stream
+        breaker.record_failure()
+        raise
+    else:
+        breaker.record_success()
+    yield format_event("done", {"count": count})
+
+
+async def astream_events(breaker, songs, fallback):
+    """
+    Async variant of stream_events().
+
+    Args:
+        breaker (CircuitBreaker): The breaker whose allow() admitted the stream.
+        songs (AsyncIterable[dict]): Songs, typically from llm.astream_recommend().
+        fallback (Callable[[], list[dict]]): Computes local recommendations; run
+            in a worker thread.
+
+    Yields:
+        str: Encoded events.
+    """
+    count = 0
+    try:
+        async for song in songs:
+            count += 1
+            yield format_event("song", song)
+    except openai.APIError:
+        breaker.record_failure()
+        metrics.count_fallback(ERROR)
+        yield format_event("degraded", {"reason": ERROR})
+        for song in await sync_to_async(fallback)():
+            count += 1
+            yield format_event("song", song)
+    except BaseException:
+        breaker.record_failure()
+        raise
+    else:
+        breaker.record_success()
+    yield format_event("done", {"count": count})
+
+
+def mark_degraded(response, reason):
+    """
+    Mark a response as served from a local fallback.
+
+    Sets the X-Degraded header to the reason and forbids storing the response,
+    so clients and caches ask again once the LLM is back.
+
+    Args:
+        response (HttpResponse): The fallback response.
+        reason (str): TIMEOUT, ERROR or CIRCUIT_OPEN.
+
+    Returns:
+        HttpResponse: The response.
+    """
+    response[DEGRADED_HEADER] = reason
+    response["Cache-Control"] = "no-store"
+    return response
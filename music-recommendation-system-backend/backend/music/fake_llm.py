@@ -0,0 +1,248 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+from .models import GENRES, MOODS
+
+SHAPES = ["json", "prose", "invalid"]
+
+
+def fake_songs(count, rng=random):
+    """
+    Generate song dicts shaped like the LLM's recommendations.
+
+    Args:
+        count (int): Number of songs.
+        rng (random.Random): Source of randomness.
+
+    Returns:
+        list[dict]: Songs with title, artist, genre and mood.
+    """
+    return [
+        {
+            "title": f"Fake Song {rng.randrange(100000)}",
+            "artist": f"Fake Artist {rng.randrange(500)}",
+            "genre": rng.choice(GENRES),
+            "mood": rng.choice(MOODS),
+        }
+        for _ in range(count)
+    ]
+
+
+class FakeLLMServer:
+    """
+    Local stand-in for the OpenAI chat completions endpoint.
+
+    Answers POST .../chat/completions after a configurable delay with a completion
+    whose content is a JSON array of songs. Requests with "stream": true get the
+    content as chat.completion.chunk events, the first after `latency` and the
+    rest `chunk_delay` apart. Point the app at it with
+    OPENAI_BASE_URL=<server.base_url>.
+
+    Attributes:
+        latency (float): Base delay in seconds before answering.
+        jitter (float): Extra uniformly distributed delay in seconds.
+        shape (str): "json" for a bare array, "prose" for an array wrapped in text,
+            "invalid" for content without a parseable array.
+        songs (int): Number of songs per completion.
+        chunk_size (int): Characters per streamed chunk.
+        chunk_delay (float): Delay in seconds between streamed chunks.
+        token_latency (float): Extra delay in seconds per prompt token, modelling
+            the time an LLM spends reading its input.
+        requests (int): Number of completions served so far.
+        prompt_tokens (int): Prompt tokens received so far, about four characters each.
+        peak_in_flight (int): Highest number of completions pending at once.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.5, jitter=0.0, shape="json", songs=20,
+                 chunk_size=16, chunk_delay=0.01, token_latency=0.0, seed=None):
+        if shape not in SHAPES:
+            raise ValueError(f"shape must be one of {SHAPES}")
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.shape = shape
+        self.songs = songs
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.token_latency = token_latency
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._rng = random.Random(seed)
+        self._server = None
+        self._writers = set()
+        self._handlers = set()
+        self._loop = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def delay(self, prompt_tokens=0):
+        """Return the delay for the next request, in seconds."""
+        return self.latency + self._rng.uniform(0, self.jitter) + prompt_tokens * self.token_latency
+
+    def content(self):
+        """Return the completion text for the next request."""
+        songs = json.dumps(fake_songs(self.songs, self._rng))
+        if self.shape == "prose":
+            return f"Sure! Here are some songs you might enjoy:\n```json\n{songs}\n```\nHappy listening!"
+        if self.shape == "invalid":
+            return "Sorry, I can't recommend [anything] right now."
+        return songs
+
+    def completion(self, model, prompt=""):
+        """Build a chat completion payload, counting about four characters per token."""
+        content = self.content()
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+        return {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def chunk(self, model, content=None, finish_reason=None):
+        """Build a chat.completion.chunk payload."""
+        delta = {"content": content} if content is not None else {}
+        return {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    async def _stream(self, writer, model):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+
+        async def send(data):
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+
+        content = self.content()
+        for i in range(0, len(content), self.chunk_size):
+            if i:
+                await asyncio.sleep(self.chunk_delay)
+            piece = self.chunk(model, content[i:i + self.chunk_size])
+            await send(f"data: {json.dumps(piece)}\n\n".encode())
+        await send(f"data: {json.dumps(self.chunk(model, finish_reason='stop'))}\n\n".encode())
+        await send(b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+                    request = json.loads(body or b"{}")
+                    prompt = "".join(str(m.get("content", "")) for m in request.get("messages", []))
+                    self.requests += 1
+                    self.prompt_tokens += len(prompt) // 4
+                    self.in_flight += 1
+                    self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                    try:
+                        await asyncio.sleep(self.delay(len(prompt) // 4))
+                        if request.get("stream"):
+                            await self._stream(writer, request.get("model", "fake"))
+                            continue
+                    finally:
+                        self.in_flight -= 1
+                    status, payload = "200 OK", self.completion(request.get("model", "fake"), prompt)
+                else:
+                    status, payload = "404 Not Found", {"error": {"message": "Not found"}}
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def serve(self):
+        """Start listening on the event loop of the caller."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        """
+        Run the server on its own event loop in a daemon thread.
+
+        Returns:
+            str: The base URL to use as OPENAI_BASE_URL.
+        """
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.base_url
+
+    async def shutdown(self):
+        """Stop accepting connections and wait for open ones to finish."""
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    def stop(self):
+        """Stop a server started with start()."""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,286 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.signals import m2m_changed, post_delete
+from django.dispatch import receiver
+
+from .models import PrecomputedRecommendation, User
+
+# Per-user liked and skipped songs as sorted id arrays. Song ids are sparse
+# compared to the catalog, so a sorted array costs a few bytes per song where a
+# bitmap over the catalog would cost catalog size / 8 per user; membership of a
+# whole candidate array is one vectorized searchsorted. Users are loaded on
+# first use into a process-wide LRU of settings.FEEDBACK_CACHE_USERS entries
+# and dropped from it, along with their precomputed recommendations, whenever
+# their liked_songs or skipped_songs change. Those signals only reach the
+# process making the change, so entries also expire after
+# settings.FEEDBACK_CACHE_TTL seconds: a change made by another worker, or
+# behind the ORM's back, shows up within that delay everywhere, including in
+# the recommendation ETags of music.conditional.
+
+LIKED = 0
+SKIPPED = 1
+
+
+def _id_array(*groups):
+    song_ids = np.concatenate([np.sort(np.asarray(list(group), dtype=np.int64)) for group in groups])
+    if len(song_ids) and song_ids.max() <= np.iinfo(np.uint32).max and song_ids.min() >= 0:
+        return song_ids.astype(np.uint32)
+    return song_ids
+
+
+def _contains(sorted_ids, song_ids):
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    if not len(sorted_ids) or not len(song_ids):
+        return np.zeros(len(song_ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_ids, song_ids), len(sorted_ids) - 1)
+    return sorted_ids[pos] == song_ids
+
+
+class SongFeedback:
+    """
+    A user's liked and skipped songs.
+
+    Both sets share one array, liked ids then skipped ids, each part sorted and
+    stored as uint32 when the ids fit, which halves the per-user overhead of
+    two separate arrays.
+
+    Attributes:
+        liked (np.ndarray): Sorted liked song ids.
+        skipped (np.ndarray): Sorted skipped song ids.
+    """
+
+    __slots__ = ("_ids", "_split")
+
+    def __init__(self, liked=(), skipped=()):
+        liked = list(liked)
+        self._ids = _id_array(liked, skipped)
+        self._split = len(liked)
+
+    @property
+    def liked(self):
+        return self._ids[:self._split]
+
+    @property
+    def skipped(self):
+        return self._ids[self._split:]
+
+    def is_liked(self, song_ids):
+        """
+        Tell which songs are liked.
+
+        Args:
+            song_ids (array-like): Song ids.
+
+        Returns:
+            np.ndarray: One bool per id.
+        """
+        return _contains(self.liked, song_ids)
+
+    def is_skipped(self, song_ids):
+        """
+        Tell which songs are skipped.
+
+        Args:
+            song_ids (array-like): Song ids.
+
+        Returns:
+            np.ndarray: One bool per id.
+        """
+        return _contains(self.skipped, song_ids)
+
+
+# Shared by users without likes or skips
+EMPTY = SongFeedback()
+
+
+def load_feedback(user_ids):
+    """
+    Load the liked and skipped songs of users in a single query.
+
+    Args:
+        user_ids (Iterable[int]): The users.
+
+    Returns:
+        dict[int, SongFeedback]: One entry per user id, EMPTY for users
+        without likes or skips.
+    """
+    user_ids = list(user_ids)
+    liked = User.liked_songs.through.objects.filter(user_id__in=user_ids).values_list(
+        "user_id", "song_id"
+    ).annotate(kind=Value(LIKED))
+    skipped = User.skipped_songs.through.objects.filter(user_id__in=user_ids).values_list(
+        "user_id", "song_id"
+    ).annotate(kind=Value(SKIPPED))
+    songs = {}
+    for user_id, song_id, kind in liked.union(skipped, all=True):
+        songs.setdefault(user_id, ([], []))[kind].append(song_id)
+    return {
+        user_id: SongFeedback(*songs[user_id]) if user_id in songs else EMPTY
+        for user_id in user_ids
+    }
+
+
+class FeedbackCache:
+    """
+    Least recently used cache of SongFeedback per user id, with expiry.
+
+    Args:
+        max_users (int): Most users kept; the least recently used are evicted.
+        ttl (float): Seconds a user's feedback is kept after loading it, None
+            to keep it until discarded.
+        clock (Callable[[], float]): Monotonic time source.
+    """
+
+    def __init__(self, max_users, ttl=None, clock=time.monotonic):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, user_ids):
+        """
+        Return the feedback of users, loading the missing ones in one query.
+
+        Args:
+            user_ids (Iterable[int]): The users.
+
+        Returns:
+            dict[int, SongFeedback]: Feedback per user id.
+        """
+        found, missing = {}, []
+        with self._lock:
+            now = self._clock()
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry is None or entry[0] <= now:
+                    missing.append(user_id)
+                else:
+                    self._entries.move_to_end(user_id)
+                    found[user_id] = entry[1]
+        if missing:
+            loaded = load_feedback(missing)
+            found.update(loaded)
+            self._store(loaded)
+        return found
+
+    def _store(self, loaded):
+        with self._lock:
+            expires_at = math.inf if self.ttl is None else self._clock() + self.ttl
+            for user_id, feedback in loaded.items():
+                self._entries[user_id] = (expires_at, feedback)
+                self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id):
+        """
+        Return the feedback of one user.
+
+        Args:
+            user_id (int): The user.
+
+        Returns:
+            SongFeedback: The user's liked and skipped songs.
+        """
+        return self.get_many([user_id])[user_id]
+
+    def discard(self, user_ids=None):
+        """
+        Drop users from the cache, or every user when user_ids is None.
+
+        Args:
+            user_ids (Iterable[int]): Users whose feedback changed.
+        """
+        with self._lock:
+            if user_ids is None:
+                self._entries.clear()
+            else:
+                for user_id in user_ids:
+                    self._entries.pop(user_id, None)
+
+
+_lock = threading.Lock()
+_cache = None
+
+
+def get_feedback_cache():
+    """
+    Return the process-wide feedback cache, creating it on first use.
+
+    Returns:
+        FeedbackCache: Cache sized by settings.FEEDBACK_CACHE_USERS, expiring
+        entries after settings.FEEDBACK_CACHE_TTL.
+    """
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = FeedbackCache(settings.FEEDBACK_CACHE_USERS, settings.FEEDBACK_CACHE_TTL or None)
+        return _cache
+
+
+def get_feedback(user):
+    """
+    Return a user's liked and skipped songs.
+
+    Args:
+        user (User | int): The user or its id.
+
+    Returns:
+        SongFeedback: The user's feedback.
+    """
+    return get_feedback_cache().get(getattr(user, "pk", user))
+
+
+def skipped_ids(user):
+    """
+    Return a user's skipped songs as a set, to check LLM results one by one.
+
+    Args:
+        user (User | int | None): The user or its id; None for anonymous requests.
+
+    Returns:
+        set[int]: Skipped song ids, empty for None.
+    """
+    return set() if user is None else set(get_feedback(user).skipped.tolist())
+
+
+def invalidate_feedback(user_ids=None):
+    """
+    Drop cached feedback so the next lookup reloads it.
+
+    Args:
+        user_ids (Iterable[int]): Users to drop, all users by default.
+    """
+    with _lock:
+        cache = _cache
+    if cache is not None:
+        cache.discard(user_ids)
+
+
+@receiver(m2m_changed, sender=User.liked_songs.through)
+@receiver(m2m_changed, sender=User.skipped_songs.through)
+def _feedback_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    # Changed from the song's side, pk_set holds the users, or is None after
+    # clear(), when the affected users are unknown
+    user_ids = pk_set if reverse else {instance.pk}
+    invalidate_feedback(user_ids)
+    if user_ids:
+        # Precomputed recommendations may contain a song that is now skipped
+        PrecomputedRecommendation.objects.filter(user_id__in=user_ids).delete()
+
+
+@receiver(post_delete, sender=User)
+def _user_deleted(sender, instance, **kwargs):
+    invalidate_feedback([instance.pk])
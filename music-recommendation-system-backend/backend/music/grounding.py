@@ -0,0 +1,380 @@
+import re
+
+import numpy as np
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import stage
+from .models import Song
+from .rebuild import CatalogCache
+
+# Grounding resolves the free-form {"title", "artist"} dicts returned by the LLM
+# to rows of our Song table, through an in-memory character trigram index over
+# song titles. Candidates sharing the rarest trigrams of a title are re-scored
+# exactly on title and artist similarity. The index keeps the songs' fields, so
+# matches are serialized without a query, even one streamed item at a time.
+
+# Minimum combined similarity for an LLM item to be considered a catalog song
+MIN_SCORE = 0.6
+
+# Weight of the title in the combined score; the rest goes to the artist
+TITLE_WEIGHT = 0.75
+
+# Posting list entries and trigrams read per lookup, rarest trigrams first
+MAX_POSTINGS = 50_000
+MAX_GRAMS = 12
+
+# Candidates re-scored exactly per lookup
+CANDIDATES = 8
+
+_NON_WORD = re.compile(r"\W+")
+
+
+def normalize(text):
+    """Casefold text, collapse punctuation and pad it with spaces for edge trigrams."""
+    return f" {_NON_WORD.sub(' ', str(text).casefold()).strip()} "
+
+
+def trigrams(text):
+    """Return the set of character trigrams of already normalized text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(a, b):
+    """
+    Dice coefficient between the trigram sets of two normalized strings.
+
+    Args:
+        a (set[str] | str): Trigrams of, or the normalized, first string.
+        b (str): The normalized second string.
+
+    Returns:
+        float: Similarity in [0, 1].
+    """
+    a = a if isinstance(a, set) else trigrams(a)
+    b = trigrams(b)
+    if not a or not b:
+        return float(a == b)
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def item_title_artist(item):
+    """
+    Extract the title and artist from a song dict returned by the LLM.
+
+    Args:
+        item (dict): One recommended song, in whatever shape the model chose.
+
+    Returns:
+        tuple[str, str]: Title and artist, empty when missing.
+    """
+    if not isinstance(item, dict):
+        return "", ""
+    title = item.get("title") or item.get("song") or item.get("name") or ""
+    artist = item.get("artist") or item.get("artists") or item.get("by") or ""
+    if isinstance(artist, list):
+        artist = ", ".join(str(a) for a in artist)
+    return str(title), str(artist)
+
+
+class GroundingIndex:
+    """
+    Character trigram index over song titles.
+
+    Trigrams are packed from UTF-8 bytes into integers and their posting lists
+    stored as one sorted array of catalog positions, so the build is vectorized
+    and a lookup is a few binary searches and one np.unique over short slices.
+    Titles that match exactly after normalization skip the trigram search.
+    Titles and artists are kept as stored and normalized per candidate.
+
+    Attributes:
+        ids (np.ndarray): Song primary keys per position.
+        titles (list[str]): Titles per position.
+        artists (list[str]): Artists per position.
+        popularity (np.ndarray): Popularity per position, to break ties.
+        genre_names (np.ndarray): Distinct genres, indexed by genres.
+        genres (np.ndarray): Genre code per position.
+        mood_names (np.ndarray): Distinct moods, indexed by moods.
+        moods (np.ndarray): Mood code per position.
+        grams (np.ndarray): Sorted distinct trigram codes.
+        gram_offsets (np.ndarray): Posting list of grams[i] is postings[gram_offsets[i]:gram_offsets[i + 1]].
+        postings (np.ndarray): Catalog positions grouped by trigram.
+        gram_counts (np.ndarray): Distinct trigrams per title.
+        title_hashes (np.ndarray): Sorted hashes of the normalized titles, for exact matches.
+        title_order (np.ndarray): Catalog position per entry of title_hashes.
+    """
+
+    def __init__(self, ids, titles, artists, popularity, genres=None, moods=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.titles = list(titles)
+        self.artists = list(artists)
+        self.popularity = np.asarray(popularity, dtype=np.int64)
+        n = len(self.ids)
+        self.genre_names, self.genres = np.unique(np.asarray(genres or [""] * n, dtype=object), return_inverse=True)
+        self.mood_names, self.moods = np.unique(np.asarray(moods or [""] * n, dtype=object), return_inverse=True)
+
+        normalized = [normalize(t) for t in self.titles]
+        encoded = [t.encode() for t in normalized]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=n)
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.int64)
+        owner = np.repeat(np.arange(n, dtype=np.int64), lengths)
+        if len(data) >= 3:
+            codes = (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+            inside = owner[:-2] == owner[2:]
+            keys = np.sort(codes[inside] * max(n, 1) + owner[:-2][inside])
+            keys = keys[np.append(True, keys[1:] != keys[:-1])]
+        else:
+            keys = np.empty(0, dtype=np.int64)
+        self.postings = (keys % max(n, 1)).astype(np.int32)
+        codes = keys // max(n, 1)
+        starts = np.flatnonzero(np.append(True, codes[1:] != codes[:-1])) if len(codes) else np.empty(0, np.int64)
+        self.grams = codes[starts]
+        self.gram_offsets = np.append(starts, len(keys))
+        self.gram_counts = np.bincount(self.postings, minlength=n).astype(np.int32)
+        hashes = np.fromiter(map(hash, normalized), dtype=np.int64, count=n)
+        self.title_order = np.argsort(hashes, kind="stable")
+        self.title_hashes = hashes[self.title_order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_database(cls):
+        """
+        Index the full Song table.
+
+        Returns:
+            GroundingIndex: Index over the current catalog.
+        """
+        rows = list(
+            Song.objects.order_by("id").values_list("id", "title", "artist", "popularity", "genre", "mood")
+            .iterator(chunk_size=10000)
+        )
+        if not rows:
+            return cls([], [], [], [])
+        return cls(*zip(*rows))
+
+    def song(self, position):
+        """
+        Return the song at a catalog position, shaped like SongSerializer's output.
+
+        Args:
+            position (int): Catalog position, e.g. from match().
+
+        Returns:
+            dict: The song's id, title, artist, genre, mood and popularity.
+        """
+        return {
+            "id": int(self.ids[position]),
+            "title": self.titles[position],
+            "artist": self.artists[position],
+            "genre": self.genre_names[self.genres[position]],
+            "mood": self.mood_names[self.moods[position]],
+            "popularity": int(self.popularity[position]),
+        }
+
+    def exact(self, title):
+        """
+        Return the catalog positions whose normalized title equals `title`.
+
+        Args:
+            title (str): Normalized title.
+
+        Returns:
+            list[int]: Matching positions.
+        """
+        code = hash(title)
+        start = np.searchsorted(self.title_hashes, code)
+        end = np.searchsorted(self.title_hashes, code, side="right")
+        return [p for p in self.title_order[start:end].tolist() if normalize(self.titles[p]) == title]
+
+    def candidates(self, title, limit=CANDIDATES):
+        """
+        Return the catalog positions most likely to match a title.
+
+        Candidates are read from the posting lists of the title's rarest
+        trigrams and ranked by their estimated Dice coefficient.
+
+        Args:
+            title (str): Normalized title.
+            limit (int): Maximum number of candidates.
+
+        Returns:
+            np.ndarray: Candidate positions, best estimate first.
+        """
+        data = np.frombuffer(title.encode(), dtype=np.uint8).astype(np.int64)
+        if len(data) < 3 or not len(self.grams):
+            return np.empty(0, dtype=np.int32)
+        codes = np.unique((data[:-2] << 16) | (data[1:-1] << 8) | data[2:])
+        found = np.minimum(np.searchsorted(self.grams, codes), len(self.grams) - 1)
+        found = found[self.grams[found] == codes]
+        if not len(found):
+            return np.empty(0, dtype=np.int32)
+
+        starts, ends = self.gram_offsets[found], self.gram_offsets[found + 1]
+        order = np.argsort(ends - starts, kind="stable")
+        budget = np.cumsum((ends - starts)[order])
+        selected = order[:max(1, min(MAX_GRAMS, int(np.searchsorted(budget, MAX_POSTINGS, side="right"))))]
+        hits = np.concatenate([self.postings[starts[i]:ends[i]] for i in selected])
+        positions, counts = np.unique(hits, return_counts=True)
+        estimate = counts / (len(codes) + self.gram_counts[positions])
+        if len(positions) > limit:
+            top = np.argpartition(-estimate, limit)[:limit]
+            positions, estimate = positions[top], estimate[top]
+        return positions[np.argsort(-estimate, kind="stable")]
+
+    def resolve(self, title, artist=""):
+        """
+        Find the catalog song best matching a title and artist.
+
+        Args:
+            title (str): Song title as returned by the LLM.
+            artist (str): Artist as returned by the LLM, optional.
+
+        Returns:
+            int | None: The Song id, or None if nothing is similar enough.
+        """
+        position = self.match(title, artist)
+        return None if position is None else int(self.ids[position])
+
+    def match(self, title, artist=""):
+        """
+        Find the catalog position of the song best matching a title and artist.
+
+        Args:
+            title (str): Song title as returned by the LLM.
+            artist (str): Artist as returned by the LLM, optional.
+
+        Returns:
+            int | None: The position, or None if nothing is similar enough.
+        """
+        title = normalize(title)
+        artist = normalize(artist) if artist else ""
+        title_grams = trigrams(title)
+        artist_grams = trigrams(artist) if artist else None
+        best, best_key = None, (MIN_SCORE, -1)
+        candidates = self.exact(title) or self.candidates(title).tolist()
+        for position in candidates:
+            score = similarity(title_grams, normalize(self.titles[position]))
+            if artist_grams is not None:
+                score = TITLE_WEIGHT * score + (1 - TITLE_WEIGHT) * similarity(
+                    artist_grams, normalize(self.artists[position])
+                )
+            key = (score, int(self.popularity[position]))
+            if key >= best_key:
+                best, best_key = position, key
+            if score == 1.0:
+                break
+        return best
+
+
+_index = CatalogCache(GroundingIndex.from_database, "grounding-index")
+
+
+def get_grounding_index():
+    """
+    Return the process-wide grounding index, building it on first use.
+
+    Returns:
+        GroundingIndex: Index over the catalog, rebuilt in the background
+        after changes, see music.rebuild.
+    """
+    return _index.get()
+
+
+def invalidate_grounding_index():
+    """Drop the cached index so the next lookup rebuilds it."""
+    _index.reset()
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def _song_changed(sender, using=None, **kwargs):
+    _index.changed(using)
+
+
+def resolve_items(items):
+    """
+    Resolve LLM song dicts to Song ids.
+
+    Args:
+        items (list): Songs returned by the LLM.
+
+    Returns:
+        list[int | None]: Song id per item, None where no catalog song matched.
+    """
+    index = get_grounding_index()
+    return [None if position is None else int(index.ids[position]) for position in match_items(index, items)]
+
+
+def match_items(index, items):
+    """
+    Match LLM song dicts to catalog positions of a grounding index.
+
+    Args:
+        index (GroundingIndex): The index to search.
+        items (list): Songs returned by the LLM.
+
+    Returns:
+        list[int | None]: Position per item, None where no catalog song matched.
+    """
+    positions = []
+    for item in items:
+        title, artist = item_title_artist(item)
+        positions.append(index.match(title, artist) if title else None)
+    return positions
+
+
+def ground_items(items, exclude=(), index=None):
+    """
+    Replace LLM song dicts with the matching catalog songs.
+
+    Matched items are replaced by the song as kept in the grounding index, in
+    SongSerializer's shape, without querying the database; unmatched ones are
+    kept as returned with "id": None. Repeated matches of the same song and
+    matches of excluded songs are dropped.
+
+    Args:
+        items (list): Songs returned by the LLM.
+        exclude (Collection[int]): Ids of songs to drop, e.g. the user's skipped songs.
+        index (GroundingIndex): Index to match against, the process-wide one by default.
+
+    Returns:
+        list[dict]: The grounded songs, in the LLM's order.
+    """
+    with stage("ground"):
+        if index is None:
+            index = get_grounding_index()
+        grounded, seen = [], set()
+        for item, position in zip(items, match_items(index, items)):
+            if position is None:
+                grounded.append({**item, "id": None} if isinstance(item, dict) else item)
+                continue
+            song_id = int(index.ids[position])
+            if song_id not in seen and song_id not in exclude:
+                seen.add(song_id)
+                grounded.append(index.song(position))
+        return grounded
+
+
+def ground_stream(items, exclude=()):
+    """
+    Ground songs one by one as they are streamed from the LLM.
+
+    Each item is matched against the in-memory index alone, so streaming adds
+    no query per song.
+
+    Args:
+        items (Iterable): Songs as they are parsed from the completion.
+        exclude (Collection[int]): Ids of songs to drop, see ground_items().
+
+    Yields:
+        dict: Each grounded song, see ground_items().
+    """
+    seen = set()
+    for item in items:
+        for song in ground_items([item], exclude):
+            song_id = song.get("id") if isinstance(song, dict) else None
+            if song_id is None or song_id not in seen:
+                seen.add(song_id)
+                yield song
@@ -0,0 +1,446 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, close_old_connections, connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import metrics
+from .models import ListeningHistory, Song, User
+from .profiles import SongInfo, record_listens
+from .renderers import loads
+
+# Listening event ingestion. Requests are validated against cached sets of
+# known user and song ids and appended to a process-wide buffer; a background
+# thread writes the buffer in chunked transactions once it holds
+# settings.INGEST_FLUSH_ROWS events or every settings.INGEST_FLUSH_INTERVAL
+# seconds, folding the listens into the taste profiles. A request whose
+# events do not fit in the buffer is refused as a whole, so clients can retry
+# it without creating duplicates.
+
+logger = logging.getLogger(__name__)
+
+# Errors reported back per request; the rest are only counted
+MAX_REPORTED_ERRORS = 10
+
+# Seconds a flush waits before retrying after a database error
+RETRY_DELAY = 1.0
+
+# ListeningHistory fields written per event, in the order of the event tuples
+INSERT_FIELDS = ("user", "song", "listened_at")
+
+
+class KnownIds:
+    """
+    Sets of existing user and song ids, for validating events without queries.
+
+    Kept up to date by the User and Song receivers below; rows inserted with
+    bulk_create are picked up by reloading, see refresh_known_ids().
+    """
+
+    def __init__(self, user_ids, song_ids):
+        self.user_ids = set(user_ids)
+        self.song_ids = set(song_ids)
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_database(cls):
+        return cls(
+            User.objects.values_list("id", flat=True).iterator(chunk_size=10000),
+            Song.objects.values_list("id", flat=True).iterator(chunk_size=10000),
+        )
+
+
+_ids_lock = threading.Lock()
+_known_ids = None
+
+
+def get_known_ids():
+    """
+    Return the process-wide known id sets, loading them on first use.
+
+    Returns:
+        KnownIds: Current user and song ids.
+    """
+    global _known_ids
+    with _ids_lock:
+        if _known_ids is None:
+            _known_ids = KnownIds.from_database()
+        return _known_ids
+
+
+def invalidate_known_ids():
+    """Drop the cached id sets so the next lookup reloads them."""
+    global _known_ids
+    with _ids_lock:
+        _known_ids = None
+
+
+def refresh_known_ids(max_age):
+    """
+    Reload the known id sets if they are older than max_age seconds.
+
+    Returns:
+        KnownIds | None: The reloaded sets, or None if they were recent enough.
+    """
+    if time.monotonic() - get_known_ids().loaded_at < max_age:
+        return None
+    invalidate_known_ids()
+    return get_known_ids()
+
+
+def _update_known_ids(attribute, pk, add):
+    with _ids_lock:
+        if _known_ids is not None:
+            ids = getattr(_known_ids, attribute)
+            if add:
+                ids.add(pk)
+            else:
+                ids.discard(pk)
+
+
+@receiver(post_save, sender=User)
+def _user_saved(sender, instance, created, **kwargs):
+    if created:
+        _update_known_ids("user_ids", instance.pk, add=True)
+
+
+@receiver(post_delete, sender=User)
+def _user_deleted(sender, instance, **kwargs):
+    _update_known_ids("user_ids", instance.pk, add=False)
+
+
+@receiver(post_save, sender=Song)
+def _song_saved(sender, instance, created, **kwargs):
+    if created:
+        _update_known_ids("song_ids", instance.pk, add=True)
+
+
+@receiver(post_delete, sender=Song)
+def _song_deleted(sender, instance, **kwargs):
+    _update_known_ids("song_ids", instance.pk, add=False)
+
+
+def parse_timestamp(value):
+    """
+    Parse the listened_at of an event.
+
+    Args:
+        value (str | int | float | None): ISO 8601 text, Unix seconds, or None for now.
+
+    Returns:
+        datetime: Aware timestamp; naive ISO text is taken as UTC.
+
+    Raises:
+        ValueError: If the value is not a timestamp or lies in the future.
+    """
+    if value is None:
+        return datetime.now(timezone.utc)
+    if isinstance(value, bool):
+        raise ValueError("listened_at must be ISO 8601 text or Unix seconds")
+    if isinstance(value, (int, float)):
+        listened_at = datetime.fromtimestamp(value, timezone.utc)
+    elif isinstance(value, str):
+        listened_at = datetime.fromisoformat(value)
+        if listened_at.tzinfo is None:
+            listened_at = listened_at.replace(tzinfo=timezone.utc)
+    else:
+        raise ValueError("listened_at must be ISO 8601 text or Unix seconds")
+    if (listened_at - datetime.now(timezone.utc)).total_seconds() > settings.INGEST_MAX_CLOCK_SKEW:
+        raise ValueError("listened_at is in the future")
+    return listened_at
+
+
+def _decode(line):
+    event = loads(line)
+    user_id, song_id = event["user_id"], event["song_id"]
+    if type(user_id) is not int or type(song_id) is not int:
+        raise ValueError("user_id and song_id must be integers")
+    return user_id, song_id, parse_timestamp(event.get("listened_at"))
+
+
+def parse_events(lines):
+    """
+    Decode and validate NDJSON listening events.
+
+    Every line holds {"user_id", "song_id", "listened_at"}; listened_at is
+    optional and blank lines are skipped. Lines are decoded first, then their
+    ids checked in bulk against the known id sets, which are reloaded once if
+    some ids are unknown and the sets are older than settings.INGEST_IDS_MAX_AGE.
+
+    Args:
+        lines (Iterable[bytes | str]): The NDJSON lines.
+
+    Returns:
+        tuple[list[tuple[int, int, datetime]], int, list[dict]]: Valid
+        (user_id, song_id, listened_at) rows, the number of rejected lines,
+        and {"line", "error"} for the first MAX_REPORTED_ERRORS of them.
+    """
+    decoded, failures = [], []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            decoded.append((number, _decode(line)))
+        except KeyError as error:
+            failures.append((number, f"Missing field {error}"))
+        except (ValueError, TypeError, AttributeError, OverflowError) as error:
+            failures.append((number, str(error)))
+
+    known = get_known_ids()
+    users, songs = {row[0] for _, row in decoded}, {row[1] for _, row in decoded}
+    if not (users <= known.user_ids and songs <= known.song_ids):
+        known = refresh_known_ids(settings.INGEST_IDS_MAX_AGE) or known
+    unknown_users, unknown_songs = users - known.user_ids, songs - known.song_ids
+
+    rows = []
+    for number, row in decoded:
+        if row[0] in unknown_users:
+            failures.append((number, f"Unknown user_id {row[0]}"))
+        elif row[1] in unknown_songs:
+            failures.append((number, f"Unknown song_id {row[1]}"))
+        else:
+            rows.append(row)
+    failures.sort()
+    errors = [{"line": number, "error": error} for number, error in failures[:MAX_REPORTED_ERRORS]]
+    return rows, len(failures), errors
+
+
+def iter_lines(stream, chunk_size=1 << 16):
+    """
+    Split a binary stream into lines, reading it in large chunks.
+
+    Args:
+        stream: Object with a read(size) method, e.g. the request.
+        chunk_size (int): Bytes per read.
+
+    Yields:
+        bytes: Each line, without the trailing newline.
+    """
+    rest = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def write_rows(rows):
+    """
+    Insert listening history rows in one transaction, folding them into the
+    taste profiles when settings.INGEST_UPDATE_PROFILES is on.
+
+    Rows go in with a single executemany() of the model's INSERT, which on
+    SQLite is more than twice as fast as bulk_create() building an instance
+    per row. No post_save signals are sent.
+
+    Args:
+        rows (list[tuple[int, int, datetime]]): (user_id, song_id, listened_at) rows.
+    """
+    database = router.db_for_write(ListeningHistory)
+    connection = connections[database]
+    meta = ListeningHistory._meta
+    listened_at_field = meta.get_field("listened_at")
+    columns = ", ".join(connection.ops.quote_name(meta.get_field(name).column) for name in INSERT_FIELDS)
+    sql = f"INSERT INTO {connection.ops.quote_name(meta.db_table)} ({columns}) VALUES (%s, %s, %s)"
+    params = [
+        (user_id, song_id, listened_at_field.get_db_prep_save(listened_at, connection))
+        for user_id, song_id, listened_at in rows
+    ]
+    with transaction.atomic(using=database):
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+        if settings.INGEST_UPDATE_PROFILES:
+            song_ids = {song_id for _, song_id, _ in rows}
+            songs = {
+                song[0]: SongInfo(*song)
+                for song in Song.objects.filter(id__in=song_ids).values_list("id", "title", "artist", "genre", "mood")
+            }
+            record_listens(
+                (user_id, songs[song_id], listened_at) for user_id, song_id, listened_at in rows if song_id in songs
+            )
+
+
+def _refusal(rows):
+    """
+    Write rows with write_rows(), returning the error if the database refused them.
+
+    Raises:
+        OperationalError: If the database itself failed, e.g. it is locked or
+            unreachable, as opposed to refusing these rows.
+    """
+    try:
+        write_rows(rows)
+    except OperationalError:
+        raise
+    except DatabaseError as error:
+        return error
+    return None
+
+
+class IngestBuffer:
+    """
+    Bounded in-process buffer of listening events, written in the background.
+
+    Args:
+        capacity (int): Most events held, buffered or being written.
+        flush_rows (int): Buffered events that trigger a flush.
+        interval (float): Seconds between flushes of a partial buffer; None
+            disables the background thread and leaves flushing to the caller.
+        chunk_size (int): Rows per write_rows() transaction.
+    """
+
+    def __init__(self, capacity, flush_rows, interval, chunk_size):
+        self.capacity = capacity
+        self.flush_rows = flush_rows
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.rows = deque()
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.closed = False
+
+    def offer(self, rows):
+        """
+        Add a request's events, all or nothing.
+
+        Args:
+            rows (list[tuple[int, int, datetime]]): Validated rows.
+
+        Returns:
+            bool: False if the buffer has no room for them, in which case none were added.
+        """
+        with self.condition:
+            if self.pending + len(rows) > self.capacity:
+                return False
+            self.rows.extend(rows)
+            self.pending += len(rows)
+            if len(self.rows) >= self.flush_rows:
+                self.condition.notify()
+        if self.interval is not None and self.thread is None:
+            self.start()
+        return True
+
+    def flush(self):
+        """
+        Write every buffered event, one transaction per chunk_size rows.
+
+        A chunk the database refuses, e.g. with an integrity error, is written
+        again without the rows referencing users or songs deleted since
+        validation, and if that fails too, one row per transaction: rows still
+        refused on their own are logged and dropped rather than blocking the
+        buffer. If the database itself fails (OperationalError), the rows not
+        yet written go back to the front of the buffer and the error is raised.
+
+        Returns:
+            int: Number of rows written.
+        """
+        with self.flush_lock:
+            with self.condition:
+                rows = list(self.rows)
+                self.rows.clear()
+            written, dropped = 0, 0
+            try:
+                for offset in range(0, len(rows), self.chunk_size):
+                    chunk = rows[offset:offset + self.chunk_size]
+                    rest = rows[offset:]
+                    if _refusal(chunk) is None:
+                        written += len(chunk)
+                        continue
+                    invalidate_known_ids()
+                    known = get_known_ids()
+                    valid = [row for row in chunk if row[0] in known.user_ids and row[1] in known.song_ids]
+                    dropped += len(chunk) - len(valid)
+                    rest = valid + rows[offset + len(chunk):]
+                    if _refusal(valid) is None:
+                        written += len(valid)
+                        continue
+                    for index, row in enumerate(valid):
+                        rest = valid[index:] + rows[offset + len(chunk):]
+                        error = _refusal([row])
+                        if error is None:
+                            written += 1
+                        else:
+                            logger.warning("Dropping listening event %s: %s", row, error)
+                            dropped += 1
+            except DatabaseError:
+                with self.condition:
+                    self.rows.extendleft(reversed(rest))
+                    self.pending -= len(rows) - len(rest)
+                raise
+            else:
+                with self.condition:
+                    self.pending -= len(rows)
+            finally:
+                metrics.count_ingested("written", written)
+                metrics.count_ingested("dropped", dropped)
+            return written
+
+    def start(self):
+        """Start the background flushing thread, once."""
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="ingest-flusher", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Stop the background thread after writing what is buffered."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        deadline = time.monotonic() + self.interval
+        while True:
+            with self.condition:
+                while not self.closed and len(self.rows) < self.flush_rows and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+                closed = self.closed
+            deadline = time.monotonic() + self.interval
+            close_old_connections()
+            try:
+                self.flush()
+            except DatabaseError:
+                logger.exception("Writing listening events failed, retrying")
+                time.sleep(RETRY_DELAY)
+            if closed:
+                connections.close_all()
+                return
+
+
+_buffer_lock = threading.Lock()
+_buffer = None
+
+
+def get_ingest_buffer():
+    """
+    Return the process-wide ingestion buffer, creating it on first use.
+
+    Returns:
+        IngestBuffer: Buffer configured from the INGEST_* settings.
+    """
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = IngestBuffer(
+                capacity=settings.INGEST_BUFFER_ROWS,
+                flush_rows=settings.INGEST_FLUSH_ROWS,
+                interval=settings.INGEST_FLUSH_INTERVAL,
+                chunk_size=settings.INGEST_CHUNK_SIZE,
+            )
+        return _buffer
@@ -0,0 +1,118 @@
+import json
+import re
+
+# Characters that can change the parser state; everything else is copied as-is.
+_STRUCTURAL = re.compile(r'[\[\]{}",\\]')
+
+
+class ArrayStreamParser:
+    """
+    Incrementally decodes the elements of a JSON array embedded in streamed text.
+
+    Text is fed chunk by chunk as it arrives from the LLM. Anything before the first
+    '[' (prose, code fences) is ignored, and every top-level element is decoded as
+    soon as its closing ',' or ']' is seen, so songs can be emitted long before the
+    completion ends. Elements that fail to decode or are not JSON objects are
+    counted in `skipped` instead of failing the whole response; an element that is
+    still open when the stream ends is simply never emitted.
+
+    If an array closes without yielding a single object (e.g. "[20] songs:"), the
+    parser keeps scanning for the next one.
+
+    Attributes:
+        items (list[dict]): Objects decoded so far.
+        skipped (int): Number of malformed or non-object elements dropped.
+        done (bool): Whether the array holding the items has been closed.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.skipped = 0
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element = []
+
+    def feed(self, text):
+        """
+        Consume the next chunk of text.
+
+        Args:
+            text (str): The next piece of the completion.
+
+        Returns:
+            list[dict]: Objects completed by this chunk, in order.
+        """
+        completed = []
+        if self.done or not text:
+            return completed
+
+        start = 0  # beginning of the not yet copied part of `text`
+        skip_to = 0
+        if self._escape:
+            self._escape = False
+            skip_to = 1
+
+        for match in _STRUCTURAL.finditer(text):
+            i = match.start()
+            if i < skip_to:
+                continue
+            ch = text[i]
+
+            if self._depth == 0:
+                if ch == "[":
+                    self._depth = 1
+                    self._element = []
+                    start = i + 1
+                continue
+
+            if self._in_string:
+                if ch == "\\":
+                    if i + 1 < len(text):
+                        skip_to = i + 2
+                    else:
+                        self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 1 and ch in ",]":
+                self._element.append(text[start:i])
+                start = i + 1
+                self._finish_element(completed)
+                if ch == "]":
+                    self._depth = 0
+                    if self.items:
+                        self.done = True
+                        return completed
+                    # Not the song array; forget what it contained and keep looking.
+                    self.skipped = 0
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._depth += 1
+            elif ch in "]}" and self._depth > 1:
+                self._depth -= 1
+
+        if self._depth > 0:
+            self._element.append(text[start:])
+        return completed
+
+    def _finish_element(self, completed):
+        text = "".join(self._element).strip()
+        self._element = []
+        if not text:
+            return
+        try:
+            value = json.loads(text)
+        except ValueError:
+            self.skipped += 1
+            return
+        if isinstance(value, dict):
+            self.items.append(value)
+            completed.append(value)
+        else:
+            self.skipped += 1
@@ -0,0 +1,385 @@
+import asyncio
+import json
+import time
+import weakref
+
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+from . import metrics, schemas
+from .json_stream import ArrayStreamParser
+from .llm_cache import cache_key, get_cache
+
+_client = None
+_async_client = None
+
+
+def get_client():
+    """
+    Return the shared OpenAI client, creating it on first use.
+
+    Returns:
+        OpenAI: Client configured with the API key and timeout from settings.
+    """
+    global _client
+    if _client is None:
+        _client = OpenAI(
+            api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL, timeout=settings.LLM_TIMEOUT,
+        )
+    return _client
+
+
+def get_async_client():
+    """
+    Return the shared AsyncOpenAI client, creating it on first use.
+
+    Returns:
+        AsyncOpenAI: Client configured with the API key and timeout from settings.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL, timeout=settings.LLM_TIMEOUT,
+        )
+    return _async_client
+
+
+def _request(prompt, model, response_format, **kwargs):
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    return {"model": model or settings.OPENAI_MODEL, "messages": [{"role": "system", "content": prompt}], **kwargs}
+
+
+def complete(prompt, model=None, response_format=None):
+    """
+    Send a single system prompt to the chat completions API.
+
+    Args:
+        prompt (str): The prompt to send.
+        model (str): Model name, defaults to settings.OPENAI_MODEL.
+        response_format (dict): Structured output format, see schemas.response_format().
+
+    Returns:
+        str: The raw completion text.
+    """
+    started = time.perf_counter()
+    response = get_client().chat.completions.create(**_request(prompt, model, response_format))
+    metrics.observe_llm(time.perf_counter() - started, usage=getattr(response, "usage", None))
+    return response.choices[0].message.content
+
+
+def stream(prompt, model=None, response_format=None):
+    """
+    Stream a completion for a single system prompt.
+
+    Args:
+        prompt (str): The prompt to send.
+        model (str): Model name, defaults to settings.OPENAI_MODEL.
+        response_format (dict): Structured output format, see schemas.response_format().
+
+    Yields:
+        str: Pieces of the completion text as they arrive.
+    """
+    started = time.perf_counter()
+    response = get_client().chat.completions.create(**_request(prompt, model, response_format, stream=True))
+    try:
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        response.close()
+        metrics.observe_llm(time.perf_counter() - started, mode="stream")
+
+
+def parse_completion(content, kind=schemas.SONGS):
+    """
+    Decode and validate the items of a completion.
+
+    Args:
+        content (str): Raw completion text: a structured-output object, or an
+            array possibly wrapped in prose or code fences.
+        kind (str): schemas.SONGS or schemas.IDS.
+
+    Returns:
+        list: Valid items; items that cannot be repaired are dropped and counted.
+
+    Raises:
+        json.JSONDecodeError: If the completion holds no array at all.
+    """
+    with metrics.stage("parse"):
+        try:
+            items = schemas.extract_items(content, kind)
+        except json.JSONDecodeError:
+            metrics.count_parse_failure()
+            raise
+        valid, dropped = schemas.validate_items(items, kind)
+        if dropped:
+            metrics.count_dropped_items(dropped)
+        return valid
+
+
+def validated_songs(items):
+    """
+    Validate songs one by one as they are decoded from a stream.
+
+    Args:
+        items (Iterable): Decoded array elements.
+
+    Yields:
+        dict: Each valid or repaired song; others are dropped and counted.
+    """
+    for item in items:
+        song = schemas.validate_song(item)
+        if song is None:
+            metrics.count_dropped_items(1)
+        else:
+            yield song
+
+
+def recommend(prompt, model=None, kind=schemas.SONGS):
+    """
+    Ask the LLM for recommendations and decode the returned JSON array.
+
+    Decoded responses are memoized in the LLM response cache; completions that
+    fail to parse are never stored.
+
+    Args:
+        prompt (str): The prompt to send.
+        model (str): Model name, defaults to settings.OPENAI_MODEL.
+        kind (str): Expected items, schemas.SONGS ({"title", "artist"} dicts)
+            or schemas.IDS (song ids).
+
+    Returns:
+        list: Recommended items, validated against the schema.
+
+    Raises:
+        json.JSONDecodeError: If the completion does not contain an array.
+    """
+    model = model or settings.OPENAI_MODEL
+    cache = get_cache()
+    if cache is None:
+        return parse_completion(complete(prompt, model=model, response_format=schemas.response_format(kind)), kind)
+
+    key = cache_key(prompt, model)
+    recommendations = cache.get(key)
+    if recommendations is None:
+        content = complete(prompt, model=model, response_format=schemas.response_format(kind))
+        recommendations = parse_completion(content, kind)
+        cache.set(key, recommendations)
+    return recommendations
+
+
+def stream_recommend(prompt, model=None):
+    """
+    Streaming variant of recommend(), yielding songs as soon as each one is decoded.
+
+    A cached response is replayed at once. A streamed response is cached only if
+    its array was closed and no element had to be skipped.
+
+    Args:
+        prompt (str): The prompt to send.
+        model (str): Model name, defaults to settings.OPENAI_MODEL.
+
+    Yields:
+        dict: Recommended songs, in completion order.
+    """
+    model = model or settings.OPENAI_MODEL
+    key = cache_key(prompt, model)
+    cache = get_cache()
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        yield from cached
+        return
+
+    parser = ArrayStreamParser()
+    songs = []
+    for text in stream(prompt, model=model, response_format=schemas.response_format(schemas.SONGS)):
+        for song in validated_songs(parser.feed(text)):
+            songs.append(song)
+            yield song
+        if parser.done:
+            break
+    if not parser.done or parser.skipped:
+        metrics.count_parse_failure()
+    if cache is not None and parser.done and not parser.skipped:
+        cache.set(key, songs)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the work as a task; callers arriving while
+    it is still running await the same task instead of starting their own. The
+    task is shielded, so a cancelled caller does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def do(self, key, func):
+        """
+        Run `func()` once for all concurrent callers with the same key.
+
+        Args:
+            key (str): Identifies identical work.
+            func (Callable[[], Awaitable]): Coroutine factory doing the work.
+
+        Returns:
+            The result of the shared call.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away.
+            task.exception()
+
+
+class _LoopState:
+    """Concurrency primitives bound to a single event loop."""
+
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        self.flights = SingleFlight()
+
+
+_loop_states = weakref.WeakKeyDictionary()
+
+
+def _loop_state():
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None:
+        state = _loop_states[loop] = _LoopState()
+    return state
+
+
+async def acomplete(prompt, model=None, response_format=None):
+    """
+    Async variant of complete(), capped at settings.LLM_MAX_CONCURRENCY
+    outstanding requests per event loop.
+
+    Args:
+        prompt (str): The prompt to send.
+        model (str): Model name, defaults to settings.OPENAI_MODEL.
+        response_format (dict): Structured output format, see schemas.response_format().
+
+    Returns:
+        str: The raw completion text.
+    """
+    async with _loop_state().semaphore:
+        started = time.perf_counter()
+        response = await get_async_client().chat.completions.create(**_request(prompt, model, response_format))
+    metrics.observe_llm(time.perf_counter() - started, usage=getattr(response, "usage", None))
+    return response.choices[0].message.content
+
+
+async def arecommend(prompt, model=None, kind=schemas.SONGS):
+    """
+    Async variant of recommend().
+
+    Besides sharing the response cache, concurrent identical prompts are coalesced
+    so that they trigger a single upstream request.
+
+    Args:
+        prompt (str): The prompt to send.
+        model (str): Model name, defaults to settings.OPENAI_MODEL.
+        kind (str): Expected items, schemas.SONGS or schemas.IDS.
+
+    Returns:
+        list: Recommended items, validated against the schema.
+
+    Raises:
+        json.JSONDecodeError: If the completion does not contain an array.
+    """
+    model = model or settings.OPENAI_MODEL
+    key = cache_key(prompt, model)
+    cache = get_cache()
+    if cache is not None:
+        recommendations = await cache.aget(key)
+        if recommendations is not None:
+            return recommendations
+
+    async def fetch():
+        content = await acomplete(prompt, model=model, response_format=schemas.response_format(kind))
+        recommendations = parse_completion(content, kind)
+        if cache is not None:
+            await cache.aset(key, recommendations)
+        return recommendations
+
+    return await _loop_state().flights.do(key, fetch)
+
+
+async def astream(prompt, model=None, response_format=None):
+    """
+    Async variant of stream(), holding a concurrency slot until the stream ends.
+
+    Args:
+        prompt (str): The prompt to send.
+        model (str): Model name, defaults to settings.OPENAI_MODEL.
+        response_format (dict): Structured output format, see schemas.response_format().
+
+    Yields:
+        str: Pieces of the completion text as they arrive.
+    """
+    async with _loop_state().semaphore:
+        started = time.perf_counter()
+        response = await get_async_client().chat.completions.create(
+            **_request(prompt, model, response_format, stream=True)
+        )
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
+            metrics.observe_llm(time.perf_counter() - started, mode="stream")
+
+
+async def astream_recommend(prompt, model=None):
+    """
+    Async variant of stream_recommend().
+
+    Args:
+        prompt (str): The prompt to send.
+        model (str): Model name, defaults to settings.OPENAI_MODEL.
+
+    Yields:
+        dict: Recommended songs, in completion order.
+    """
+    model = model or settings.OPENAI_MODEL
+    key = cache_key(prompt, model)
+    cache = get_cache()
+    cached = await cache.aget(key) if cache is not None else None
+    if cached is not None:
+        for song in cached:
+            yield song
+        return
+
+    parser = ArrayStreamParser()
+    songs = []
+    chunks = astream(prompt, model=model, response_format=schemas.response_format(schemas.SONGS))
+    try:
+        async for text in chunks:
+            for song in validated_songs(parser.feed(text)):
+                songs.append(song)
+                yield song
+            if parser.done:
+                break
+    finally:
+        await chunks.aclose()
+    if not parser.done or parser.skipped:
+        metrics.count_parse_failure()
+    if cache is not None and parser.done and not parser.skipped:
+        await cache.aset(key, songs)
@@ -0,0 +1,221 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULTS = {
+    "BACKEND": "memory",
+    "TTL": 3600,
+    "MAX_ENTRIES": 1024,
+    "ALIAS": "default",
+}
+
+
+def cache_key(prompt, model):
+    """
+    Build the cache key for a prompt/model pair.
+
+    Prompts are normalized by collapsing whitespace and case folding, so that
+    trivially different spellings of the same request share one entry.
+
+    Args:
+        prompt (str): The prompt sent to the LLM.
+        model (str): The model name.
+
+    Returns:
+        str: A fixed-length key safe for any cache backend.
+    """
+    normalized = " ".join(prompt.split()).casefold()
+    digest = hashlib.sha256(f"{model}\0{normalized}".encode()).hexdigest()
+    return f"llm:{digest}"
+
+
+class ResponseCache:
+    """
+    Base class for LLM response caches, keeping hit/miss counters.
+
+    Attributes:
+        ttl (float): Seconds an entry stays valid.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that had to go to the LLM.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up a cached value.
+
+        Args:
+            key (str): Key from cache_key().
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        return self._record(self._get(key))
+
+    def set(self, key, value):
+        """
+        Store a value under a key for `ttl` seconds.
+
+        Args:
+            key (str): Key from cache_key().
+            value: A JSON-serializable value.
+        """
+        self._set(key, value)
+
+    async def aget(self, key):
+        """Async variant of get()."""
+        return self._record(await self._aget(key))
+
+    async def aset(self, key, value):
+        """Async variant of set()."""
+        await self._aset(key, value)
+
+    def _record(self, value):
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def stats(self):
+        """
+        Return the hit/miss counters of this process.
+
+        Returns:
+            dict: hits, misses and hit_rate.
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def clear(self):
+        """Drop all entries and reset counters."""
+        self.hits = self.misses = 0
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    async def _aget(self, key):
+        return self._get(key)
+
+    async def _aset(self, key, value):
+        self._set(key, value)
+
+
+class LRUResponseCache(ResponseCache):
+    """
+    In-process cache with per-entry expiry and least-recently-used eviction.
+
+    Attributes:
+        max_entries (int): Entries kept before the least recently used is evicted.
+    """
+
+    def __init__(self, ttl, max_entries, clock=time.monotonic):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        super().clear()
+
+
+class DjangoResponseCache(ResponseCache):
+    """
+    Cache stored in a Django cache alias, shared by every worker using that alias.
+
+    Size bounds and eviction are those of the configured backend (for example
+    MAX_ENTRIES of the locmem/database backends, or Redis/Memcached policies).
+    """
+
+    def __init__(self, ttl, alias="default"):
+        super().__init__(ttl)
+        self.alias = alias
+
+    @property
+    def _cache(self):
+        return caches[self.alias]
+
+    def _get(self, key):
+        return self._cache.get(key)
+
+    def _set(self, key, value):
+        self._cache.set(key, value, timeout=self.ttl)
+
+    async def _aget(self, key):
+        return await self._cache.aget(key)
+
+    async def _aset(self, key, value):
+        await self._cache.aset(key, value, timeout=self.ttl)
+
+    def clear(self):
+        self._cache.clear()
+        super().clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Return the process-wide LLM response cache configured by settings.LLM_CACHE.
+
+    Returns:
+        ResponseCache: The cache, or None when BACKEND is "none".
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = {**DEFAULTS, **getattr(settings, "LLM_CACHE", {})}
+            if config["BACKEND"] == "none":
+                return None
+            if config["BACKEND"] == "django":
+                _cache = DjangoResponseCache(config["TTL"], alias=config["ALIAS"])
+            else:
+                _cache = LRUResponseCache(config["TTL"], config["MAX_ENTRIES"])
+        return _cache
+
+
+def reset_cache():
+    """Forget the configured cache so the next get_cache() re-reads settings."""
+    global _cache
+    with _cache_lock:
+        _cache = None
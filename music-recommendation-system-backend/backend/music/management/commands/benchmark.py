@@ -0,0 +1,270 @@
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from music import ingest, llm
+from music.fake_llm import SHAPES, FakeLLMServer
+from music.llm_cache import reset_cache
+from music.models import GENRES, MOODS, Song, User
+
+# Named dataset sizes: songs, users, listening history rows
+SCALES = {
+    "small": {"songs": 1000, "users": 100, "events": 2000},
+    "medium": {"songs": 10000, "users": 1000, "events": 100000},
+    "large": {"songs": 100000, "users": 10000, "events": 1000000},
+}
+
+ENDPOINTS = ["login", "async-login", "recommendations", "filter", "search", "ingest"]
+
+# Listening events per ingest request
+INGEST_BATCH = 1000
+
+QUERIES = [
+    "Relaxing music for evening walks",
+    "Upbeat songs for a morning run",
+    "Calm music to focus with",
+    "Sad songs for a rainy day",
+    "Party hits from the 2000s",
+]
+
+
+def percentile(values, q):
+    """
+    Return the q-th percentile of values using linear interpolation.
+
+    Args:
+        values (list[float]): Samples, in any order.
+        q (float): Percentile in the range 0-100.
+
+    Returns:
+        float: The percentile, or 0.0 for no samples.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the API endpoints against a local fake LLM and report latency as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", default="small", help=f"Comma separated dataset sizes from {list(SCALES)}")
+        parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"Comma separated subset of {ENDPOINTS}")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+        parser.add_argument("--concurrency", type=int, default=16, help="Concurrent client threads")
+        parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per endpoint beforehand")
+        parser.add_argument("--llm-latency", type=float, default=0.05, help="Fake LLM response delay in seconds")
+        parser.add_argument("--llm-jitter", type=float, default=0.0, help="Extra random fake LLM delay in seconds")
+        parser.add_argument(
+            "--llm-token-latency", type=float, default=0.0, help="Extra fake LLM delay per prompt token in seconds",
+        )
+        parser.add_argument("--llm-shape", choices=SHAPES, default="json", help="Shape of fake LLM completions")
+        parser.add_argument("--llm-cache", action="store_true", help="Keep the LLM response cache enabled")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for data generation and request mix")
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+        parser.add_argument("--baseline", help="Previous JSON report to compare p95 latencies against")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.2,
+            help="Allowed relative p95 increase over the baseline before failing",
+        )
+
+    def handle(self, *args, **options):
+        scales = options["scales"].split(",")
+        endpoints = options["endpoints"].split(",")
+        unknown = [s for s in scales if s not in SCALES] + [e for e in endpoints if e not in ENDPOINTS]
+        if unknown:
+            raise CommandError(f"Unknown scales/endpoints: {', '.join(unknown)}")
+
+        self.rng = random.Random(options["seed"])
+        report = {
+            "config": {key: options[key] for key in (
+                "requests", "concurrency", "warmup", "llm_latency", "llm_jitter", "llm_token_latency", "llm_shape",
+                "llm_cache", "seed",
+            )},
+            "results": [],
+        }
+
+        setup_test_environment()
+        original_settings = (settings.OPENAI_BASE_URL, settings.OPENAI_API_KEY, settings.LLM_CACHE)
+        try:
+            with FakeLLMServer(
+                latency=options["llm_latency"], jitter=options["llm_jitter"],
+                shape=options["llm_shape"], token_latency=options["llm_token_latency"], seed=options["seed"],
+            ) as server:
+                settings.OPENAI_BASE_URL = server.base_url
+                settings.OPENAI_API_KEY = settings.OPENAI_API_KEY or "benchmark"
+                if not options["llm_cache"]:
+                    settings.LLM_CACHE = {**settings.LLM_CACHE, "BACKEND": "none"}
+                reset_cache()
+                llm._client = llm._async_client = None
+
+                for scale in scales:
+                    report["results"].append(self.run_scale(scale, endpoints, options, server))
+        finally:
+            settings.OPENAI_BASE_URL, settings.OPENAI_API_KEY, settings.LLM_CACHE = original_settings
+            reset_cache()
+            llm._client = llm._async_client = None
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options["baseline"]:
+            self.compare(report, options["baseline"], options["tolerance"])
+
+    def run_scale(self, scale, endpoints, options, server):
+        """Seed a throwaway database at the given scale and benchmark every endpoint on it."""
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.perf_counter()
+            sizes = SCALES[scale]
+            call_command(
+                "generate_data", f"--seed={options['seed']}", "--chunk-size=10000",
+                songs=sizes["songs"], users=sizes["users"], events=sizes["events"], stdout=StringIO(),
+            )
+            result = {"scale": scale, **sizes, "seed_seconds": round(time.perf_counter() - started, 3), "endpoints": {}}
+
+            self.user_ids = list(User.objects.values_list("id", flat=True))
+            self.usernames = list(User.objects.values_list("username", flat=True))
+            self.song_ids = list(Song.objects.values_list("id", flat=True))
+            for endpoint in endpoints:
+                self.load(endpoint, options["warmup"], options["concurrency"])
+                if endpoint == "ingest":
+                    ingest.get_ingest_buffer().flush()
+                upstream_before, tokens_before = server.requests, server.prompt_tokens
+                stats = self.load(endpoint, options["requests"], options["concurrency"])
+                stats["llm_requests"] = server.requests - upstream_before
+                stats["llm_prompt_tokens"] = round(
+                    (server.prompt_tokens - tokens_before) / max(stats["llm_requests"], 1), 1
+                )
+                if endpoint == "ingest":
+                    # Accepted events over the load plus the time to write what is still buffered
+                    drain_started = time.perf_counter()
+                    ingest.get_ingest_buffer().flush()
+                    wall = stats["requests"] / stats["throughput_rps"] + time.perf_counter() - drain_started
+                    accepted = (stats["requests"] - stats["errors"]) * INGEST_BATCH
+                    stats["events_written_per_second"] = round(accepted / wall)
+                result["endpoints"][endpoint] = stats
+                self.stderr.write(
+                    f"{scale:>6} {endpoint:<16} p50={stats['latency_ms']['p50']:.1f}ms "
+                    f"p95={stats['latency_ms']['p95']:.1f}ms {stats['throughput_rps']:.1f} req/s"
+                )
+            return result
+        finally:
+            if ingest._buffer is not None:
+                ingest._buffer.close()
+                ingest._buffer = None
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def make_request(self, endpoint):
+        """Return a callable issuing one randomized request to an endpoint with a given client."""
+        rng = self.rng
+        if endpoint == "login":
+            body = {"username": rng.choice(self.usernames), "password": "password123"}
+            return lambda client: client.post("/api/login/", body, content_type="application/json")
+        if endpoint == "async-login":
+            body = {"username": rng.choice(self.usernames), "password": "password123"}
+            return lambda client: client.post("/api/async/login/", body, content_type="application/json")
+        if endpoint == "recommendations":
+            url = f"/api/recommendations/{rng.choice(self.user_ids)}/"
+            return lambda client: client.get(url)
+        if endpoint == "filter":
+            url = f"/api/recommendations/filter/{rng.choice(self.user_ids)}/"
+            params = {"genre": rng.choice(GENRES), "mood": rng.choice(MOODS)}
+            return lambda client: client.get(url, params)
+        if endpoint == "ingest":
+            body = "\n".join(
+                json.dumps({"user_id": rng.choice(self.user_ids), "song_id": rng.choice(self.song_ids)})
+                for _ in range(INGEST_BATCH)
+            )
+            return lambda client: client.post("/api/listening-events/", body, content_type="application/x-ndjson")
+        body = {"query": f"{rng.choice(QUERIES)} #{rng.randrange(1000)}"}
+        return lambda client: client.post("/api/recommendations/search/", body, content_type="application/json")
+
+    def load(self, endpoint, total, concurrency):
+        """
+        Fire `total` requests at an endpoint from `concurrency` threads.
+
+        Returns:
+            dict: Latency percentiles, throughput, error count and DB queries per request.
+        """
+        requests = [self.make_request(endpoint) for _ in range(total)]
+        latencies, statuses, queries = [], [], []
+        lock = threading.Lock()
+        local = threading.local()
+
+        def count_query(execute, sql, params, many, context):
+            local.queries += 1
+            return execute(sql, params, many, context)
+
+        def run(request):
+            if not hasattr(local, "client"):
+                local.client = Client()
+            local.queries = 0
+            with connection.execute_wrapper(count_query):
+                started = time.perf_counter()
+                response = request(local.client)
+                elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed * 1000)
+                statuses.append(response.status_code)
+                queries.append(local.queries)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(run, requests))
+        wall = time.perf_counter() - started
+
+        if not latencies:
+            return {}
+        return {
+            "requests": total,
+            "errors": sum(1 for status in statuses if status >= 400),
+            "throughput_rps": round(total / wall, 2),
+            "latency_ms": {
+                "mean": round(statistics.fmean(latencies), 3),
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+                "p99": round(percentile(latencies, 99), 3),
+                "max": round(max(latencies), 3),
+            },
+            "db_queries_per_request": round(statistics.fmean(queries), 2),
+        }
+
+    def compare(self, report, baseline_path, tolerance):
+        """Fail if any endpoint's p95 regressed by more than `tolerance` against a baseline report."""
+        with open(baseline_path) as f:
+            baseline = {r["scale"]: r["endpoints"] for r in json.load(f)["results"]}
+
+        regressions = []
+        for result in report["results"]:
+            for endpoint, stats in result["endpoints"].items():
+                before = baseline.get(result["scale"], {}).get(endpoint)
+                if before is None:
+                    continue
+                old, new = before["latency_ms"]["p95"], stats["latency_ms"]["p95"]
+                if old and new > old * (1 + tolerance):
+                    regressions.append(f"{result['scale']}/{endpoint}: p95 {old:.1f}ms -> {new:.1f}ms")
+
+        if regressions:
+            raise CommandError("Latency regressions:\n" + "\n".join(regressions))
+        self.stderr.write(self.style.SUCCESS("No p95 regressions against baseline."))
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from music.similarity import MAX_USER_SONGS, build_index
+
+
+class Command(BaseCommand):
+    help = "Build the item-item co-listening similarity index served by the 'similar' backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default=None, help="Index file (default: settings.SIMILARITY_INDEX_PATH)")
+        parser.add_argument("--top-k", type=int, default=20, help="Neighbours kept per song")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Users loaded per query")
+        parser.add_argument(
+            "--max-user-songs", type=int, default=MAX_USER_SONGS,
+            help="Most recent distinct songs per user taken into account",
+        )
+        parser.add_argument(
+            "--max-pairs", type=int, default=5_000_000,
+            help="Song pairs materialized at once; lower it to reduce peak memory",
+        )
+
+    def handle(self, *args, **options):
+        path = options["output"] or settings.SIMILARITY_INDEX_PATH
+        started = time.perf_counter()
+        for done, total in build_index(
+            path, top_k=options["top_k"], chunk_size=options["chunk_size"],
+            max_user_songs=options["max_user_songs"], max_pairs=options["max_pairs"],
+        ):
+            self.stdout.write(f"  songs: {done:,}/{total:,} ({time.perf_counter() - started:.1f}s)")
+        self.stdout.write(self.style.SUCCESS(f"✅ Wrote similarity index to {path}."))
@@ -0,0 +1,32 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from music.compaction import compact_history
+from music.models import ListeningDailyCount, ListeningHistory
+
+
+class Command(BaseCommand):
+    help = "Roll listening history older than the retention window up into per-day counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.HISTORY_RETENTION_DAYS,
+                            help="Days of raw history to keep (default: settings.HISTORY_RETENTION_DAYS)")
+        parser.add_argument("--batch-size", type=int, default=10000, help="Raw rows per transaction")
+
+    def handle(self, *args, **options):
+        cutoff = now() - timedelta(days=options["days"])
+        total = ListeningHistory.objects.filter(listened_at__lt=cutoff).count()
+        started = time.perf_counter()
+        done = 0
+        for done in compact_history(cutoff, batch_size=options["batch_size"]):
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f"  history: {done:,}/{total:,} listens ({rate:,.0f} listens/s)")
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Compacted {done:,} listens before {cutoff:%Y-%m-%d}: "
+            f"{ListeningHistory.objects.count():,} raw listens and "
+            f"{ListeningDailyCount.objects.count():,} daily counts remain."
+        ))
@@ -0,0 +1,41 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from music.fake_llm import SHAPES, FakeLLMServer
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the OpenAI chat completions API (for load testing)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", type=float, default=0.5, help="Base response delay in seconds")
+        parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay in seconds")
+        parser.add_argument("--shape", choices=SHAPES, default="json", help="Shape of the completion content")
+        parser.add_argument("--songs", type=int, default=20, help="Songs per completion")
+        parser.add_argument("--chunk-size", type=int, default=16, help="Characters per streamed chunk")
+        parser.add_argument("--chunk-delay", type=float, default=0.01, help="Seconds between streamed chunks")
+
+    def handle(self, *args, **options):
+        server = FakeLLMServer(
+            host=options["host"],
+            port=options["port"],
+            latency=options["latency"],
+            jitter=options["jitter"],
+            shape=options["shape"],
+            songs=options["songs"],
+            chunk_size=options["chunk_size"],
+            chunk_delay=options["chunk_delay"],
+        )
+
+        async def main():
+            await server.serve()
+            self.stdout.write(f"Fake LLM listening, set OPENAI_BASE_URL={server.base_url}")
+            await asyncio.Event().wait()
+
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            self.stdout.write(f"Served {server.requests} completions.")
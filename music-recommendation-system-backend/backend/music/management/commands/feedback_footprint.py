@@ -0,0 +1,101 @@
+import json
+import random
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from music.feedback import FeedbackCache, SongFeedback
+
+# Users the report is scaled to
+REPORT_USERS = 1_000_000
+
+
+def feedback_footprint(users=10000, likes=50, skips=50, songs=1_000_000, candidates=5000, seed=0):
+    """
+    Measure the memory of cached liked/skipped songs and the cost of filtering
+    candidates with them.
+
+    Synthetic users with `likes` liked and `skips` skipped songs out of a catalog
+    of `songs` are put in a FeedbackCache; its traced allocations are scaled to
+    REPORT_USERS users and compared with one bitmap per set over the catalog.
+
+    Args:
+        users (int): Users to measure.
+        likes (int): Liked songs per user.
+        skips (int): Skipped songs per user.
+        songs (int): Catalog size song ids are drawn from.
+        candidates (int): Candidate ids filtered per timing.
+        seed (int): Seed for the synthetic ids.
+
+    Returns:
+        dict: Bytes per user, MiB per REPORT_USERS users for sorted arrays and
+        bitmaps, and microseconds to exclude the skipped songs from scores over
+        the catalog and to filter them out of `candidates` candidate ids.
+    """
+    rng = random.Random(seed)
+    cache = FeedbackCache(max_users=users)
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for user_id in range(users):
+            cache._store({user_id: SongFeedback(
+                rng.sample(range(1, songs + 1), likes), rng.sample(range(1, songs + 1), skips)
+            )})
+        used = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+
+    feedback = cache.get(0)
+    rounds = 200
+    # Excluding from scores over the whole catalog, as VectorRecommender does
+    catalog_ids = np.arange(1, songs + 1, dtype=np.int64)
+    scores = np.zeros(songs, dtype=np.float32)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        pos = np.minimum(np.searchsorted(catalog_ids, feedback.skipped), songs - 1)
+        scores[pos[catalog_ids[pos] == feedback.skipped]] = -np.inf
+    exclude_us = (time.perf_counter() - started) / rounds * 1e6
+    # Filtering an unsorted candidate list
+    candidate_ids = np.asarray(rng.sample(range(1, songs + 1), candidates), dtype=np.int64)
+    candidate_ids[:len(feedback.skipped)] = feedback.skipped
+    started = time.perf_counter()
+    for _ in range(rounds):
+        kept = candidate_ids[~feedback.is_skipped(candidate_ids)]
+    filter_us = (time.perf_counter() - started) / rounds * 1e6
+
+    per_user = used / users
+    bitmap_per_user = 2 * ((songs + 7) // 8)
+    return {
+        "users": users,
+        "likes": likes,
+        "skips": skips,
+        "songs": songs,
+        "bytes_per_user": round(per_user, 1),
+        "mib_per_million_users": round(per_user * REPORT_USERS / 2**20, 1),
+        "bitmap_mib_per_million_users": round(bitmap_per_user * REPORT_USERS / 2**20, 1),
+        "exclude_from_catalog_us": round(exclude_us, 1),
+        "candidates": candidates,
+        "kept": len(kept),
+        "filter_candidates_us": round(filter_us, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = "Report the memory of in-process liked/skipped songs per 1M users, as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000, help="Users to measure")
+        parser.add_argument("--likes", type=int, default=50, help="Liked songs per user")
+        parser.add_argument("--skips", type=int, default=50, help="Skipped songs per user")
+        parser.add_argument("--songs", type=int, default=1_000_000, help="Catalog size")
+        parser.add_argument("--candidates", type=int, default=5000, help="Candidates filtered per timing")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic ids")
+
+    def handle(self, *args, **options):
+        report = feedback_footprint(
+            users=options["users"], likes=options["likes"], skips=options["skips"], songs=options["songs"],
+            candidates=options["candidates"], seed=options["seed"],
+        )
+        self.stdout.write(json.dumps(report, indent=2))
@@ -1,52 +1,136 @@
 import random
-from django.core.management.base import BaseCommand
+import time
+from itertools import accumulate
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from music.models import Song, User, ListeningHistory
-from datetime import datetime, timedelta
-import pytz
+from music.profiles import rebuild_profiles
 
 # Define genres, moods
 GENRES = ["Pop", "Rock", "Hip-Hop", "Jazz", "Classical", "Electronic", "Reggae", "Country"]
 MOODS = ["Happy", "Sad", "Energetic", "Relaxing", "Romantic", "Melancholic"]
 
+# Relative share of listens per hour of day (UTC): quiet nights, a morning
+# commute bump, steady afternoons and an evening peak.
+HOUR_WEIGHTS = [
+    2, 1, 1, 1, 1, 2, 4, 7, 9, 8, 6, 6,
+    7, 7, 6, 6, 7, 8, 9, 10, 10, 9, 7, 4,
+]
+
+
 class Command(BaseCommand):
     help = "Generate synthetic data for users, songs, and listening history"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument("--songs", type=int, default=1000, help="Number of songs to create")
+        parser.add_argument("--users", type=int, default=100, help="Number of users to create")
+        parser.add_argument("--events", type=int, default=2000, help="Number of listening history rows to create")
+        parser.add_argument("--artists", type=int, default=20, help="Number of distinct artists")
+        parser.add_argument("--days", type=int, default=30, help="Spread history over this many days")
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Rows per bulk insert transaction")
+        parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible datasets")
+        parser.add_argument(
+            "--until", type=datetime.fromisoformat, default=None,
+            help="ISO timestamp of the newest listen (default: now); fix it together with --seed",
+        )
+        parser.add_argument(
+            "--skip-profiles", action="store_true",
+            help="Do not rebuild taste profiles afterwards (run rebuild_profiles later)",
+        )
+
+    def handle(self, *args, **options):
+        if min(options["songs"], options["users"]) < 1 and options["events"] > 0:
+            raise CommandError("Listening history needs at least one song and one user.")
+
+        self.rng = random.Random(options["seed"])
+        self.chunk_size = options["chunk_size"]
         self.stdout.write("Generating synthetic data...")
 
-        # Create songs
-        songs = []
-        for i in range(1000):
-            song = Song.objects.create(
-                title=f"Song {i}",
-                artist=f"Artist {i % 20}",
-                genre=random.choice(GENRES),
-                mood=random.choice(MOODS),
-                popularity=random.randint(1, 100)
+        self.create_songs(options["songs"], options["artists"])
+        self.create_users(options["users"])
+        until = options["until"] or datetime.now(timezone.utc)
+        if until.tzinfo is None:
+            until = until.replace(tzinfo=timezone.utc)
+        self.create_history(options["events"], until, options["days"])
+        if options["events"] and not options["skip_profiles"]:
+            self.update_profiles()
+
+        self.stdout.write(self.style.SUCCESS("🎵 Synthetic data generated successfully!"))
+
+    def bulk_insert(self, label, model, total, make_row):
+        """
+        Insert `total` rows in chunks, one transaction per chunk, reporting throughput.
+
+        Args:
+            label (str): Name used in progress output.
+            model (Model): The model to insert.
+            total (int): Number of rows.
+            make_row (Callable[[int], Model]): Builds the unsaved instance for row i.
+        """
+        started = time.perf_counter()
+        for offset in range(0, total, self.chunk_size):
+            rows = [make_row(i) for i in range(offset, min(offset + self.chunk_size, total))]
+            with transaction.atomic():
+                model.objects.bulk_create(rows, batch_size=self.chunk_size)
+            done = offset + len(rows)
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f"  {label}: {done:,}/{total:,} rows ({rate:,.0f} rows/s)")
+
+    def create_songs(self, count, artists):
+        start = Song.objects.count()
+        rng = self.rng
+        self.bulk_insert("songs", Song, count, lambda i: Song(
+            title=f"Song {start + i}",
+            artist=f"Artist {(start + i) % artists}",
+            genre=rng.choice(GENRES),
+            mood=rng.choice(MOODS),
+            popularity=rng.randint(1, 100),
+        ))
+        self.stdout.write(f"✅ Created {count} songs.")
+
+    def create_users(self, count):
+        start = User.objects.count()
+        rng = self.rng
+        # Hashing is deliberately slow, so hash the shared password only once.
+        password = make_password("password123")
+        self.bulk_insert("users", User, count, lambda i: User(
+            name=f"User {start + i}",
+            username=f"user_{start + i}",
+            password=password,
+            preferred_genres=rng.sample(GENRES, 3),
+            preferred_moods=rng.sample(MOODS, 2),
+        ))
+        self.stdout.write(f"✅ Created {count} users.")
+
+    def create_history(self, count, until, days):
+        song_ids = list(Song.objects.order_by("id").values_list("id", flat=True))
+        user_ids = list(User.objects.order_by("id").values_list("id", flat=True))
+        rng = self.rng
+        midnight = until.replace(hour=0, minute=0, second=0, microsecond=0)
+        hours = range(24)
+        cum_weights = list(accumulate(HOUR_WEIGHTS))
+
+        def make_row(i):
+            listened_at = midnight - timedelta(days=rng.randrange(days)) + timedelta(
+                hours=rng.choices(hours, cum_weights=cum_weights)[0], seconds=rng.randrange(3600)
             )
-            songs.append(song)
-        self.stdout.write("✅ Created 1000 songs.")
-
-        # Create users
-        users = []
-        for i in range(100):
-            user = User.objects.create(
-                name=f"User {i}",
-                username=f"user_{i}",
-                preferred_genres=random.sample(GENRES, 3),
-                preferred_moods=random.sample(MOODS, 2),
+            if listened_at > until:
+                listened_at -= timedelta(days=1)
+            return ListeningHistory(
+                user_id=rng.choice(user_ids),
+                song_id=rng.choice(song_ids),
+                listened_at=listened_at,
             )
-            user.set_password("password123")
-            users.append(user)
-        self.stdout.write("✅ Created 100 users.")
-
-        # Create listening history
-        tz = pytz.UTC
-        for user in users:
-            for _ in range(random.randint(10, 30)):
-                song = random.choice(songs)
-                listened_at = tz.localize(datetime.now() - timedelta(days=random.randint(0, 30)))
-                ListeningHistory.objects.create(user=user, song=song, listened_at=listened_at)
-        self.stdout.write("✅ Created listening history for all users.")
-
-        self.stdout.write(self.style.SUCCESS("🎵 Synthetic data generated successfully!"))
\ No newline at end of file
+
+        self.bulk_insert("history", ListeningHistory, count, make_row)
+        self.stdout.write(f"✅ Created {count} listening history rows.")
+
+    def update_profiles(self):
+        # bulk_create bypasses the post_save signal that maintains taste profiles.
+        user_ids = list(User.objects.order_by("id").values_list("id", flat=True))
+        for done in rebuild_profiles(user_ids, chunk_size=1000):
+            self.stdout.write(f"  profiles: {done:,}/{len(user_ids):,} users")
+        self.stdout.write(f"✅ Rebuilt taste profiles for {len(user_ids)} users.")
@@ -0,0 +1,30 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from music.precompute import changed_users, precompute
+
+
+class Command(BaseCommand):
+    help = "Precompute recommendations per user and time of day for users whose history changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Worker processes (0 computes in this process)")
+        parser.add_argument("--chunk-size", type=int, default=100, help="Users per worker task")
+        parser.add_argument("--force", action="store_true", help="Recompute every user")
+
+    def handle(self, *args, **options):
+        user_marks = changed_users(settings.PRECOMPUTED_MAX_AGE, force=options["force"])
+        total = len(user_marks)
+        self.stdout.write(f"{total:,} users to compute")
+        started = time.perf_counter()
+        failures = 0
+        for done, failures in precompute(user_marks, workers=options["workers"], chunk_size=options["chunk_size"]):
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f"  recommendations: {done:,}/{total:,} users ({rate:,.0f} users/s)")
+        if failures:
+            self.stdout.write(self.style.WARNING(f"{failures} slots failed and will be retried on the next run."))
+        self.stdout.write(self.style.SUCCESS(f"✅ Precomputed recommendations for {total} users."))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from music.models import User
+from music.profiles import rebuild_profiles
+
+
+class Command(BaseCommand):
+    help = "Recompute per-user time-of-day taste profiles from the full listening history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("user_ids", nargs="*", type=int, help="Users to rebuild (default: all users)")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Users per chunk")
+
+    def handle(self, *args, **options):
+        user_ids = options["user_ids"] or list(User.objects.order_by("id").values_list("id", flat=True))
+        total = len(user_ids)
+        started = time.perf_counter()
+        for done in rebuild_profiles(user_ids, chunk_size=options["chunk_size"]):
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f"  profiles: {done:,}/{total:,} users ({rate:,.0f} users/s)")
+        self.stdout.write(self.style.SUCCESS(f"✅ Rebuilt taste profiles for {total} users."))
@@ -0,0 +1,195 @@
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+from music.management.commands.benchmark import percentile
+from music.models import GENRES, MOODS, ListeningHistory, Song, User
+
+# Throwaway database aliases used during a storm
+PRIMARY = "storm_primary"
+REPLICA = "storm_replica"
+
+
+def _database(name, init_command):
+    return {
+        **connections.settings["default"],
+        "NAME": name,
+        "OPTIONS": {**settings.DATABASES["default"].get("OPTIONS", {}), "init_command": init_command},
+        "TEST": {},
+    }
+
+
+def _seed(songs, users, events, rng):
+    Song.objects.using(PRIMARY).bulk_create([
+        Song(title=f"Song {i}", artist=f"Artist {i % 20}", genre=rng.choice(GENRES), mood=rng.choice(MOODS),
+             popularity=rng.randint(1, 100))
+        for i in range(songs)
+    ])
+    User.objects.using(PRIMARY).bulk_create([
+        User(name=f"User {i}", username=f"user_{i}", password="!") for i in range(users)
+    ])
+    song_ids = list(Song.objects.using(PRIMARY).values_list("id", flat=True))
+    user_ids = list(User.objects.using(PRIMARY).values_list("id", flat=True))
+    until = datetime.now(timezone.utc)
+    ListeningHistory.objects.using(PRIMARY).bulk_create([
+        ListeningHistory(user_id=rng.choice(user_ids), song_id=rng.choice(song_ids),
+                         listened_at=until - timedelta(seconds=rng.randrange(30 * 86400)))
+        for _ in range(events)
+    ], batch_size=10000)
+    return song_ids, user_ids
+
+
+def write_storm(directory, seconds=5.0, readers=4, writers=1, batch=20, journal_mode="wal", replica=True,
+                songs=1000, users=100, events=20000, seed=0):
+    """
+    Measure history reads while writers keep inserting listening history.
+
+    A primary SQLite file is created and seeded in `directory` with the
+    connection settings of DATABASES["default"]. With `replica`, it is copied
+    to a second file that readers use, as they would a replica through
+    music.routers; writes always go to the primary.
+
+    Args:
+        directory (str): Where to create the database files.
+        seconds (float): Duration of the storm.
+        readers (int): Threads reading a user's latest listens with their songs.
+        writers (int): Threads inserting `batch` history rows per transaction.
+        batch (int): Rows per write transaction.
+        journal_mode (str): SQLite journal mode, e.g. "wal" or "delete" to compare.
+        replica (bool): Read from a second file instead of the primary.
+        songs (int): Catalog size.
+        users (int): Number of users.
+        events (int): Initial listening history rows.
+        seed (int): Seed for data and request mix.
+
+    Returns:
+        dict: Reads and writes per second, read latency percentiles and the
+        number of operations that failed with "database is locked".
+    """
+    base = settings.DATABASES["default"].get("OPTIONS", {}).get("init_command", "")
+    pragmas = [p for p in base.split(";") if p.strip() and "journal_mode" not in p]
+    init_command = ";".join([f"PRAGMA journal_mode={journal_mode}"] + pragmas)
+    primary_name = os.path.join(directory, "primary.sqlite3")
+    replica_name = os.path.join(directory, "replica.sqlite3")
+    rng = random.Random(seed)
+
+    connections.settings[PRIMARY] = _database(primary_name, init_command)
+    try:
+        call_command("migrate", database=PRIMARY, verbosity=0, stdout=StringIO())
+        song_ids, user_ids = _seed(songs, users, events, rng)
+        connections[PRIMARY].close()
+        read_alias = PRIMARY
+        if replica:
+            with sqlite3.connect(primary_name) as source, sqlite3.connect(replica_name) as target:
+                source.backup(target)
+            connections.settings[REPLICA] = _database(replica_name, init_command + ";PRAGMA query_only=ON")
+            read_alias = REPLICA
+
+        deadline = time.perf_counter() + seconds
+        lock = threading.Lock()
+        latencies, counts = [], {"reads": 0, "writes": 0, "read_errors": 0, "write_errors": 0}
+
+        def read(worker):
+            local_rng = random.Random(seed + worker)
+            samples = []
+            try:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        list(ListeningHistory.objects.using(read_alias).filter(user_id=local_rng.choice(user_ids))
+                             .select_related("song").order_by("-listened_at")[:20])
+                    except OperationalError:
+                        with lock:
+                            counts["read_errors"] += 1
+                        continue
+                    samples.append((time.perf_counter() - started) * 1000)
+            finally:
+                connections.close_all()
+            with lock:
+                latencies.extend(samples)
+                counts["reads"] += len(samples)
+
+        def write(worker):
+            local_rng = random.Random(-seed - worker - 1)
+            try:
+                while time.perf_counter() < deadline:
+                    rows = [
+                        ListeningHistory(user_id=local_rng.choice(user_ids), song_id=local_rng.choice(song_ids))
+                        for _ in range(batch)
+                    ]
+                    try:
+                        with transaction.atomic(using=PRIMARY):
+                            ListeningHistory.objects.using(PRIMARY).bulk_create(rows)
+                    except OperationalError:
+                        with lock:
+                            counts["write_errors"] += 1
+                        continue
+                    with lock:
+                        counts["writes"] += len(rows)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+        threads += [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+    finally:
+        for alias in (PRIMARY, REPLICA):
+            if alias in connections.settings:
+                connections[alias].close()
+                del connections[alias]
+                del connections.settings[alias]
+
+    return {
+        "journal_mode": journal_mode,
+        "replica": replica,
+        "reads_per_second": round(counts["reads"] / wall, 1),
+        "rows_written_per_second": round(counts["writes"] / wall, 1),
+        "read_latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "max": round(max(latencies, default=0.0), 3),
+            "mean": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        },
+        "read_errors": counts["read_errors"],
+        "write_errors": counts["write_errors"],
+    }
+
+
+class Command(BaseCommand):
+    help = "Measure listening history read throughput while writers insert history, as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5.0, help="Duration of the storm")
+        parser.add_argument("--readers", type=int, default=4, help="Reading threads")
+        parser.add_argument("--writers", type=int, default=1, help="Writing threads")
+        parser.add_argument("--batch", type=int, default=20, help="History rows per write transaction")
+        parser.add_argument("--journal-mode", default="wal", help='SQLite journal mode, e.g. "wal" or "delete"')
+        parser.add_argument("--no-replica", action="store_true", help="Read from the primary file")
+        parser.add_argument("--events", type=int, default=20000, help="Initial listening history rows")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for data and request mix")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            report = write_storm(
+                directory, seconds=options["seconds"], readers=options["readers"], writers=options["writers"],
+                batch=options["batch"], journal_mode=options["journal_mode"], replica=not options["no_replica"],
+                events=options["events"], seed=options["seed"],
+            )
+        self.stdout.write(json.dumps(report, indent=2))
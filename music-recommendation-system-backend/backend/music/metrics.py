@@ -0,0 +1,410 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.views import View
+
+# Per-request performance instrumentation. MetricsMiddleware opens a
+# RequestMetrics for every request; database queries, LLM calls, JSON parsing
+# and the other stages wrapped in stage() add their time to it and to
+# process-wide histograms labelled by endpoint (the URL name). MetricsView
+# renders the histograms in the Prometheus text format. Each worker process
+# keeps its own series, so scrape every worker, or run a single one per host.
+
+# Upper bounds in seconds of the duration buckets, the Prometheus client defaults
+# extended for LLM round-trips
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+INF_BOUND = 'le="+Inf"'
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter with labels, in the Prometheus data model.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): One-line description.
+        labelnames (tuple[str]): Names of the labels, in order.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        """Add `amount` to the series identified by the label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        """Return the current value of a series."""
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        """Yield the exposition lines of every series."""
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    """
+    Histogram with labels and fixed buckets, in the Prometheus data model.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): One-line description.
+        labelnames (tuple[str]): Names of the labels, in order.
+        buckets (tuple[float]): Sorted upper bounds; +Inf is implied.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """Record one observation in the series identified by the label values."""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels):
+        """Return the number of observations of a series."""
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def sum(self, *labels):
+        """Return the sum of the observations of a series."""
+        series = self._series.get(labels)
+        return series[1] if series else 0.0
+
+    def samples(self):
+        """Yield the exposition lines of every series: cumulative buckets, sum and count."""
+        with self._lock:
+            series = sorted((labels, (list(counts), total, n)) for labels, (counts, total, n) in self._series.items())
+        for labels, (counts, total, n) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_number(float(bound))}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, INF_BOUND)} {n}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {n}"
+
+
+REQUEST_DURATION = Histogram(
+    "soundify_request_duration_seconds", "Time to produce a response, rendering included.",
+    ("endpoint", "method", "status"),
+)
+STAGE_DURATION = Histogram(
+    "soundify_stage_duration_seconds", "Time spent per request in a stage (db, llm, parse, ground, search, render).",
+    ("endpoint", "stage"),
+)
+DB_QUERIES = Histogram(
+    "soundify_db_queries", "Database queries per request.", ("endpoint",), buckets=QUERY_COUNT_BUCKETS,
+)
+LLM_DURATION = Histogram(
+    "soundify_llm_request_duration_seconds", "Latency of one LLM round-trip, to the last chunk when streamed.",
+    ("endpoint", "mode"),
+)
+LLM_TOKENS = Histogram(
+    "soundify_llm_tokens", "Tokens per LLM call as reported by the API.", ("endpoint", "kind"), buckets=TOKEN_BUCKETS,
+)
+PROMPT_TOKENS = Histogram(
+    "soundify_prompt_tokens", "Estimated tokens per prompt built.", ("endpoint",), buckets=TOKEN_BUCKETS,
+)
+LLM_PARSE_FAILURES = Counter(
+    "soundify_llm_parse_failures_total", "LLM completions without a decodable JSON array.", ("endpoint",),
+)
+
+LLM_DROPPED_ITEMS = Counter(
+    "soundify_llm_dropped_items_total", "Items of LLM completions dropped for not matching the schema.", ("endpoint",),
+)
+
+LLM_FALLBACKS = Counter(
+    "soundify_llm_fallbacks_total",
+    "Degraded responses served from a local fallback instead of the LLM, by reason: timeout, error or circuit_open.",
+    ("endpoint", "reason"),
+)
+
+INGESTED_EVENTS = Counter(
+    "soundify_ingested_events_total",
+    "Listening events by outcome: accepted, rejected, throttled, written or dropped.", ("result",),
+)
+
+REGISTRY = [
+    REQUEST_DURATION, STAGE_DURATION, DB_QUERIES, LLM_DURATION, LLM_TOKENS, PROMPT_TOKENS, LLM_PARSE_FAILURES,
+    LLM_DROPPED_ITEMS, LLM_FALLBACKS, INGESTED_EVENTS,
+]
+
+
+def render_metrics(registry=REGISTRY):
+    """
+    Render metrics in the Prometheus text exposition format (version 0.0.4).
+
+    Args:
+        registry (list): Counters and histograms to render.
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    """
+    Accumulates the timings of one request.
+
+    Attributes:
+        endpoint (str): URL name of the view, "unknown" until resolved.
+        stages (dict[str, float]): Seconds spent per stage.
+        queries (int): Database queries run.
+    """
+
+    def __init__(self, endpoint="unknown"):
+        self.endpoint = endpoint
+        self.stages = {}
+        self.queries = 0
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self, total):
+        """Format the stages and the total as a Server-Timing header value, in milliseconds."""
+        entries = [
+            f'db;desc="{self.queries} queries";dur={self.stages["db"] * 1000:.1f}' if stage == "db"
+            else f"{stage};dur={seconds * 1000:.1f}"
+            for stage, seconds in self.stages.items()
+        ]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+def current():
+    """Return the RequestMetrics of the request being served, or None outside one."""
+    return _current.get()
+
+
+def current_endpoint():
+    metrics = _current.get()
+    return metrics.endpoint if metrics is not None else "unknown"
+
+
+def record_stage(name, seconds):
+    """Add time to a stage of the current request, if any."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as a stage of the current request.
+
+    Args:
+        name (str): Stage name, e.g. "llm" or "ground".
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def observe_llm(seconds, mode="complete", usage=None):
+    """
+    Record one LLM round-trip.
+
+    Args:
+        seconds (float): Latency of the call.
+        mode (str): "complete" or "stream".
+        usage: The `usage` object of the API response, if reported.
+    """
+    endpoint = current_endpoint()
+    record_stage("llm", seconds)
+    LLM_DURATION.observe(seconds, endpoint, mode)
+    if usage is not None:
+        for kind in ("prompt_tokens", "completion_tokens"):
+            tokens = getattr(usage, kind, None)
+            if tokens is not None:
+                LLM_TOKENS.observe(tokens, endpoint, kind.removesuffix("_tokens"))
+
+
+def observe_prompt(tokens):
+    """Record the estimated size of a prompt built for the current endpoint."""
+    PROMPT_TOKENS.observe(tokens, current_endpoint())
+
+
+def count_parse_failure():
+    """Count an LLM completion that could not be decoded."""
+    LLM_PARSE_FAILURES.inc(current_endpoint())
+
+
+def count_dropped_items(count):
+    """Count LLM completion items dropped by schema validation."""
+    LLM_DROPPED_ITEMS.inc(current_endpoint(), amount=count)
+
+
+def count_fallback(reason):
+    """Count a degraded response served instead of the LLM's, see music.deadline."""
+    LLM_FALLBACKS.inc(current_endpoint(), reason)
+
+
+def count_ingested(result, count):
+    """Count listening events ingested with a given outcome."""
+    if count:
+        INGESTED_EVENTS.inc(result, amount=count)
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add("db", time.perf_counter() - started)
+        metrics.queries += 1
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    # Connections are per thread, and async views query from sync_to_async
+    # threads, so every connection is wrapped and attributes its queries to
+    # the request in the calling context.
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class MetricsMiddleware:
+    """
+    Record the duration, stages and query count of every request.
+
+    Works under WSGI and ASGI. Rendering of DRF responses is timed as the
+    "render" stage. With settings.METRICS_SERVER_TIMING, responses carry the
+    stages in a Server-Timing header for browser developer tools.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics, started = self.start()
+        response = self.get_response(request)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics, started = self.start()
+        response = await self.get_response(request)
+        return self.finish(request, response, metrics, started)
+
+    def start(self):
+        metrics = RequestMetrics()
+        # Left set after the response: a streamed body is produced later, and
+        # its LLM calls must still be attributed to this request's endpoint.
+        _current.set(metrics)
+        return metrics, time.perf_counter()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None and request.resolver_match is not None:
+            metrics.endpoint = request.resolver_match.url_name or request.resolver_match.view_name
+        return None
+
+    def process_template_response(self, request, response):
+        with stage("render"):
+            response.render()
+        return response
+
+    def finish(self, request, response, metrics, started):
+        total = time.perf_counter() - started
+        endpoint = metrics.endpoint
+        REQUEST_DURATION.observe(total, endpoint, request.method, str(response.status_code))
+        DB_QUERIES.observe(metrics.queries, endpoint)
+        for name, seconds in metrics.stages.items():
+            STAGE_DURATION.observe(seconds, endpoint, name)
+        if getattr(settings, "METRICS_SERVER_TIMING", False):
+            response["Server-Timing"] = metrics.server_timing(total)
+        return response
+
+
+class MetricsView(View):
+    """
+    Expose the process's metrics in the Prometheus text format.
+
+    GET:
+        No parameters.
+
+    Returns:
+        - 200 OK text/plain exposition of all histograms and counters.
+    """
+
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
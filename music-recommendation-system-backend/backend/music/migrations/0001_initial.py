@@ -0,0 +1,49 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Song',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('artist', models.CharField(max_length=255)),
+                ('genre', models.CharField(choices=[('Pop', 'Pop'), ('Rock', 'Rock'), ('Jazz', 'Jazz'), ('Hip-Hop', 'Hip-Hop'), ('Classical', 'Classical'), ('Electronic', 'Electronic'), ('Reggae', 'Reggae'), ('Country', 'Country'), ('Blues', 'Blues'), ('R&B', 'R&B'), ('Metal', 'Metal'), ('Folk', 'Folk'), ('Soul', 'Soul')], max_length=100)),
+                ('mood', models.CharField(choices=[('Happy', 'Happy'), ('Sad', 'Sad'), ('Energetic', 'Energetic'), ('Relaxing', 'Relaxing'), ('Romantic', 'Romantic'), ('Melancholic', 'Melancholic'), ('Angry', 'Angry'), ('Excited', 'Excited'), ('Chill', 'Chill')], max_length=100)),
+                ('popularity', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('username', models.CharField(max_length=100, unique=True)),
+                ('password', models.CharField(default='12345678', max_length=255)),
+                ('preferred_genres', models.JSONField(default=list)),
+                ('preferred_moods', models.JSONField(default=list)),
+                ('liked_songs', models.ManyToManyField(blank=True, related_name='liked_by', to='music.song')),
+                ('skipped_songs', models.ManyToManyField(blank=True, related_name='skipped_by', to='music.song')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ListeningHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listened_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music.song')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listening_history', to='music.user')),
+            ],
+        ),
+    ]
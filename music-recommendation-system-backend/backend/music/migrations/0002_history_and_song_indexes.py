@@ -0,0 +1,21 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listeninghistory',
+            index=models.Index(fields=['user', '-listened_at'], name='history_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['genre', 'mood'], name='song_genre_mood_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0002_history_and_song_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TasteProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_of_day', models.CharField(choices=[('Morning', 'Morning'), ('Afternoon', 'Afternoon'), ('Evening', 'Evening')], max_length=20)),
+                ('genres', models.JSONField(default=dict)),
+                ('moods', models.JSONField(default=dict)),
+                ('artists', models.JSONField(default=dict)),
+                ('recent_songs', models.JSONField(default=list)),
+                ('listens', models.IntegerField(default=0)),
+                ('decayed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='taste_profiles', to='music.user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'time_of_day'), name='taste_profile_user_slot_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# SQLite only: an external-content FTS5 index over music_song, kept in sync by
+# triggers so that every write path (ORM, bulk_create, raw SQL) updates it.
+# Other databases use the in-memory BM25 index in music.search instead.
+
+COLUMNS = "title, artist, genre, mood"
+
+FORWARD = [
+    f"""CREATE VIRTUAL TABLE music_song_fts USING fts5(
+        {COLUMNS}, content='music_song', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER music_song_fts_insert AFTER INSERT ON music_song BEGIN
+        INSERT INTO music_song_fts(rowid, {COLUMNS}) VALUES (new.id, new.title, new.artist, new.genre, new.mood);
+    END""",
+    f"""CREATE TRIGGER music_song_fts_delete AFTER DELETE ON music_song BEGIN
+        INSERT INTO music_song_fts(music_song_fts, rowid, {COLUMNS})
+        VALUES ('delete', old.id, old.title, old.artist, old.genre, old.mood);
+    END""",
+    f"""CREATE TRIGGER music_song_fts_update AFTER UPDATE OF {COLUMNS} ON music_song BEGIN
+        INSERT INTO music_song_fts(music_song_fts, rowid, {COLUMNS})
+        VALUES ('delete', old.id, old.title, old.artist, old.genre, old.mood);
+        INSERT INTO music_song_fts(rowid, {COLUMNS}) VALUES (new.id, new.title, new.artist, new.genre, new.mood);
+    END""",
+    "INSERT INTO music_song_fts(music_song_fts) VALUES ('rebuild')",
+]
+
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS music_song_fts_update",
+    "DROP TRIGGER IF EXISTS music_song_fts_delete",
+    "DROP TRIGGER IF EXISTS music_song_fts_insert",
+    "DROP TABLE IF EXISTS music_song_fts",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0003_taste_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARD), run(BACKWARD)),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 11:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0004_song_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecomputedRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_of_day', models.CharField(choices=[('Morning', 'Morning'), ('Afternoon', 'Afternoon'), ('Evening', 'Evening')], max_length=20)),
+                ('songs', models.JSONField(default=list)),
+                ('history_last_id', models.BigIntegerField(default=0)),
+                ('generated_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='precomputed_recommendations', to='music.user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'time_of_day'), name='precomputed_user_slot_uniq')],
+            },
+        ),
+    ]
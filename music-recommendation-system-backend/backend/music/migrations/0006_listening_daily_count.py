@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 12:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0005_precomputed_recommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListeningDailyCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('time_of_day', models.CharField(choices=[('Morning', 'Morning'), ('Afternoon', 'Afternoon'), ('Evening', 'Evening')], max_length=20)),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music.song')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_listens', to='music.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-day'], name='daily_count_user_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'time_of_day', 'day', 'song'), name='daily_count_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_listening_daily_count'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='song',
+            name='song_genre_mood_idx',
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['genre', 'mood', '-popularity', '-id'], name='song_genre_mood_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['genre', '-popularity', '-id'], name='song_genre_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['mood', '-popularity', '-id'], name='song_mood_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['-popularity', '-id'], name='song_popularity_idx'),
+        ),
+    ]
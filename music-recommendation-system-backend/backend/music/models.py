@@ -1,6 +1,12 @@
+import heapq
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone
+
 from django.db import models
+from django.db.models import Case, F, Value, When, Window
+from django.db.models.functions import RowNumber
 from django.utils.timezone import now
-from django.contrib.auth.hashers import make_password, check_password
+from django.contrib.auth.hashers import make_password
 
 GENRES = [
     "Pop", "Rock", "Jazz", "Hip-Hop", "Classical", "Electronic", "Reggae",
@@ -14,6 +20,30 @@ MOODS = [
 
 TIME_OF_DAY = ["Morning", "Afternoon", "Evening"]
 
+# Half-open [start, end) hour range covered by each time-of-day slot
+TIME_OF_DAY_HOURS = {
+    "Morning": (0, 12),
+    "Afternoon": (12, 18),
+    "Evening": (18, 24),
+}
+
+
+def time_of_day_for_hour(hour):
+    """
+    Map an hour of the day to its time-of-day slot.
+
+    Args:
+        hour (int): Hour in the range 0-23.
+
+    Returns:
+        str: "Morning", "Afternoon", or "Evening".
+    """
+    for time_of_day, (start, end) in TIME_OF_DAY_HOURS.items():
+        if start <= hour < end:
+            return time_of_day
+    raise ValueError(f"Hour out of range: {hour}")
+
+
 class Song(models.Model):
     """
     Represents a song in the music recommendation system.
@@ -31,6 +61,16 @@ class Song(models.Model):
     mood = models.CharField(max_length=100, choices=[(m, m) for m in MOODS])
     popularity = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # Keyset pages by descending popularity (music.browse), per filter
+            # combination; the first also serves genre/mood lookups.
+            models.Index(fields=["genre", "mood", "-popularity", "-id"], name="song_genre_mood_popularity_idx"),
+            models.Index(fields=["genre", "-popularity", "-id"], name="song_genre_popularity_idx"),
+            models.Index(fields=["mood", "-popularity", "-id"], name="song_mood_popularity_idx"),
+            models.Index(fields=["-popularity", "-id"], name="song_popularity_idx"),
+        ]
+
     def __str__(self):
         """Return a string representation of the song."""
         return f"{self.title} - {self.artist}"
@@ -71,19 +111,132 @@ class User(models.Model):
         """
         Verify that the given raw password matches the stored hashed password.
 
+        A matching password stored with outdated hasher parameters is rehashed
+        with the current ones and saved.
+
         Args:
             raw_password (str): The raw password to check.
 
         Returns:
             bool: True if the password matches, False otherwise.
         """
-        return check_password(raw_password, self.password)
+        from .auth import verify_password
+
+        valid, rehashed = verify_password(raw_password, self.password)
+        if rehashed:
+            self.password = rehashed
+            self.save(update_fields=["password"])
+        return valid
 
     def __str__(self):
         """Return the username as string representation of the user."""
         return self.username
 
 
+class ListeningHistoryQuerySet(models.QuerySet):
+    """
+    Query helpers for listening history that keep filtering and limiting in SQL.
+    """
+
+    def for_time_of_day(self, time_of_day):
+        """
+        Keep only listens whose hour falls in the given time-of-day slot.
+
+        Args:
+            time_of_day (str): One of TIME_OF_DAY.
+
+        Returns:
+            ListeningHistoryQuerySet: The filtered queryset.
+        """
+        start, end = TIME_OF_DAY_HOURS[time_of_day]
+        return self.filter(listened_at__hour__gte=start, listened_at__hour__lt=end)
+
+    def for_song_attributes(self, genre=None, mood=None):
+        """
+        Keep only listens of songs with the given genre and/or mood.
+
+        Args:
+            genre (str): Genre to match, optional.
+            mood (str): Mood to match, optional.
+
+        Returns:
+            ListeningHistoryQuerySet: The filtered queryset.
+        """
+        queryset = self
+        if genre:
+            queryset = queryset.filter(song__genre=genre)
+        if mood:
+            queryset = queryset.filter(song__mood=mood)
+        return queryset
+
+    def latest_listens(self, limit=20):
+        """
+        Fetch the `limit` most recent listens with their songs in a single query.
+
+        Args:
+            limit (int): Number of listens to fetch.
+
+        Returns:
+            list[tuple[datetime, Song]]: When each song was listened to and the
+            song, most recent listen first.
+        """
+        history = self.select_related("song").only(
+            "listened_at", "song", "song__title", "song__artist", "song__genre", "song__mood", "song__popularity"
+        ).order_by("-listened_at")[:limit]
+        return [(h.listened_at, h.song) for h in history]
+
+    def latest_songs(self, limit=20):
+        """
+        Fetch the songs of the `limit` most recent listens in a single query.
+
+        Args:
+            limit (int): Number of listens to fetch.
+
+        Returns:
+            list[Song]: The songs, most recent listen first.
+        """
+        return [song for _, song in self.latest_listens(limit)]
+
+    def latest_listens_per_user(self, limit=20):
+        """
+        Fetch the `limit` most recent listens of every user in a single
+        windowed query.
+
+        Args:
+            limit (int): Number of listens to fetch per user.
+
+        Returns:
+            dict[int, list[tuple[datetime, Song]]]: User id to listens as in
+            latest_listens(), most recent first.
+        """
+        history = self.select_related("song").only(
+            "user_id", "listened_at", "song", "song__title", "song__artist", "song__genre", "song__mood",
+            "song__popularity",
+        ).annotate(
+            recency=Window(RowNumber(), partition_by=F("user_id"), order_by=F("listened_at").desc()),
+        ).filter(recency__lte=limit).order_by("user_id", "recency")
+        listens = defaultdict(list)
+        for h in history:
+            listens[h.user_id].append((h.listened_at, h.song))
+        return dict(listens)
+
+    def latest_songs_per_user(self, limit=20):
+        """
+        Fetch the songs of the `limit` most recent listens of every user in a
+        single windowed query.
+
+        Args:
+            limit (int): Number of listens to fetch per user.
+
+        Returns:
+            dict[int, list[Song]]: User id to songs, most recent listen first.
+        """
+        return {
+            user_id: [song for _, song in listens]
+            for user_id, listens in self.latest_listens_per_user(limit).items()
+        }
+
+
 class ListeningHistory(models.Model):
     """
     Records the listening history of users.
@@ -97,6 +250,14 @@ class ListeningHistory(models.Model):
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
     listened_at = models.DateTimeField(default=now)
 
+    objects = ListeningHistoryQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves "latest N listens of a user", optionally filtered further
+            models.Index(fields=["user", "-listened_at"], name="history_user_recent_idx"),
+        ]
+
     def time_of_day(self):
         """
         Determine the time of day when the song was listened to.
@@ -104,15 +265,333 @@ class ListeningHistory(models.Model):
         Returns:
             str: "Morning", "Afternoon", or "Evening" based on the hour.
         """
-        hour = self.listened_at.hour
-        if hour < 12:
-            return "Morning"
-        elif hour < 18:
-            return "Afternoon"
-        else:
-            return "Evening"
+        return time_of_day_for_hour(self.listened_at.hour)
 
     def __str__(self):
         """Return a human-readable record of the listening event."""
         return f"{self.user.name} - {self.song.title} at {self.listened_at}"
 
+
+class ListeningDailyCountQuerySet(models.QuerySet):
+    """
+    Query helpers mirroring ListeningHistoryQuerySet for rolled-up listens.
+    """
+
+    def for_time_of_day(self, time_of_day):
+        """Keep only counts of the given time-of-day slot."""
+        return self.filter(time_of_day=time_of_day)
+
+    def for_song_attributes(self, genre=None, mood=None):
+        """Keep only counts of songs with the given genre and/or mood."""
+        queryset = self
+        if genre:
+            queryset = queryset.filter(song__genre=genre)
+        if mood:
+            queryset = queryset.filter(song__mood=mood)
+        return queryset
+
+    def _with_songs(self):
+        return self.select_related("song").only(
+            "user_id", "day", "time_of_day", "plays", "song", "song__title", "song__artist", "song__genre",
+            "song__mood", "song__popularity",
+        ).annotate(
+            # Slots sort by name in the wrong order
+            slot_start=Case(*[When(time_of_day=slot, then=Value(start)) for slot, (start, _) in TIME_OF_DAY_HOURS.items()]),
+        )
+
+    def latest_listens(self, limit=20):
+        """
+        Fetch the `limit` most recent counts with their songs in a single query.
+
+        Returns:
+            list[tuple[datetime, Song]]: The representative timestamp of each
+            count (see ListeningDailyCount.listened_at()) and its song, latest
+            slot first and most played first within a slot.
+        """
+        counts = self._with_songs().order_by("-day", "-slot_start", "-plays")[:limit]
+        return [(count.listened_at(), count.song) for count in counts]
+
+    def latest_songs(self, limit=20):
+        """
+        Fetch the songs of the `limit` most recent counts in a single query.
+
+        Returns:
+            list[Song]: The songs, latest slot first and most played first within a slot.
+        """
+        return [song for _, song in self.latest_listens(limit)]
+
+    def latest_listens_per_user(self, limit=20):
+        """
+        Fetch the `limit` most recent counts of every user in a single windowed query.
+
+        Returns:
+            dict[int, list[tuple[datetime, Song]]]: User id to counts as in
+            latest_listens(), latest first.
+        """
+        counts = self._with_songs().annotate(
+            recency=Window(
+                RowNumber(), partition_by=F("user_id"),
+                order_by=[F("day").desc(), F("slot_start").desc(), F("plays").desc()],
+            ),
+        ).filter(recency__lte=limit).order_by("user_id", "recency")
+        listens = defaultdict(list)
+        for count in counts:
+            listens[count.user_id].append((count.listened_at(), count.song))
+        return dict(listens)
+
+    def latest_songs_per_user(self, limit=20):
+        """
+        Fetch the songs of the `limit` most recent counts of every user in a
+        single windowed query.
+
+        Returns:
+            dict[int, list[Song]]: User id to songs, latest slot first.
+        """
+        return {
+            user_id: [song for _, song in listens]
+            for user_id, listens in self.latest_listens_per_user(limit).items()
+        }
+
+
+class ListeningDailyCount(models.Model):
+    """
+    Listens of a user to a song on one day and time-of-day slot, rolled up from
+    ListeningHistory rows older than settings.HISTORY_RETENTION_DAYS by the
+    compact_history command.
+
+    Attributes:
+        user (User): The user who listened.
+        song (Song): The song listened to.
+        day (date): The day of the listens, in UTC.
+        time_of_day (str): One of TIME_OF_DAY.
+        plays (int): Number of listens.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="daily_listens")
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    day = models.DateField()
+    time_of_day = models.CharField(max_length=20, choices=[(t, t) for t in TIME_OF_DAY])
+    plays = models.PositiveIntegerField(default=0)
+
+    objects = ListeningDailyCountQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Also serves "latest days of a user in a slot"
+            models.UniqueConstraint(fields=["user", "time_of_day", "day", "song"], name="daily_count_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-day"], name="daily_count_user_recent_idx"),
+        ]
+
+    def listened_at(self):
+        """
+        Return a representative timestamp for the listens: the middle of their slot.
+
+        Returns:
+            datetime: Aware UTC timestamp on `day`.
+        """
+        start, end = TIME_OF_DAY_HOURS[self.time_of_day]
+        return datetime.combine(self.day, time(0), timezone.utc) + timedelta(hours=(start + end) / 2)
+
+    def __str__(self):
+        """Return a human-readable description of the count."""
+        return f"{self.user_id} - {self.song_id} on {self.day} ({self.time_of_day}): {self.plays}"
+
+
+def latest_listens(limit=20, time_of_day=None, genre=None, mood=None, **filters):
+    """
+    Fetch the most recent listens across raw and rolled-up history, in two queries.
+
+    Raw listens are usually newer than any rolled-up day, but late or
+    backfilled events can be older, so the latest `limit` of each table are
+    merged by timestamp, rolled-up counts standing at the middle of their slot.
+
+    Args:
+        limit (int): Number of listens.
+        time_of_day (str): Keep only this slot, optional.
+        genre (str): Keep only songs of this genre, optional.
+        mood (str): Keep only songs of this mood, optional.
+        **filters: Further filters valid on both models, e.g. user=user.
+
+    Returns:
+        list[tuple[datetime, Song]]: When each song was listened to and the
+        song, most recent first.
+    """
+    listens = []
+    for model in (ListeningHistory, ListeningDailyCount):
+        queryset = model.objects.filter(**filters).for_song_attributes(genre, mood)
+        if time_of_day:
+            queryset = queryset.for_time_of_day(time_of_day)
+        listens.append(queryset.latest_listens(limit))
+    return _merge_latest(listens, limit)
+
+
+def latest_listened_songs(limit=20, time_of_day=None, genre=None, mood=None, **filters):
+    """
+    Fetch the songs of the most recent listens across raw and rolled-up history.
+
+    Args:
+        limit (int): Number of songs.
+        time_of_day (str): Keep only this slot, optional.
+        genre (str): Keep only songs of this genre, optional.
+        mood (str): Keep only songs of this mood, optional.
+        **filters: Further filters valid on both models, e.g. user=user.
+
+    Returns:
+        list[Song]: The songs, most recent first, see latest_listens().
+    """
+    return [song for _, song in latest_listens(limit, time_of_day, genre, mood, **filters)]
+
+
+def _merge_latest(listens, limit):
+    return list(heapq.merge(*listens, key=lambda listen: listen[0], reverse=True))[:limit]
+
+
+def latest_listened_songs_per_user(user_ids, limit=20, time_of_day=None, genre=None, mood=None):
+    """
+    Per-user variant of latest_listened_songs(), in two queries.
+
+    Args:
+        user_ids (Iterable[int]): The users.
+        limit (int): Number of songs per user.
+        time_of_day (str): Keep only this slot, optional.
+        genre (str): Keep only songs of this genre, optional.
+        mood (str): Keep only songs of this mood, optional.
+
+    Returns:
+        dict[int, list[Song]]: User id to songs, most recent first; users
+        without listens are left out.
+    """
+    user_ids = list(user_ids)
+    listens = defaultdict(list)
+    for model in (ListeningHistory, ListeningDailyCount):
+        queryset = model.objects.filter(user_id__in=user_ids).for_song_attributes(genre, mood)
+        if time_of_day:
+            queryset = queryset.for_time_of_day(time_of_day)
+        for user_id, found in queryset.latest_listens_per_user(limit).items():
+            listens[user_id].append(found)
+    return {user_id: [song for _, song in _merge_latest(found, limit)] for user_id, found in listens.items()}
+
+
+class TasteProfile(models.Model):
+    """
+    Materialized taste of a user for one time-of-day slot, kept up to date as
+    listens are recorded (see music.profiles).
+
+    Counts decay exponentially with the listen's age, so recent habits dominate.
+    All weights are stored relative to `decayed_at`; scaling them uniformly to a
+    later instant does not change their shares, so readers never need to decay.
+
+    Attributes:
+        user (User): The user.
+        time_of_day (str): One of TIME_OF_DAY.
+        genres (dict): Genre to decayed listen weight.
+        moods (dict): Mood to decayed listen weight.
+        artists (dict): Artist to decayed listen weight, for the top artists only.
+        recent_songs (list[dict]): Latest songs in the slot as {id, title, artist, at}.
+        listens (int): Total number of listens applied.
+        decayed_at (datetime): Instant the weights are expressed at.
+    """
+    MAX_ARTISTS = 50
+    MAX_RECENT_SONGS = 20
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="taste_profiles")
+    time_of_day = models.CharField(max_length=20, choices=[(t, t) for t in TIME_OF_DAY])
+    genres = models.JSONField(default=dict)
+    moods = models.JSONField(default=dict)
+    artists = models.JSONField(default=dict)
+    recent_songs = models.JSONField(default=list)
+    listens = models.IntegerField(default=0)
+    decayed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "time_of_day"], name="taste_profile_user_slot_uniq"),
+        ]
+
+    def add_listen(self, song, listened_at, half_life_days, plays=1):
+        """
+        Fold one listen, or several of the same song at once, into the profile.
+
+        Args:
+            song: Object with id, title, artist, genre and mood attributes.
+            listened_at (datetime): When the song was listened to.
+            half_life_days (float): Age after which a listen counts half.
+            plays (int): Number of listens at listened_at.
+        """
+        weight = float(plays)
+        if self.decayed_at is None:
+            self.decayed_at = listened_at
+        elif listened_at > self.decayed_at:
+            factor = 0.5 ** ((listened_at - self.decayed_at).total_seconds() / 86400 / half_life_days)
+            for counts in (self.genres, self.moods, self.artists):
+                for key in counts:
+                    counts[key] *= factor
+            self.decayed_at = listened_at
+        else:
+            weight *= 0.5 ** ((self.decayed_at - listened_at).total_seconds() / 86400 / half_life_days)
+
+        self.genres[song.genre] = self.genres.get(song.genre, 0.0) + weight
+        self.moods[song.mood] = self.moods.get(song.mood, 0.0) + weight
+        self.artists[song.artist] = self.artists.get(song.artist, 0.0) + weight
+        if len(self.artists) > 2 * self.MAX_ARTISTS:
+            top = sorted(self.artists.items(), key=lambda item: item[1], reverse=True)[:self.MAX_ARTISTS]
+            self.artists = dict(top)
+        self.listens += plays
+
+        at = listened_at.isoformat()
+        if len(self.recent_songs) < self.MAX_RECENT_SONGS or at > self.recent_songs[-1]["at"]:
+            self.recent_songs.append({"id": song.id, "title": song.title, "artist": song.artist, "at": at})
+            self.recent_songs.sort(key=lambda entry: entry["at"], reverse=True)
+            del self.recent_songs[self.MAX_RECENT_SONGS:]
+
+    @staticmethod
+    def shares(counts, limit=None):
+        """
+        Normalize weights to shares, largest first.
+
+        Args:
+            counts (dict): Key to weight.
+            limit (int): Keep only the largest `limit` entries.
+
+        Returns:
+            list[tuple[str, float]]: (key, share) pairs summing to 1 over all keys.
+        """
+        total = sum(counts.values())
+        if not total:
+            return []
+        ordered = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(key, weight / total) for key, weight in ordered]
+
+    def __str__(self):
+        """Return a human-readable description of the profile."""
+        return f"{self.user_id} - {self.time_of_day}"
+
+
+class PrecomputedRecommendation(models.Model):
+    """
+    Recommendations computed ahead of time for a user and time-of-day slot by
+    the precompute_recommendations command.
+
+    Attributes:
+        user (User): The user.
+        time_of_day (str): One of TIME_OF_DAY.
+        songs (list[dict]): The recommended songs, as RecommendationView returns them.
+        history_last_id (int): Latest ListeningHistory id of the user when computed;
+            newer listens make the row stale.
+        generated_at (datetime): When the recommendations were computed.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="precomputed_recommendations")
+    time_of_day = models.CharField(max_length=20, choices=[(t, t) for t in TIME_OF_DAY])
+    songs = models.JSONField(default=list)
+    history_last_id = models.BigIntegerField(default=0)
+    generated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "time_of_day"], name="precomputed_user_slot_uniq"),
+        ]
+
+    def __str__(self):
+        """Return a human-readable description of the row."""
+        return f"{self.user_id} - {self.time_of_day} at {self.generated_at}"
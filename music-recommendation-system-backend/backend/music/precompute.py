@@ -0,0 +1,132 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.db import connections
+from django.db.models import Count, Max, Min
+from django.utils.timezone import now
+
+from .models import TIME_OF_DAY, ListeningHistory, PrecomputedRecommendation, User
+
+# Offline recommendations per (user, time-of-day slot), stored so that
+# RecommendationView can answer from one indexed read. Each row remembers the
+# newest ListeningHistory id it was computed from; users who listened since, or
+# whose rows aged out, are recomputed on the next run.
+
+
+def changed_users(max_age, force=False):
+    """
+    Find the users whose precomputed recommendations must be (re)computed.
+
+    Args:
+        max_age (timedelta): Rows generated longer ago than this are recomputed.
+        force (bool): Recompute every user.
+
+    Returns:
+        dict[int, int]: Newest ListeningHistory id (0 without history) per user to compute.
+    """
+    latest = dict(ListeningHistory.objects.values("user_id").annotate(last=Max("id")).values_list("user_id", "last"))
+    marks = {user_id: latest.get(user_id, 0) for user_id in User.objects.order_by("id").values_list("id", flat=True)}
+    if force:
+        return marks
+
+    stored = PrecomputedRecommendation.objects.values("user_id").annotate(
+        slots=Count("id"), history_last_id=Min("history_last_id"), generated_at=Min("generated_at"),
+    )
+    up_to_date = {
+        row["user_id"]
+        for row in stored
+        if row["slots"] == len(TIME_OF_DAY)
+        and row["generated_at"] >= now() - max_age
+        and row["history_last_id"] >= marks.get(row["user_id"], 0)
+    }
+    return {user_id: mark for user_id, mark in marks.items() if user_id not in up_to_date}
+
+
+def _setup_worker():
+    # Spawned workers start without Django; forked ones inherit it but must not
+    # share the parent's database connections.
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+
+
+def compute_chunk(user_marks, generated_at):
+    """
+    Compute the recommendations of a chunk of users for every time-of-day slot.
+
+    Runs in a worker process. A user whose recommendations fail in a slot is
+    left out of that slot and retried on the next run.
+
+    Args:
+        user_marks (list[tuple[int, int]]): (user id, newest ListeningHistory id) pairs.
+        generated_at (datetime): Timestamp stored on the rows.
+
+    Returns:
+        tuple[list[PrecomputedRecommendation], int]: Unsaved rows and the number of failures.
+    """
+    from .views import compute_recommendations
+
+    rows, failures = [], 0
+    users = User.objects.in_bulk([user_id for user_id, _ in user_marks])
+    for user_id, mark in user_marks:
+        if user_id not in users:
+            continue
+        for time_of_day in TIME_OF_DAY:
+            try:
+                songs = compute_recommendations(users[user_id], time_of_day)
+            except Exception:
+                failures += 1
+                continue
+            rows.append(PrecomputedRecommendation(
+                # Plain JSON values, so rows pickle back from worker processes
+                user_id=user_id, time_of_day=time_of_day, songs=json.loads(json.dumps(songs)),
+                history_last_id=mark, generated_at=generated_at,
+            ))
+    return rows, failures
+
+
+def save_rows(rows):
+    """Insert or replace precomputed rows on (user, time_of_day)."""
+    PrecomputedRecommendation.objects.bulk_create(
+        rows, batch_size=500, update_conflicts=True, unique_fields=["user", "time_of_day"],
+        update_fields=["songs", "history_last_id", "generated_at"],
+    )
+
+
+def precompute(user_marks, workers=0, chunk_size=100):
+    """
+    Compute and store recommendations, fanning chunks of users out to processes.
+
+    Workers only read; rows are written by the calling process as chunks come
+    back. The history mark of each user is taken before computing, so listens
+    recorded meanwhile leave the row stale rather than wrongly fresh.
+
+    Args:
+        user_marks (dict[int, int]): Users to compute, from changed_users().
+        workers (int): Worker processes; 0 computes in this process.
+        chunk_size (int): Users per task.
+
+    Yields:
+        tuple[int, int]: (users done, failed slots so far) after each chunk.
+    """
+    items = list(user_marks.items())
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    generated_at = now()
+    done = failures = 0
+
+    if workers <= 0:
+        results = (compute_chunk(chunk, generated_at) for chunk in chunks)
+        for chunk, (rows, failed) in zip(chunks, results):
+            save_rows(rows)
+            done, failures = done + len(chunk), failures + failed
+            yield done, failures
+        return
+
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_setup_worker) as pool:
+        for chunk, (rows, failed) in zip(chunks, pool.map(compute_chunk, chunks, [generated_at] * len(chunks))):
+            save_rows(rows)
+            done, failures = done + len(chunk), failures + failed
+            yield done, failures
@@ -0,0 +1,118 @@
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import ListeningDailyCount, ListeningHistory, TasteProfile, User, time_of_day_for_hour
+
+# Minimal song record, so bulk paths can apply listens from values_list() rows
+SongInfo = namedtuple("SongInfo", ["id", "title", "artist", "genre", "mood"])
+
+
+def half_life_days():
+    return getattr(settings, "TASTE_PROFILE_HALF_LIFE_DAYS", 30)
+
+
+def record_listens(listens):
+    """
+    Fold new listens into the affected taste profiles.
+
+    Profiles are locked and updated in one transaction, creating missing ones.
+
+    Args:
+        listens (Iterable[tuple[int, song, datetime]]): (user_id, song, listened_at)
+            triples, where song has id, title, artist, genre and mood attributes.
+    """
+    grouped = defaultdict(list)
+    for user_id, song, listened_at in listens:
+        grouped[(user_id, time_of_day_for_hour(listened_at.hour))].append((song, listened_at))
+    if not grouped:
+        return
+
+    half_life = half_life_days()
+    user_ids = {user_id for user_id, _ in grouped}
+    with transaction.atomic():
+        existing = {
+            (p.user_id, p.time_of_day): p
+            for p in TasteProfile.objects.select_for_update().filter(user_id__in=user_ids)
+        }
+        created, updated = [], []
+        for key, entries in grouped.items():
+            profile = existing.get(key)
+            if profile is None:
+                profile = TasteProfile(user_id=key[0], time_of_day=key[1])
+                created.append(profile)
+            else:
+                updated.append(profile)
+            for song, listened_at in sorted(entries, key=lambda entry: entry[1]):
+                profile.add_listen(song, listened_at, half_life)
+
+        # One upsert instead of bulk_update(), whose CASE WHEN per row and
+        # field costs far more to compile than to run. Existing rows are
+        # matched on (user, time_of_day) and keep their primary key.
+        for profile in updated:
+            profile.pk = None
+        TasteProfile.objects.bulk_create(
+            created + updated, update_conflicts=True, unique_fields=["user", "time_of_day"],
+            update_fields=["genres", "moods", "artists", "recent_songs", "listens", "decayed_at"],
+        )
+
+
+@receiver(post_save, sender=ListeningHistory)
+def _listen_recorded(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_listens([(instance.user_id, instance.song, instance.listened_at)])
+
+
+def rebuild_profiles(user_ids=None, chunk_size=1000):
+    """
+    Recompute taste profiles from the full listening history.
+
+    Users are processed in chunks, streaming each chunk's history in time order,
+    so memory is bounded by the number of profiles in one chunk. Rolled-up
+    ListeningDailyCount rows, older than any raw listen, are folded in first.
+
+    Args:
+        user_ids (Iterable[int]): Users to rebuild, all users by default.
+        chunk_size (int): Users per chunk.
+
+    Yields:
+        int: Number of users processed so far, after each chunk.
+    """
+    if user_ids is None:
+        user_ids = User.objects.order_by("id").values_list("id", flat=True)
+    user_ids = list(user_ids)
+    half_life = half_life_days()
+
+    for offset in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[offset:offset + chunk_size]
+        profiles = {}
+
+        def profile_for(user_id, time_of_day):
+            profile = profiles.get((user_id, time_of_day))
+            if profile is None:
+                profile = profiles[(user_id, time_of_day)] = TasteProfile(user_id=user_id, time_of_day=time_of_day)
+            return profile
+
+        song_fields = ("song_id", "song__title", "song__artist", "song__genre", "song__mood")
+        counts = ListeningDailyCount.objects.filter(user_id__in=chunk).order_by("day", "id").values_list(
+            "user_id", "day", "time_of_day", "plays", *song_fields
+        )
+        for user_id, day, time_of_day, plays, *song in counts.iterator(chunk_size=10000):
+            count = ListeningDailyCount(day=day, time_of_day=time_of_day)
+            profile_for(user_id, time_of_day).add_listen(SongInfo(*song), count.listened_at(), half_life, plays)
+
+        rows = ListeningHistory.objects.filter(user_id__in=chunk).order_by("listened_at", "id").values_list(
+            "user_id", "listened_at", *song_fields
+        )
+        for user_id, listened_at, *song in rows.iterator(chunk_size=10000):
+            profile_for(user_id, time_of_day_for_hour(listened_at.hour)).add_listen(
+                SongInfo(*song), listened_at, half_life
+            )
+
+        with transaction.atomic():
+            TasteProfile.objects.filter(user_id__in=chunk).delete()
+            TasteProfile.objects.bulk_create(profiles.values())
+        yield offset + len(chunk)
@@ -0,0 +1,314 @@
+import math
+from collections import Counter, namedtuple
+
+from django.conf import settings
+
+from . import metrics
+from .models import TasteProfile
+from .schemas import IDS, SONGS
+
+# Prompt building for every recommendation path. A prompt is a few fixed lines
+# (task, query, filters, taste summary, output format) plus one list of songs,
+# either the user's history or catalog candidates. The list gets whatever is
+# left of the token budget: repeated songs are listed once with a play count
+# and grouped by artist, and when the list still does not fit, the least recent
+# entries are folded into per-artist, genre and mood counts. The budget is
+# settings.PROMPT_TOKEN_BUDGET plus settings.PROMPT_TOKENS_PER_CANDIDATE per
+# catalog candidate, and candidate lists always keep as many songs as the LLM
+# is asked for.
+
+# Completions are asked for this fixed, compact schema, which keeps output
+# tokens down and is what grounding and parsing expect. The reply is wrapped in
+# the object of music.schemas, so models without structured output return the
+# same shape as those that enforce it
+SONG_SCHEMA = '{"title":"...","artist":"..."}'
+
+# Average characters per token of English text for GPT tokenizers
+CHARS_PER_TOKEN = 4
+
+SongEntry = namedtuple("SongEntry", "title artist genre mood plays")
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a text.
+
+    Args:
+        text (str): Prompt text.
+
+    Returns:
+        int: About one token per CHARS_PER_TOKEN characters.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _field(song, name):
+    value = song.get(name) if isinstance(song, dict) else getattr(song, name, None)
+    return str(value) if value else ""
+
+
+def song_entries(songs):
+    """
+    Deduplicate songs, counting repeats.
+
+    Args:
+        songs (Iterable[Song | dict]): Songs, most relevant first; dicts such as
+            TasteProfile.recent_songs entries need "title" and "artist".
+
+    Returns:
+        list[SongEntry]: One entry per distinct title and artist, in first-seen order.
+    """
+    entries = {}
+    for song in songs:
+        title, artist = _field(song, "title"), _field(song, "artist")
+        key = (title.casefold(), artist.casefold())
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = SongEntry(title, artist, _field(song, "genre"), _field(song, "mood"), 1)
+        else:
+            entries[key] = entry._replace(plays=entry.plays + 1)
+    return list(entries.values())
+
+
+def describe(entry, attributes=(), artist=True):
+    """
+    Format one entry for a prompt.
+
+    Args:
+        entry (SongEntry): The entry.
+        attributes (Iterable[str]): Entry fields to add in parentheses, e.g. ("genre", "mood").
+        artist (bool): Append "by <artist>" to the title.
+
+    Returns:
+        str: e.g. "So What by Miles Davis (Jazz, Relaxing) x3".
+    """
+    text = f"{entry.title} by {entry.artist}" if artist else entry.title
+    values = [getattr(entry, name) for name in attributes if getattr(entry, name)]
+    if values:
+        text += f" ({', '.join(values)})"
+    if entry.plays > 1:
+        text += f" x{entry.plays}"
+    return text
+
+
+def group_by_artist(entries, details=False):
+    """
+    Format entries grouped by artist, so each artist is named once.
+
+    Artists are ordered by their first entry, which keeps the most relevant
+    first. With details, the genre or mood shared by every entry is stated once
+    up front instead of per song.
+
+    Args:
+        entries (list[SongEntry]): Entries, most relevant first.
+        details (bool): Include genre and mood.
+
+    Returns:
+        str: e.g. "all Relaxing; Trio: Jazz 1 (Jazz) x3, Jazz 0 (Jazz); Star: Pop 2 (Pop)".
+    """
+    attributes, shared = [], []
+    if details:
+        for name in ("genre", "mood"):
+            values = {getattr(entry, name) for entry in entries}
+            if len(values) == 1 and "" not in values:
+                shared.append(values.pop())
+            else:
+                attributes.append(name)
+    groups = {}
+    for entry in entries:
+        groups.setdefault(entry.artist, []).append(describe(entry, attributes, artist=False))
+    listed = "; ".join(f"{artist}: {', '.join(titles)}" for artist, titles in groups.items())
+    return f"all {', '.join(shared)}; {listed}" if shared else listed
+
+
+def summarize(entries, limit=3):
+    """
+    Aggregate entries into their most frequent artists, genres and moods.
+
+    Args:
+        entries (list[SongEntry]): Entries to fold.
+        limit (int): Names kept per field.
+
+    Returns:
+        str: e.g. "12 more songs: artists Trio x5, Star x3; genres Jazz x8".
+    """
+    parts = []
+    for label, field in (("artists", "artist"), ("genres", "genre"), ("moods", "mood")):
+        counts = Counter()
+        for entry in entries:
+            if getattr(entry, field):
+                counts[getattr(entry, field)] += entry.plays
+        if counts:
+            parts.append(f"{label} " + ", ".join(f"{name} x{n}" for name, n in counts.most_common(limit)))
+    noun = "song" if len(entries) == 1 else "songs"
+    return f"{len(entries)} more {noun}" + (": " + "; ".join(parts) if parts else "")
+
+
+def default_budget(candidates=0):
+    """
+    Return the token budget of a prompt.
+
+    Args:
+        candidates (int): Number of catalog candidates the prompt lists.
+
+    Returns:
+        int: settings.PROMPT_TOKEN_BUDGET plus
+        settings.PROMPT_TOKENS_PER_CANDIDATE per candidate.
+    """
+    return settings.PROMPT_TOKEN_BUDGET + candidates * settings.PROMPT_TOKENS_PER_CANDIDATE
+
+
+def song_list(entries, budget, details=False, keep=0):
+    """
+    List entries within a token budget, summarizing those that do not fit.
+
+    Args:
+        entries (list[SongEntry]): Entries, most relevant first.
+        budget (int): Tokens available for the list.
+        details (bool): Include genre and mood of listed songs.
+        keep (int): Entries listed even if they exceed the budget.
+
+    Returns:
+        str: The entries grouped by artist, see group_by_artist(), followed by a
+        summary of the least relevant ones when the budget is tight.
+    """
+    listed = group_by_artist(entries, details)
+    if estimate_tokens(listed) <= budget:
+        return listed
+    keep = min(keep, len(entries))
+    for kept in range(len(entries) - 1, keep - 1, -1):
+        parts = [group_by_artist(entries[:kept], details)] if kept else []
+        listed = "; ".join(parts + [summarize(entries[kept:])])
+        if estimate_tokens(listed) <= budget:
+            return listed
+    if keep:
+        return listed
+    return listed[:max(budget, 0) * CHARS_PER_TOKEN]
+
+
+def taste_summary(taste):
+    """Describe a TasteProfile's leading genres, moods and artists for a prompt."""
+    parts = []
+    for label, counts, limit in (
+        ("genres", taste.genres, 3), ("moods", taste.moods, 3), ("artists", taste.artists, 5)
+    ):
+        shares = TasteProfile.shares(counts, limit)
+        if shares:
+            parts.append(f"{label} " + ', '.join([f"{name} ({share:.0%})" for name, share in shares]))
+    return '; '.join(parts)
+
+
+def _finish(text):
+    metrics.observe_prompt(estimate_tokens(text))
+    return text
+
+
+def build_prompt(history=(), time_of_day=None, taste=None, genre=None, mood=None, query=None, candidates=(),
+                 count=20, budget=None):
+    """
+    Build a recommendation prompt within a token budget.
+
+    Args:
+        history (Iterable[Song | dict]): Songs the user played, most recent first.
+        time_of_day (str): Slot the history belongs to, optional.
+        taste (TasteProfile): The user's profile for the slot, optional.
+        genre (str): Requested genre, optional.
+        mood (str): Requested mood, optional.
+        query (str): Free text request, optional.
+        candidates (Iterable[Song]): Catalog songs to prefer; listed instead of
+            the history, the first `count` always in full.
+        count (int): Number of songs to ask for.
+        budget (int): Token budget, defaults to default_budget() for the
+            number of candidates. The fixed lines always fit; only the song
+            list is shortened.
+
+    Returns:
+        str: The prompt.
+    """
+    candidates = song_entries(candidates)
+    history = song_entries(history)
+    budget = budget or default_budget(len(candidates))
+    head = ["You are a music recommender."]
+    if query:
+        head.append(f'The user asks: "{query}".')
+    wanted = ", ".join(part for part in (genre and f"genre {genre}", mood and f"mood {mood}") if part)
+    if wanted:
+        head.append(f"They want {wanted}.")
+    summary = taste_summary(taste) if taste is not None else ""
+    if summary:
+        head.append(f"Their usual {time_of_day} taste: {summary}.")
+    tail = f'Reply with only a JSON object {{"{SONGS}":[...]}} holding {count} objects {SONG_SCHEMA}.'
+
+    if candidates:
+        label, closing, entries, details = "Catalog songs matching the request: ", " Prefer these.", candidates, True
+        keep = count
+    elif history:
+        played = f"in the {time_of_day}" if time_of_day else "recently"
+        label, closing, entries, details = f"Played {played} by artist, newest first: ", "", history, False
+        keep = 0
+    else:
+        label, closing, entries, details, keep = "", "", [], False, 0
+
+    if entries:
+        fixed = " ".join(head + [label + "." + closing, tail])
+        head.append(label + song_list(entries, budget - estimate_tokens(fixed), details, keep) + "." + closing)
+    elif not query and not wanted:
+        head.append("They have no recent listening history: pick popular songs across genres and moods.")
+    return _finish(" ".join(head + [tail]))
+
+
+def history_prompt(songs, current_time_of_day):
+    """Build the RecommendationView prompt from the user's recent songs."""
+    return build_prompt(history=songs, time_of_day=current_time_of_day)
+
+
+def taste_prompt(taste, current_time_of_day):
+    """Build the RecommendationView prompt from a user's TasteProfile for the slot."""
+    return build_prompt(history=taste.recent_songs, time_of_day=current_time_of_day, taste=taste)
+
+
+def filtered_prompt(songs, genre=None, mood=None):
+    """Build the FilteredRecommendationView prompt from matching songs and the filters."""
+    return build_prompt(history=songs, genre=genre, mood=mood)
+
+
+def search_prompt(query):
+    """Build the SearchRecommendationView prompt from a natural language query."""
+    return build_prompt(query=query)
+
+
+def candidate_search_prompt(query, candidates):
+    """Build the SearchRecommendationView prompt listing catalog songs that match the query."""
+    return build_prompt(query=query, candidates=candidates)
+
+
+def rerank_prompt(candidates, current_time_of_day, count=20, budget=None):
+    """
+    Build the prompt asking the LLM to re-rank vector engine candidates by id.
+
+    Candidates that do not fit the token budget are left out from the end of
+    the list, but never the first `count`; merge_ranking() appends them back
+    in engine order.
+
+    Args:
+        candidates (list[Song]): Candidates in vector engine order.
+        current_time_of_day (str): The slot being recommended for.
+        count (int): Number of ids to ask for, at most the number listed.
+        budget (int): Token budget, defaults to default_budget() for the
+            number of candidates.
+
+    Returns:
+        str: The prompt.
+    """
+    budget = budget or default_budget(len(candidates))
+    head = f"You are a music recommender. Catalog songs matching the user's {current_time_of_day} listening: "
+    tail = '. Reply with only a JSON object {{"{key}":[...]}} holding the ids of the {count} best songs, best first.'
+    available = (budget - estimate_tokens(head + tail.format(key=IDS, count=count))) * CHARS_PER_TOKEN
+    listed, length = [], 0
+    for song in candidates:
+        entry = f"{song.id}: {describe(song_entries([song])[0], ('genre', 'mood'))}"
+        length += len(entry) + (2 if listed else 0)
+        if length > available and len(listed) >= count:
+            break
+        listed.append(entry)
+    return _finish(head + "; ".join(listed) + tail.format(key=IDS, count=min(count, len(listed))))
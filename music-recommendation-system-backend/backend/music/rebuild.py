@@ -0,0 +1,98 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+
+# Process-wide values derived from the whole catalog: the grounding and BM25
+# indexes and the vector recommender. Each is built on first use. After that a
+# saved or deleted song no longer drops it: once the change is committed, a
+# background thread builds a fresh value and swaps it in, and requests keep
+# using the previous one meanwhile instead of all waiting behind a full
+# rebuild. Changes arriving during a rebuild are folded into one more rebuild.
+# With settings.CATALOG_REBUILD_IN_BACKGROUND off, a change drops the value and
+# the next request rebuilds it, which is what tests running inside a
+# transaction need.
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """
+    A value built from the catalog, replaced by a fresh one after changes.
+
+    Args:
+        build (Callable[[], object]): Builds the value from the database.
+        name (str): Name of the rebuild thread, for logs and debuggers.
+    """
+
+    def __init__(self, build, name):
+        self.build = build
+        self.name = name
+        self._value = None
+        self._rebuilding = False
+        self._stale = False
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the value, building it first if there is none yet.
+
+        Returns:
+            object: The current value, possibly one rebuild behind the catalog.
+        """
+        with self._lock:
+            if self._value is None:
+                self._value = self.build()
+            return self._value
+
+    def reset(self):
+        """Drop the value so the next get() builds it."""
+        with self._lock:
+            self._value = None
+            self._generation += 1
+
+    def changed(self, using=None):
+        """
+        Note a catalog change, from a post_save or post_delete receiver.
+
+        Args:
+            using (str): Database alias of the write, whose commit triggers the rebuild.
+        """
+        if not settings.CATALOG_REBUILD_IN_BACKGROUND:
+            self.reset()
+            return
+        transaction.on_commit(self.refresh, using=using)
+
+    def refresh(self):
+        """Rebuild the value on a background thread, unless nothing was built yet."""
+        with self._lock:
+            if self._value is None:
+                return
+            if self._rebuilding:
+                self._stale = True
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, name=self.name, daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            while True:
+                with self._lock:
+                    generation = self._generation
+                try:
+                    value = self.build()
+                except Exception:
+                    logger.exception("Rebuilding %s failed, the next request rebuilds it", self.name)
+                    value = None
+                with self._lock:
+                    # Left alone if reset() ran meanwhile
+                    if generation == self._generation:
+                        self._value = value
+                    if not self._stale or value is None:
+                        self._stale = self._rebuilding = False
+                        return
+                    self._stale = False
+        finally:
+            connections.close_all()
@@ -0,0 +1,384 @@
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .feedback import get_feedback
+from .models import GENRES, MOODS, Song, TasteProfile, latest_listened_songs
+from .rebuild import CatalogCache
+
+# Number of recent history rows used to build a user's taste profile
+PROFILE_HISTORY_SIZE = 200
+
+DEFAULT_WEIGHTS = {
+    "genre": 1.0,
+    "mood": 1.0,
+    "artist": 0.5,
+    "popularity": 0.3,
+    "liked_artist": 0.5,
+}
+
+_GENRE_INDEX = {g: i for i, g in enumerate(GENRES)}
+_MOOD_INDEX = {m: i for i, m in enumerate(MOODS)}
+
+
+class Catalog:
+    """
+    Column-oriented, in-memory copy of the Song table used for scoring.
+
+    Every song is reduced to integer codes so that scoring a profile against the
+    whole catalog is a handful of vectorized gathers instead of a Python loop.
+
+    Attributes:
+        ids (np.ndarray): Song primary keys, sorted ascending.
+        genre_mood (np.ndarray): Combined code genre * len(MOODS) + mood per song.
+        artist_codes (np.ndarray): Index into `artists` per song.
+        popularity (np.ndarray): Popularity scaled to [0, 1].
+        artists (np.ndarray): Distinct artist names.
+    """
+
+    def __init__(self, ids, genre_codes, mood_codes, artist_codes, popularity, artists):
+        order = np.argsort(ids, kind="stable")
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        genre_codes = np.asarray(genre_codes, dtype=np.int32)[order]
+        mood_codes = np.asarray(mood_codes, dtype=np.int32)[order]
+        self.genre_codes = genre_codes
+        self.mood_codes = mood_codes
+        self.genre_mood = (genre_codes * len(MOODS) + mood_codes).astype(
+            np.min_scalar_type(len(GENRES) * len(MOODS) - 1)
+        )
+        self.artist_codes = np.asarray(artist_codes, dtype=np.int32)[order]
+        # CSR-style index of song positions per artist, so boosting a few artists
+        # touches only their songs instead of gathering over the whole catalog.
+        self.artist_songs = np.argsort(self.artist_codes, kind="stable")
+        self.artist_offsets = np.searchsorted(
+            self.artist_codes[self.artist_songs], np.arange(len(artists) + 1)
+        )
+        popularity = np.asarray(popularity, dtype=np.float32)[order]
+        peak = popularity.max() if len(popularity) else 0
+        self.popularity = popularity / peak if peak > 0 else popularity
+        self.artists = np.asarray(artists)
+        self._artist_index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_database(cls):
+        """
+        Load the full Song table into a Catalog.
+
+        Returns:
+            Catalog: Snapshot of the current catalog.
+        """
+        rows = list(Song.objects.values_list("id", "genre", "mood", "artist", "popularity").iterator(chunk_size=10000))
+        if not rows:
+            return cls([], [], [], [], [], [])
+        ids, genres, moods, artists, popularity = zip(*rows)
+        artist_names, artist_codes = np.unique(np.asarray(artists, dtype=object).astype(str), return_inverse=True)
+        return cls(
+            ids,
+            [_GENRE_INDEX.get(g, 0) for g in genres],
+            [_MOOD_INDEX.get(m, 0) for m in moods],
+            artist_codes,
+            popularity,
+            artist_names,
+        )
+
+    def artist_code(self, name):
+        """
+        Return the code of an artist, or None if no song in the catalog has it.
+
+        Args:
+            name (str): Artist name.
+
+        Returns:
+            int | None: Index into `artists`.
+        """
+        if self._artist_index is None:
+            self._artist_index = {artist: code for code, artist in enumerate(self.artists.tolist())}
+        return self._artist_index.get(name)
+
+    def artist_positions(self, codes):
+        """
+        Return the catalog positions of every song by the given artists.
+
+        Args:
+            codes (Iterable[int]): Artist codes.
+
+        Returns:
+            np.ndarray: Row positions.
+        """
+        slices = [self.artist_songs[self.artist_offsets[code]:self.artist_offsets[code + 1]] for code in codes]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def positions(self, song_ids):
+        """
+        Translate song primary keys to row positions in the catalog.
+
+        Args:
+            song_ids (Iterable[int]): Song ids, unknown ids are dropped.
+
+        Returns:
+            np.ndarray: Row positions for the ids present in the catalog.
+        """
+        song_ids = np.asarray(list(song_ids), dtype=np.int64)
+        if not len(song_ids) or not len(self.ids):
+            return np.empty(0, dtype=np.int64)
+        pos = np.searchsorted(self.ids, song_ids)
+        pos = np.minimum(pos, len(self.ids) - 1)
+        return pos[self.ids[pos] == song_ids]
+
+
+class Profile:
+    """
+    A user's taste for one time-of-day slot, as normalized genre/mood/artist weights.
+
+    Attributes:
+        genre (np.ndarray): Share of listens per genre.
+        mood (np.ndarray): Share of listens per mood.
+        artist (dict): Artist code to share of listens.
+        positions (np.ndarray): Catalog positions of the songs the profile was built from.
+        liked_artists (np.ndarray): Codes of the artists of the user's liked songs.
+        excluded (np.ndarray): Catalog positions of the user's liked and skipped songs.
+    """
+
+    def __init__(self, genre, mood, artist, positions):
+        self.genre = genre
+        self.mood = mood
+        self.artist = artist
+        self.positions = positions
+        self.liked_artists = np.empty(0, dtype=np.int64)
+        self.excluded = np.empty(0, dtype=np.int64)
+
+    def apply_feedback(self, catalog, feedback):
+        """
+        Take the user's liked and skipped songs into account.
+
+        Args:
+            catalog (Catalog): The catalog the profile refers to.
+            feedback (SongFeedback): The user's liked and skipped songs.
+        """
+        liked = catalog.positions(feedback.liked)
+        self.liked_artists = np.unique(catalog.artist_codes[liked])
+        self.excluded = np.concatenate([liked, catalog.positions(feedback.skipped)])
+
+    @property
+    def is_empty(self):
+        return not len(self.positions)
+
+    @classmethod
+    def from_positions(cls, catalog, positions):
+        """
+        Aggregate catalog rows into a profile.
+
+        Args:
+            catalog (Catalog): The catalog the positions refer to.
+            positions (np.ndarray): Catalog positions of listened songs.
+
+        Returns:
+            Profile: Normalized taste profile.
+        """
+        total = max(len(positions), 1)
+        genre = np.bincount(catalog.genre_codes[positions], minlength=len(GENRES)) / total
+        mood = np.bincount(catalog.mood_codes[positions], minlength=len(MOODS)) / total
+        codes, counts = np.unique(catalog.artist_codes[positions], return_counts=True)
+        artist = dict(zip(codes.tolist(), (counts / total).tolist()))
+        return cls(genre.astype(np.float32), mood.astype(np.float32), artist, positions)
+
+    @classmethod
+    def from_taste(cls, catalog, taste):
+        """
+        Convert a stored TasteProfile into a profile over the catalog.
+
+        Args:
+            catalog (Catalog): The catalog to resolve artists and songs against.
+            taste (TasteProfile): The user's materialized taste for a slot.
+
+        Returns:
+            Profile: Normalized taste profile; its positions are the slot's recent songs.
+        """
+        genre = np.zeros(len(GENRES), dtype=np.float32)
+        for name, share in TasteProfile.shares(taste.genres):
+            if name in _GENRE_INDEX:
+                genre[_GENRE_INDEX[name]] = share
+        mood = np.zeros(len(MOODS), dtype=np.float32)
+        for name, share in TasteProfile.shares(taste.moods):
+            if name in _MOOD_INDEX:
+                mood[_MOOD_INDEX[name]] = share
+        artist = {}
+        for name, share in TasteProfile.shares(taste.artists):
+            code = catalog.artist_code(name)
+            if code is not None:
+                artist[code] = share
+        positions = catalog.positions([entry["id"] for entry in taste.recent_songs])
+        return cls(genre, mood, artist, positions)
+
+
+class VectorRecommender:
+    """
+    Scores every song in the catalog against a user profile with NumPy.
+
+    The score of song i is
+
+        w_g * genre[g_i] + w_m * mood[m_i] + w_a * artist[a_i] + w_p * popularity_i
+
+    which is the product of the catalog's one-hot genre/mood/artist matrix with the
+    profile vector. Since genre and mood are small closed sets, their part of the
+    product is folded into one lookup table indexed by the combined genre/mood code,
+    so a full pass over the catalog costs one gather and one addition; the artist
+    term only touches the songs of artists present in the profile.
+    """
+
+    def __init__(self, catalog, weights=None):
+        self.catalog = catalog
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self._popularity_term = (self.weights["popularity"] * catalog.popularity).astype(np.float32)
+
+    def score(self, profile):
+        """
+        Score the whole catalog for a profile.
+
+        Args:
+            profile (Profile): The user's taste profile.
+
+        Returns:
+            np.ndarray: One float32 score per catalog row.
+        """
+        table = (
+            self.weights["genre"] * profile.genre[:, None]
+            + self.weights["mood"] * profile.mood[None, :]
+        ).astype(np.float32).ravel()
+        scores = np.take(table, self.catalog.genre_mood)
+        scores += self._popularity_term
+        for code, weight in profile.artist.items():
+            start, end = self.catalog.artist_offsets[code], self.catalog.artist_offsets[code + 1]
+            scores[self.catalog.artist_songs[start:end]] += self.weights["artist"] * weight
+        if len(profile.liked_artists):
+            scores[self.catalog.artist_positions(profile.liked_artists)] += self.weights["liked_artist"]
+        return scores
+
+    def top_k(self, profile, k=20, exclude=None):
+        """
+        Return the catalog positions of the k best scoring songs.
+
+        Args:
+            profile (Profile): The user's taste profile.
+            k (int): Number of songs to return.
+            exclude (np.ndarray): Catalog positions that must not be returned.
+
+        Returns:
+            np.ndarray: Positions ordered from best to worst.
+        """
+        scores = self.score(profile)
+        if exclude is not None and len(exclude):
+            scores[exclude] = -np.inf
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.argpartition(scores, len(scores) - k)[-k:]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return candidates[np.isfinite(scores[candidates])]
+
+    def recommend(self, profile, k=20):
+        """
+        Recommend k song ids for a profile, skipping songs it was built from
+        and songs the user already liked or skipped.
+
+        Args:
+            profile (Profile): The user's taste profile.
+            k (int): Number of songs to return.
+
+        Returns:
+            list[int]: Song ids ordered from best to worst.
+        """
+        positions = self.top_k(profile, k=k, exclude=np.concatenate([profile.positions, profile.excluded]))
+        return self.catalog.ids[positions].tolist()
+
+
+def _load_recommender():
+    return VectorRecommender(Catalog.from_database(), weights=getattr(settings, "RECOMMENDER_WEIGHTS", None))
+
+
+_recommender = CatalogCache(_load_recommender, "vector-catalog")
+
+
+def get_recommender():
+    """
+    Return the process-wide recommender, loading the catalog on first use.
+
+    Returns:
+        VectorRecommender: Recommender over the catalog, reloaded in the
+        background after changes, see music.rebuild.
+    """
+    return _recommender.get()
+
+
+def invalidate_catalog():
+    """Drop the cached catalog so the next request reloads it."""
+    _recommender.reset()
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def _song_changed(sender, using=None, **kwargs):
+    _recommender.changed(using)
+
+
+def build_profile(catalog, user, time_of_day, limit=PROFILE_HISTORY_SIZE):
+    """
+    Build a user's profile for a time-of-day slot.
+
+    The materialized TasteProfile is used when present; otherwise the profile is
+    derived from the user's recent history in the slot.
+
+    Args:
+        catalog (Catalog): Catalog to resolve songs against.
+        user (User): The user.
+        time_of_day (str): One of TIME_OF_DAY.
+        limit (int): Number of most recent listens in the slot to consider.
+
+    Returns:
+        Profile: The user's profile for the slot.
+    """
+    taste = TasteProfile.objects.filter(user=user, time_of_day=time_of_day).first()
+    if taste is not None:
+        return Profile.from_taste(catalog, taste)
+
+    song_ids = [song.id for song in latest_listened_songs(limit, time_of_day=time_of_day, user=user)]
+    return Profile.from_positions(catalog, catalog.positions(song_ids))
+
+
+def recommend_song_ids(user, time_of_day, k=20):
+    """
+    Recommend songs for a user with the vector engine.
+
+    Songs the user liked or skipped are never returned; other songs by the
+    artists of liked songs get the "liked_artist" boost.
+
+    Args:
+        user (User): The user.
+        time_of_day (str): One of TIME_OF_DAY.
+        k (int): Number of songs to return.
+
+    Returns:
+        list[int]: Song ids ordered from best to worst.
+    """
+    recommender = get_recommender()
+    profile = build_profile(recommender.catalog, user, time_of_day)
+    profile.apply_feedback(recommender.catalog, get_feedback(user))
+    return recommender.recommend(profile, k=k)
+
+
+def songs_in_order(song_ids):
+    """
+    Fetch songs by id, preserving the given order.
+
+    Args:
+        song_ids (list[int]): Song ids.
+
+    Returns:
+        list[Song]: The songs that still exist, in the order of `song_ids`.
+    """
+    songs = Song.objects.in_bulk(song_ids)
+    return [songs[song_id] for song_id in song_ids if song_id in songs]
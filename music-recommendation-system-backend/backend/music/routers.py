@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Database routing between the primary and the read-only alias configured by
+# settings.DATABASE_READ_ALIAS. Only the read-heavy, append-mostly catalog and
+# listening history go to the read alias, where a little replication lag is
+# harmless; users, profiles and precomputed recommendations are read right
+# after they are written and stay on the primary.
+
+# Models whose reads may be served by the read alias, as "app_label.model_name"
+READ_MODELS = {"music.song", "music.listeninghistory"}
+
+
+class ReadWriteRouter:
+    """
+    Send history and catalog reads to settings.DATABASE_READ_ALIAS and every
+    write to the primary.
+
+    Inside a transaction on the primary, reads stay on the primary so that they
+    see the transaction's own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = settings.DATABASE_READ_ALIAS
+        if not alias or model._meta.label_lower not in READ_MODELS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, settings.DATABASE_READ_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The read alias gets its schema from the primary through replication
+        if settings.DATABASE_READ_ALIAS and db == settings.DATABASE_READ_ALIAS:
+            return False
+        return None
@@ -0,0 +1,179 @@
+import json
+
+from django.conf import settings
+
+from .json_stream import ArrayStreamParser
+from .renderers import loads
+
+# Structured output for LLM completions. With settings.LLM_STRUCTURED_OUTPUT the
+# chat completions API is asked for JSON matching a strict schema (an object
+# holding an array, as strict mode requires an object at the root). Whatever
+# comes back, from a model without structured output, a cache, or a fake
+# server, is then validated item by item: fixable items are repaired, the rest
+# dropped, and only a completion without any array fails as a whole.
+
+# Most characters kept per title or artist
+MAX_FIELD_LENGTH = 200
+
+SONGS = "songs"
+IDS = "ids"
+
+SCHEMAS = {
+    SONGS: {
+        "type": "object",
+        "properties": {
+            "songs": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"title": {"type": "string"}, "artist": {"type": "string"}},
+                    "required": ["title", "artist"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["songs"],
+        "additionalProperties": False,
+    },
+    IDS: {
+        "type": "object",
+        "properties": {"ids": {"type": "array", "items": {"type": "integer"}}},
+        "required": ["ids"],
+        "additionalProperties": False,
+    },
+}
+
+
+def response_format(kind):
+    """
+    Return the response_format argument of a chat completion for a schema.
+
+    Args:
+        kind (str): SONGS or IDS.
+
+    Returns:
+        dict | None: The json_schema response format, or None when
+        settings.LLM_STRUCTURED_OUTPUT is off.
+    """
+    if not settings.LLM_STRUCTURED_OUTPUT:
+        return None
+    return {"type": "json_schema", "json_schema": {"name": kind, "strict": True, "schema": SCHEMAS[kind]}}
+
+
+def _text(value):
+    if type(value) is str and len(value) <= MAX_FIELD_LENGTH and value.isprintable() and value == value.strip() \
+            and "  " not in value:
+        return value
+    if isinstance(value, list):
+        value = ", ".join(str(v) for v in value if isinstance(v, (str, int, float)))
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        return ""
+    return " ".join(str(value).split())[:MAX_FIELD_LENGTH]
+
+
+_SONG_KEYS = {"title", "artist"}
+
+
+def validate_song(item):
+    """
+    Coerce one LLM item into the song schema.
+
+    Titles and artists under other common keys ("song", "name", "by",
+    "artists") are accepted, lists of artists joined, numbers converted to
+    strings and whitespace collapsed. A bare string is taken as a title.
+
+    Args:
+        item: One decoded array element.
+
+    Returns:
+        dict | None: {"title", "artist"}, or None if no title can be found.
+    """
+    if isinstance(item, str):
+        item = {"title": item}
+    if not isinstance(item, dict):
+        return None
+    if item.keys() == _SONG_KEYS:
+        title, artist = _text(item["title"]), _text(item["artist"])
+        return {"title": title, "artist": artist} if title else None
+    title = _text(item.get("title") or item.get("song") or item.get("name"))
+    if not title:
+        return None
+    artist = _text(item.get("artist") or item.get("artists") or item.get("by"))
+    return {"title": title, "artist": artist}
+
+
+def validate_id(item):
+    """Coerce one LLM item into a song id, or None if it is not an integer."""
+    if isinstance(item, bool):
+        return None
+    if isinstance(item, int):
+        return item
+    if isinstance(item, str) and item.strip().isdigit():
+        return int(item)
+    if isinstance(item, dict):
+        return validate_id(item.get("id"))
+    return None
+
+
+VALIDATORS = {SONGS: validate_song, IDS: validate_id}
+
+
+def validate_items(items, kind=SONGS):
+    """
+    Validate decoded items against a schema.
+
+    Args:
+        items (list): Decoded array elements.
+        kind (str): SONGS or IDS.
+
+    Returns:
+        tuple[list, int]: Valid (possibly repaired) items and the number dropped.
+    """
+    validate = VALIDATORS[kind]
+    valid = [value for value in map(validate, items) if value is not None]
+    return valid, len(items) - len(valid)
+
+
+def extract_items(content, kind=SONGS):
+    """
+    Decode the array of items from a completion.
+
+    Tries, in order: the whole completion as JSON (a structured-output object
+    or a bare array), the text between the first "[" and the last "]", and
+    finally element by element, which salvages the well-formed items of a
+    truncated or partly malformed array.
+
+    Args:
+        content (str): The completion text.
+        kind (str): SONGS or IDS, the key of the array in a structured object.
+
+    Returns:
+        list: The decoded elements, not yet validated.
+
+    Raises:
+        json.JSONDecodeError: If the completion holds no array at all.
+    """
+    try:
+        decoded = loads(content)
+    except ValueError:
+        decoded = None
+    if isinstance(decoded, dict) and isinstance(decoded.get(kind), list):
+        return decoded[kind]
+    if isinstance(decoded, list):
+        return decoded
+
+    start, end = content.find("["), content.rfind("]") + 1
+    if 0 <= start < end:
+        try:
+            decoded = loads(content[start:end])
+            if isinstance(decoded, list):
+                return decoded
+        except ValueError:
+            pass
+
+    if kind == SONGS and start >= 0:
+        parser = ArrayStreamParser()
+        parser.feed(content)
+        if parser.items:
+            return parser.items
+    raise json.JSONDecodeError("No JSON array found in completion", content, max(start, 0))
@@ -0,0 +1,257 @@
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import stage
+from .models import Song
+from .rebuild import CatalogCache
+
+# Local full-text retrieval over the catalog for SearchRecommendationView. On
+# SQLite the music_song_fts FTS5 table (migration 0004) ranks songs with its
+# built-in bm25(); other databases use an in-memory BM25 index with the same
+# column weights.
+
+# Relative weight of matches per column, in the order of FIELDS
+FIELDS = ["title", "artist", "genre", "mood"]
+FIELD_WEIGHTS = [2.0, 1.5, 1.0, 1.0]
+
+# BM25 parameters, the defaults of SQLite FTS5
+K1 = 1.2
+B = 0.75
+
+# Terms found in more songs than this (a genre, a mood, "song") barely change
+# the ranking but make it scan a large share of the catalog. They are left out
+# whenever the query has rarer terms, and only required otherwise.
+COMMON_TERM_DOCS = 10_000
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    """Split text into casefolded word tokens without diacritics, like FTS5's unicode61."""
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    return _TOKEN.findall("".join(c for c in text if not unicodedata.combining(c)))
+
+
+def plan_query(query, document_counts):
+    """
+    Choose the terms of a query to retrieve songs with.
+
+    Args:
+        query (str): Free text query.
+        document_counts (Callable[[list[str]], dict]): Number of songs per term;
+            counts above COMMON_TERM_DOCS need not be exact.
+
+    Returns:
+        tuple[list[str], str]: The terms and how to combine them: "any" of the
+        selective terms, ranked by BM25, or "all" of the common ones, in id order
+        since such matches score nearly alike.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    counts = document_counts(terms) if terms else {}
+    present = [t for t in terms if counts.get(t)]
+    rare = [t for t in present if counts[t] <= COMMON_TERM_DOCS]
+    if rare:
+        return rare, "any"
+    return present, "all"
+
+
+def _fts_document_counts(cursor, terms):
+    # Counting stops past COMMON_TERM_DOCS, so probing a very common term stays
+    # cheap; an fts5vocab table would read its whole posting list.
+    counts = {}
+    for term in terms:
+        cursor.execute(
+            "SELECT count(*) FROM (SELECT 1 FROM music_song_fts WHERE music_song_fts MATCH %s LIMIT %s)",
+            [f'"{term}"', COMMON_TERM_DOCS + 1],
+        )
+        counts[term] = cursor.fetchone()[0]
+    return counts
+
+
+def fts_search(query, limit=20):
+    """
+    Rank songs for a query with the SQLite FTS5 index.
+
+    Args:
+        query (str): Free text query.
+        limit (int): Number of songs to return.
+
+    Returns:
+        list[int]: Song ids, best match first.
+    """
+    weights = ", ".join(str(w) for w in FIELD_WEIGHTS)
+    with connection.cursor() as cursor:
+        terms, combine = plan_query(query, lambda t: _fts_document_counts(cursor, t))
+        if not terms:
+            return []
+        # Quoting every term makes FTS5 take operators and punctuation literally.
+        if combine == "any":
+            match = " OR ".join(f'"{term}"' for term in terms)
+            order = f"bm25(music_song_fts, {weights}), rowid"
+        else:
+            match = " AND ".join(f'"{term}"' for term in terms)
+            order = "rowid"
+        cursor.execute(
+            f"SELECT rowid FROM music_song_fts WHERE music_song_fts MATCH %s ORDER BY {order} LIMIT %s",
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class BM25Index:
+    """
+    In-memory BM25 index over song title, artist, genre and mood.
+
+    Term frequencies are weighted per column like the FTS5 ranking. Posting
+    lists are numpy arrays, so a query is a few vectorized gathers and a
+    partial sort.
+
+    Attributes:
+        ids (np.ndarray): Song primary keys per position.
+        postings (dict): Token to (positions, weighted term frequencies).
+        lengths (np.ndarray): Weighted token count per song.
+    """
+
+    def __init__(self, rows):
+        ids, lengths = [], []
+        postings = defaultdict(lambda: ([], []))
+        for position, (song_id, *fields) in enumerate(rows):
+            frequencies = Counter()
+            length = 0.0
+            for value, weight in zip(fields, FIELD_WEIGHTS):
+                tokens = tokenize(value)
+                length += weight * len(tokens)
+                for token in tokens:
+                    frequencies[token] += weight
+            for token, frequency in frequencies.items():
+                positions, values = postings[token]
+                positions.append(position)
+                values.append(frequency)
+            ids.append(song_id)
+            lengths.append(length)
+
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.average_length = float(self.lengths.mean()) if len(ids) else 0.0
+        self.postings = {
+            token: (np.asarray(positions, dtype=np.int32), np.asarray(values, dtype=np.float32))
+            for token, (positions, values) in postings.items()
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_database(cls):
+        """
+        Index the full Song table.
+
+        Returns:
+            BM25Index: Index over the current catalog.
+        """
+        return cls(Song.objects.order_by("id").values_list("id", *FIELDS).iterator(chunk_size=10000))
+
+    def search(self, query, limit=20):
+        """
+        Rank songs for a query.
+
+        Args:
+            query (str): Free text query.
+            limit (int): Number of songs to return.
+
+        Returns:
+            list[int]: Song ids, best match first.
+        """
+        n = len(self.ids)
+        terms, combine = plan_query(
+            query, lambda terms: {t: len(self.postings[t][0]) for t in terms if t in self.postings}
+        )
+        if not terms or not n:
+            return []
+
+        if combine == "all":
+            matched = self.postings[terms[0]][0]
+            for term in terms[1:]:
+                matched = np.intersect1d(matched, self.postings[term][0], assume_unique=True)
+            return self.ids[matched[:limit]].tolist()
+
+        positions, scores = [], []
+        for term in terms:
+            term_positions, frequencies = self.postings[term]
+            df = len(term_positions)
+            idf = math.log((n - df + 0.5) / (df + 0.5) + 1)
+            norm = K1 * (1 - B + B * self.lengths[term_positions] / self.average_length)
+            positions.append(term_positions)
+            scores.append(idf * frequencies * (K1 + 1) / (frequencies + norm))
+        matched, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+
+        if len(matched) > limit:
+            top = np.argpartition(-totals, limit)[:limit]
+            matched, totals = matched[top], totals[top]
+        order = np.lexsort((matched, -totals))
+        return self.ids[matched[order]].tolist()
+
+
+_index = CatalogCache(BM25Index.from_database, "bm25-index")
+
+
+def get_bm25_index():
+    """
+    Return the process-wide BM25 index, building it on first use.
+
+    Returns:
+        BM25Index: Index over the catalog, rebuilt in the background after
+        changes, see music.rebuild.
+    """
+    return _index.get()
+
+
+def invalidate_bm25_index():
+    """Drop the cached BM25 index so the next search rebuilds it."""
+    _index.reset()
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def _song_changed(sender, using=None, **kwargs):
+    _index.changed(using)
+
+
+def use_fts():
+    """Tell whether searches should go through the FTS5 table."""
+    backend = getattr(settings, "SEARCH_BACKEND", "auto")
+    if backend == "auto":
+        return connection.vendor == "sqlite"
+    return backend == "fts"
+
+
+def search_song_ids(query, limit=20):
+    """
+    Retrieve catalog songs matching a free text query.
+
+    Uses FTS5 on SQLite and the in-memory BM25 index otherwise, or when the FTS5
+    table is missing.
+
+    Args:
+        query (str): Free text query.
+        limit (int): Number of songs to return.
+
+    Returns:
+        list[int]: Song ids, best match first.
+    """
+    with stage("search"):
+        if use_fts():
+            try:
+                return fts_search(query, limit)
+            except DatabaseError:
+                pass
+        return get_bm25_index().search(query, limit)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Song, User
+from .models import ListeningHistory, Song, User, latest_listens
 
 
 class SongSerializer(serializers.ModelSerializer):
@@ -15,16 +15,73 @@ class SongSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'artist', 'genre', 'mood', 'popularity']
 
 
+class ListeningEntrySerializer(serializers.ModelSerializer):
+    """
+    Serializer for one ListeningHistory row with its song nested.
+
+    Rolled-up listens are serialized as unsaved rows whose listened_at is the
+    middle of their slot.
+    """
+    song = SongSerializer(read_only=True)
+
+    class Meta:
+        model = ListeningHistory
+        fields = ['song', 'listened_at']
+
+
 class UserSerializer(serializers.ModelSerializer):
     """
     Serializer for the User model.
 
-    Serializes user profile data including preferences, liked/skipped songs, and listening history.
-    Note: 'listening_history' must be a related name and would require a nested or custom serializer
-    if you want to serialize full history details.
+    Serializes user profile data including preferences, liked/skipped songs and
+    the latest listens. Instances must come from load(), which bounds the
+    history and loads each relation in one query.
+
+    Args:
+        fields (Iterable[str]): Serialize only these fields, all by default.
     """
+    listening_history = ListeningEntrySerializer(source='recent_history', many=True, read_only=True)
+    liked_songs = SongSerializer(many=True, read_only=True)
+    skipped_songs = SongSerializer(many=True, read_only=True)
 
     class Meta:
         model = User
         fields = ['id', 'name', 'listening_history', 'liked_songs', 'skipped_songs', 'preferred_genres',
                   'preferred_moods']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def load(cls, user_id, fields=None, history_size=20):
+        """
+        Fetch a user with the relations among `fields` loaded for serialization.
+
+        The latest `history_size` listens and their songs come from one LIMIT
+        query on each of the raw and rolled-up history indexes, merged by time,
+        so the cost does not depend on the length of the user's history; each
+        song list takes one query.
+
+        Args:
+            user_id (int): The user.
+            fields (Iterable[str]): Fields that will be serialized, all by default.
+            history_size (int): Number of most recent listens.
+
+        Returns:
+            User: The user.
+
+        Raises:
+            User.DoesNotExist: If there is no such user.
+        """
+        fields = set(cls.Meta.fields if fields is None else fields)
+        songs = [name for name in ('liked_songs', 'skipped_songs') if name in fields]
+        user = User.objects.prefetch_related(*songs).get(id=user_id)
+        if 'listening_history' in fields:
+            user.recent_history = [
+                ListeningHistory(user=user, song=song, listened_at=listened_at)
+                for listened_at, song in latest_listens(history_size, user=user)
+            ]
+        return user
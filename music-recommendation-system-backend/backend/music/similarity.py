@@ -0,0 +1,350 @@
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from .feedback import get_feedback
+from .models import ListeningDailyCount, ListeningHistory, Song, TasteProfile, User, latest_listened_songs
+from .recommender import recommend_song_ids
+
+# Item-item collaborative filtering over co-listening. The build_similarity
+# command computes, offline, the cosine similarity between songs listened to (or
+# liked) by the same users and keeps the top-K neighbours per song in a single
+# .npy file. Web workers memory-map that file, so all processes on a host share
+# one copy of the neighbour table through the page cache.
+
+# Most recent distinct songs per user taken into account, which bounds the
+# quadratic number of song pairs a single heavy listener contributes
+MAX_USER_SONGS = 100
+
+# Interactions per bincount() in co_listening_neighbors()
+SLICE_SIZE = 1 << 20
+
+
+def index_dtype(top_k):
+    """
+    Return the row layout of the on-disk index.
+
+    Args:
+        top_k (int): Neighbours kept per song.
+
+    Returns:
+        np.dtype: Song id, neighbour row positions (-1 padded) and their scores.
+    """
+    return np.dtype([
+        ("id", np.int64),
+        ("neighbors", np.int32, (top_k,)),
+        ("scores", np.float16, (top_k,)),
+    ])
+
+
+def load_interactions(song_ids, chunk_size=1000, max_user_songs=MAX_USER_SONGS):
+    """
+    Load the distinct songs of every user as a CSR matrix of catalog positions.
+
+    Users are read in chunks, so the database never returns more than one chunk
+    of (user, song) rows at a time. Liked songs come first, then listened songs
+    from the most recent; each user keeps at most `max_user_songs`.
+
+    The result is not bounded by the chunks: it holds every user's songs, 4
+    bytes per (user, song) interaction plus 8 bytes per user, i.e. up to
+    users * (4 * max_user_songs + 8) bytes, about 400 MB for a million users
+    at the default cap, and twice the interactions while joining the chunks.
+    co_listening_neighbors() needs all of it at once, as each shard of songs
+    pairs them with every song of their listeners.
+
+    Args:
+        song_ids (np.ndarray): Sorted song ids; positions index into it.
+        chunk_size (int): Users per query.
+        max_user_songs (int): Cap on distinct songs per user.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (offsets, items) where the songs of user
+        row u are items[offsets[u]:offsets[u + 1]].
+    """
+    n = len(song_ids)
+    user_ids = np.fromiter(User.objects.order_by("id").values_list("id", flat=True).iterator(), dtype=np.int64)
+    liked = User.liked_songs.through.objects
+    lengths, parts = [], []
+
+    for offset in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[offset:offset + chunk_size]
+        ids = chunk.tolist()
+        rows = list(liked.filter(user_id__in=ids).values_list("user_id", "song_id"))
+        rows += ListeningHistory.objects.filter(user_id__in=ids).values(
+            "user_id", "song_id"
+        ).annotate(last=Max("listened_at")).order_by("user_id", "-last").values_list("user_id", "song_id")
+        # Rolled-up listens are nearly always older than raw ones, so they rank after them
+        rows += ListeningDailyCount.objects.filter(user_id__in=ids).values(
+            "user_id", "song_id"
+        ).annotate(last=Max("day")).order_by("user_id", "-last").values_list("user_id", "song_id")
+        counts = np.zeros(len(chunk), dtype=np.int64)
+        if rows and n:
+            pairs = np.asarray(rows, dtype=np.int64)
+            users = np.searchsorted(chunk, pairs[:, 0])
+            pos = np.minimum(np.searchsorted(song_ids, pairs[:, 1]), n - 1)
+            known = song_ids[pos] == pairs[:, 1]
+            users, pos = users[known], pos[known]
+            # Group by user, keeping liked-then-recent order within each user
+            order = np.argsort(users, kind="stable")
+            users, pos = users[order], pos[order]
+            _, first = np.unique(users * n + pos, return_index=True)
+            first.sort()
+            users, pos = users[first], pos[first]
+            rank = np.arange(len(users)) - np.searchsorted(users, users)
+            capped = rank < max_user_songs
+            users, pos = users[capped], pos[capped]
+            counts = np.bincount(users, minlength=len(chunk))
+            parts.append(pos.astype(np.int32))
+        lengths.append(counts.astype(np.int32))
+    del user_ids
+
+    lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int32)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    items = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+    return offsets, items
+
+
+def co_listening_neighbors(offsets, items, n, top_k=20, max_pairs=5_000_000):
+    """
+    Compute the top-k cosine neighbours of every song from user-song interactions.
+
+    Songs are processed in shards sized so that at most about `max_pairs` song
+    pairs are materialized at once, about 25 bytes each. Besides the shard and
+    the CSR input, the indexes over the interactions take 8 bytes per
+    interaction (16 while sorting them) and the per-song arrays about 40 bytes
+    per song, so the peak grows with the interactions, not with their pairs:
+    about 150 MB for 10M interactions plus 125 MB for the default shard.
+
+    Args:
+        offsets (np.ndarray): CSR offsets per user, from load_interactions().
+        items (np.ndarray): CSR song positions, from load_interactions().
+        n (int): Number of songs.
+        top_k (int): Neighbours kept per song.
+        max_pairs (int): Pair budget per shard.
+
+    Yields:
+        tuple[int, np.ndarray, np.ndarray]: (start, neighbors, scores) for the
+        songs start:start + len(neighbors); missing neighbours are -1 with score 0.
+    """
+    # Indexes over the interactions are int32 while they fit, halving them
+    index_type = np.int32 if len(items) < 2**31 else np.int64
+    user_len = np.diff(offsets).astype(np.int32)
+    user_of = np.repeat(np.arange(len(user_len), dtype=index_type), user_len)
+    # Summed per slice, as bincount() copies its input to int64 and float64
+    degree = np.zeros(n, dtype=np.int64)
+    work = np.zeros(n, dtype=np.float64)
+    for offset in range(0, len(items), SLICE_SIZE):
+        part = items[offset:offset + SLICE_SIZE]
+        degree += np.bincount(part, minlength=n)
+        work += np.bincount(part, weights=user_len[user_of[offset:offset + SLICE_SIZE]], minlength=n)
+    work = work.cumsum()
+    by_item = np.argsort(items, kind="stable").astype(index_type)
+    item_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(degree, out=item_offsets[1:])
+
+    start = 0
+    while start < n:
+        done = work[start - 1] if start else 0
+        stop = max(int(np.searchsorted(work, done + max_pairs, side="right")), start + 1)
+        stop = min(stop, n)
+
+        entries = by_item[item_offsets[start]:item_offsets[stop]]
+        a, users = items[entries], user_of[entries]
+        lengths = user_len[users]
+        ends = lengths.cumsum()
+        b = items[np.repeat(offsets[users] - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)]
+        a = np.repeat(a, lengths)
+        other = a != b
+        keys, counts = np.unique((a[other] - start).astype(np.int64) * n + b[other], return_counts=True)
+        rows, cols = keys // n + start, keys % n
+        scores = counts / np.sqrt(degree[rows].astype(np.float64) * degree[cols])
+
+        order = np.lexsort((cols, -scores, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        keep = rank < top_k
+
+        neighbors = np.full((stop - start, top_k), -1, dtype=np.int32)
+        block_scores = np.zeros((stop - start, top_k), dtype=np.float32)
+        neighbors[rows[keep] - start, rank[keep]] = cols[keep]
+        block_scores[rows[keep] - start, rank[keep]] = scores[keep]
+        yield start, neighbors, block_scores
+        start = stop
+
+
+def build_index(path, top_k=20, chunk_size=1000, max_user_songs=MAX_USER_SONGS, max_pairs=5_000_000):
+    """
+    Build the co-listening index from the database and atomically replace `path`.
+
+    Args:
+        path (str): Destination .npy file.
+        top_k (int): Neighbours kept per song.
+        chunk_size (int): Users per database query.
+        max_user_songs (int): Cap on distinct songs per user.
+        max_pairs (int): Pair budget per shard, see co_listening_neighbors().
+
+    Yields:
+        tuple[int, int]: (songs done, total songs) after each shard.
+    """
+    song_ids = np.fromiter(Song.objects.order_by("id").values_list("id", flat=True).iterator(), dtype=np.int64)
+    n = len(song_ids)
+    offsets, items = load_interactions(song_ids, chunk_size, max_user_songs)
+
+    tmp_path = f"{path}.tmp"
+    table = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=index_dtype(top_k), shape=(n,))
+    try:
+        table["id"] = song_ids
+        for start, neighbors, scores in co_listening_neighbors(offsets, items, n, top_k, max_pairs):
+            table["neighbors"][start:start + len(neighbors)] = neighbors
+            table["scores"][start:start + len(neighbors)] = scores
+            yield start + len(neighbors), n
+        if not n:
+            yield 0, 0
+        table.flush()
+    finally:
+        del table
+    os.replace(tmp_path, path)
+
+
+class SimilarityIndex:
+    """
+    Read-only view of a co-listening index file.
+
+    The neighbour table stays memory-mapped; only the song id column is copied
+    into process memory (8 bytes per song) so it can be binary searched.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.ids = np.ascontiguousarray(table["id"])
+        self.neighbors = table["neighbors"]
+        self.scores = table["scores"]
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory-map an index file written by build_index().
+
+        Args:
+            path (str): The .npy file.
+
+        Returns:
+            SimilarityIndex: The index.
+        """
+        return cls(np.load(path, mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def similar(self, song_ids, k=20, exclude=()):
+        """
+        Recommend songs co-listened with the given ones.
+
+        Each candidate is scored by the sum of its similarity to the seed songs.
+
+        Args:
+            song_ids (Iterable[int]): Seed song ids, unknown ids are ignored.
+            k (int): Number of songs to return.
+            exclude (Iterable[int]): Song ids never to return, besides the seeds.
+
+        Returns:
+            list[int]: Song ids ordered from most to least similar.
+        """
+        seeds = np.asarray(list(song_ids), dtype=np.int64)
+        if not len(seeds) or not len(self.ids):
+            return []
+        pos = np.minimum(np.searchsorted(self.ids, seeds), len(self.ids) - 1)
+        pos = np.unique(pos[self.ids[pos] == seeds])
+        if not len(pos):
+            return []
+
+        neighbors = np.asarray(self.neighbors[pos]).ravel()
+        scores = np.asarray(self.scores[pos], dtype=np.float32).ravel()
+        valid = neighbors >= 0
+        candidates, inverse = np.unique(neighbors[valid], return_inverse=True)
+        totals = np.bincount(inverse, weights=scores[valid], minlength=len(candidates))
+        candidate_ids = self.ids[candidates]
+
+        allowed = ~np.isin(candidate_ids, np.concatenate([seeds, np.asarray(list(exclude), dtype=np.int64)]))
+        candidate_ids, totals = candidate_ids[allowed], totals[allowed]
+        order = np.lexsort((candidate_ids, -totals))[:k]
+        return candidate_ids[order].tolist()
+
+
+_lock = threading.Lock()
+_index = None
+_index_stamp = None
+
+
+def index_path():
+    return str(getattr(settings, "SIMILARITY_INDEX_PATH", ""))
+
+
+def get_similarity_index():
+    """
+    Return the process-wide similarity index, or None if it has not been built.
+
+    The file is re-mapped when a rebuild replaces it.
+
+    Returns:
+        SimilarityIndex | None: The index.
+    """
+    global _index, _index_stamp
+    path = index_path()
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    stamp = (path, stat.st_ino, stat.st_mtime_ns)
+    with _lock:
+        if stamp != _index_stamp:
+            _index, _index_stamp = SimilarityIndex.open(path), stamp
+        return _index
+
+
+def seed_song_ids(user, time_of_day, limit=20):
+    """
+    Return the user's latest song ids in a time-of-day slot.
+
+    Args:
+        user (User): The user.
+        time_of_day (str): One of TIME_OF_DAY.
+        limit (int): Number of songs.
+
+    Returns:
+        list[int]: Song ids, most recent first.
+    """
+    taste = TasteProfile.objects.filter(user=user, time_of_day=time_of_day).first()
+    if taste is not None:
+        return [entry["id"] for entry in taste.recent_songs[:limit]]
+    return [song.id for song in latest_listened_songs(limit, time_of_day=time_of_day, user=user)]
+
+
+def similar_song_ids(user, time_of_day, k=20):
+    """
+    Recommend songs co-listened with the user's latest songs in a time-of-day slot.
+
+    Falls back to, or tops up with, the vector engine when the index has not been
+    built or knows too few neighbours. Songs the user skipped are left out.
+
+    Args:
+        user (User): The user.
+        time_of_day (str): One of TIME_OF_DAY.
+        k (int): Number of songs to return.
+
+    Returns:
+        list[int]: Song ids ordered from best to worst.
+    """
+    index = get_similarity_index()
+    if index is None:
+        return recommend_song_ids(user, time_of_day, k=k)
+    seeds = seed_song_ids(user, time_of_day)
+    song_ids = index.similar(seeds, k=k, exclude=get_feedback(user).skipped)
+    if len(song_ids) < k:
+        seen = set(song_ids) | set(seeds)
+        song_ids += [s for s in recommend_song_ids(user, time_of_day, k=2 * k) if s not in seen][:k - len(song_ids)]
+    return song_ids
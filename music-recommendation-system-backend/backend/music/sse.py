@@ -0,0 +1,107 @@
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+EVENT_STREAM = "text/event-stream"
+
+
+def format_event(event, data):
+    """
+    Encode one server-sent event.
+
+    Args:
+        event (str): Event name.
+        data: JSON-serializable payload.
+
+    Returns:
+        str: The event in text/event-stream framing.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ServerSentEventRenderer(BaseRenderer):
+    """
+    Lets DRF views negotiate text/event-stream (via Accept or ?format=sse).
+
+    Streaming views return their own StreamingHttpResponse; this renderer only
+    renders regular responses, such as errors, as a single event.
+    """
+    media_type = EVENT_STREAM
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get("response")
+        event = "error" if response is not None and response.status_code >= 400 else "message"
+        return format_event(event, data).encode(self.charset)
+
+
+def wants_event_stream(request):
+    """
+    Tell whether a plain Django request asked for server-sent events.
+
+    Args:
+        request (HttpRequest): The request.
+
+    Returns:
+        bool: True for ?format=sse or an Accept header of text/event-stream.
+    """
+    return request.GET.get("format") == "sse" or EVENT_STREAM in request.headers.get("Accept", "")
+
+
+def song_events(songs):
+    """
+    Turn an iterable of songs into "song" events followed by a "done" event.
+
+    Args:
+        songs (Iterable[dict]): Songs, typically from llm.stream_recommend().
+
+    Yields:
+        str: Encoded events.
+    """
+    count = 0
+    for song in songs:
+        count += 1
+        yield format_event("song", song)
+    yield format_event("done", {"count": count})
+
+
+async def asong_events(songs):
+    """
+    Async variant of song_events().
+
+    Args:
+        songs (AsyncIterable[dict] | Iterable[dict]): Songs, typically from
+            llm.astream_recommend(); plain iterables are accepted for results
+            that are already complete.
+
+    Yields:
+        str: Encoded events.
+    """
+    count = 0
+    if not hasattr(songs, "__aiter__"):
+        for song in songs:
+            count += 1
+            yield format_event("song", song)
+    else:
+        async for song in songs:
+            count += 1
+            yield format_event("song", song)
+    yield format_event("done", {"count": count})
+
+
+def event_stream_response(events):
+    """
+    Wrap encoded events in a streaming response that proxies will not buffer.
+
+    Args:
+        events (Iterable[str] | AsyncIterable[str]): Encoded events.
+
+    Returns:
+        StreamingHttpResponse: The text/event-stream response.
+    """
+    response = StreamingHttpResponse(events, content_type=EVENT_STREAM)
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -1,3 +1,1698 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import openai
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import llm
+from .auth import issue_token, token_error, verify_password, verify_token
+from .batch import batch_prompts
+from .browse import decode_cursor, get_facets, invalidate_facets, song_page
+from .compaction import compact_history
+from .conditional import max_age
+from .deadline import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, arecommend_within, get_breaker, recommend_within, reset_breaker,
+)
+from .fake_llm import FakeLLMServer
+from .feedback import FeedbackCache, SongFeedback, get_feedback, get_feedback_cache, invalidate_feedback
+from .ingest import IngestBuffer, get_known_ids, invalidate_known_ids, parse_events, write_rows
+from .grounding import GroundingIndex, get_grounding_index, ground_stream, invalidate_grounding_index
+from .json_stream import ArrayStreamParser
+from .management.commands.benchmark import percentile
+from .management.commands.feedback_footprint import feedback_footprint
+from .management.commands.write_storm import write_storm
+from .llm_cache import LRUResponseCache, cache_key, get_cache, reset_cache
+from .metrics import (
+    DB_QUERIES, LLM_DURATION, LLM_PARSE_FAILURES, LLM_TOKENS, REQUEST_DURATION, STAGE_DURATION, Histogram,
+)
+from .models import (
+    ListeningDailyCount,
+    ListeningHistory,
+    PrecomputedRecommendation,
+    Song,
+    TasteProfile,
+    User,
+    latest_listened_songs_per_user,
+)
+from .precompute import changed_users
+from .renderers import ORJSONRenderer, dumps
+from .routers import ReadWriteRouter
+from .profiles import rebuild_profiles
+from .prompts import (
+    SONG_SCHEMA, build_prompt, candidate_search_prompt, estimate_tokens, filtered_prompt, history_prompt,
+    rerank_prompt, search_prompt, song_entries,
+)
+from .rebuild import CatalogCache
+from .schemas import IDS, extract_items, validate_items
+from .search import BM25Index, fts_search, plan_query, search_song_ids
+from .similarity import SimilarityIndex, build_index, co_listening_neighbors
+from .views import filtered_songs, recent_songs
+from .serializers import SongSerializer
+from .recommender import get_recommender, invalidate_catalog, recommend_song_ids
+
+MORNING = datetime(2025, 1, 1, 9, tzinfo=timezone.utc)
+EVENING = datetime(2025, 1, 1, 20, tzinfo=timezone.utc)
+
+
+@override_settings(CATALOG_REBUILD_IN_BACKGROUND=False)
+class RecommenderTestCase(TestCase):
+    """Shared fixtures: a small catalog and a user with a Jazz/Relaxing morning habit."""
+
+    def setUp(self):
+        invalidate_catalog()
+        invalidate_grounding_index()
+        invalidate_known_ids()
+        invalidate_facets()
+        invalidate_feedback()
+        reset_cache()
+        reset_breaker()
+        self.api = APIClient()
+        self.user = User.objects.create(name="Test", username="test")
+        self.jazz = [
+            Song.objects.create(title=f"Jazz {i}", artist="Trio", genre="Jazz", mood="Relaxing", popularity=10)
+            for i in range(5)
+        ]
+        self.pop = [
+            Song.objects.create(title=f"Pop {i}", artist="Star", genre="Pop", mood="Happy", popularity=100)
+            for i in range(5)
+        ]
+        for song in self.jazz[:2]:
+            ListeningHistory.objects.create(user=self.user, song=song, listened_at=MORNING)
+
+
+@mock.patch("music.views.get_time_of_day", return_value="Morning")
+class VectorRecommenderTests(RecommenderTestCase):
+
+    def test_profile_outranks_popularity_and_skips_listened(self, _):
+        ids = recommend_song_ids(self.user, "Morning", k=3)
+        self.assertEqual(set(ids), {s.id for s in self.jazz[2:5]})
+
+    def test_empty_profile_falls_back_to_popularity(self, _):
+        ids = recommend_song_ids(self.user, "Evening", k=5)
+        self.assertEqual(set(ids), {s.id for s in self.pop})
+
+    def test_catalog_is_reloaded_after_song_changes(self, _):
+        self.assertEqual(len(get_recommender().catalog), 10)
+        Song.objects.create(title="New", artist="New", genre="Rock", mood="Angry")
+        self.assertEqual(len(get_recommender().catalog), 11)
+
+    @override_settings(RECOMMENDER_BACKEND="vector")
+    def test_vector_backend_serializes_catalog_songs(self, _):
+        response = self.api.get(f"/api/recommendations/{self.user.id}/")
+        self.assertEqual(response.status_code, 200)
+        songs = response.json()["recommended_songs"]
+        self.assertEqual(len(songs), 8)
+        self.assertEqual(songs[0]["genre"], "Jazz")
+
+    @override_settings(RECOMMENDER_BACKEND="hybrid")
+    def test_hybrid_backend_follows_llm_order(self, _):
+        preferred = self.pop[0].id
+        with mock.patch("music.llm.complete", return_value=f"[{preferred}, 999999]"):
+            response = self.api.get(f"/api/recommendations/{self.user.id}/")
+        songs = response.json()["recommended_songs"]
+        self.assertEqual(songs[0]["id"], preferred)
+        self.assertEqual(len(songs), 8)
+
+
+class LLMCacheTests(RecommenderTestCase):
+
+    def test_lru_evicts_oldest_and_expires_entries(self):
+        clock = mock.Mock(return_value=0.0)
+        cache = LRUResponseCache(ttl=10, max_entries=2, clock=clock)
+        cache.set("a", [1])
+        cache.set("b", [2])
+        cache.get("a")
+        cache.set("c", [3])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), [1])
+        clock.return_value = 11.0
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_key_ignores_whitespace_and_case_but_not_model(self):
+        self.assertEqual(cache_key("Jazz  for\nwork", "gpt-4o"), cache_key("jazz for work", "gpt-4o"))
+        self.assertNotEqual(cache_key("jazz", "gpt-4o"), cache_key("jazz", "gpt-4o-mini"))
+
+    def test_identical_search_hits_llm_once(self):
+        with mock.patch("music.llm.complete", return_value='[{"title": "So What"}]') as complete:
+            for _ in range(3):
+                response = self.api.post("/api/recommendations/search/", {"query": "cool jazz"}, format="json")
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(complete.call_count, 1)
+        self.assertEqual(get_cache().stats()["hits"], 2)
+
+    def test_unparseable_responses_are_not_cached(self):
+        with mock.patch("music.llm.complete", side_effect=["oops", '[{"title": "So What"}]']) as complete:
+            first = self.api.post("/api/recommendations/search/", {"query": "cool jazz"}, format="json")
+            second = self.api.post("/api/recommendations/search/", {"query": "cool jazz"}, format="json")
+        self.assertEqual(first.status_code, 400)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(complete.call_count, 2)
+
+    @override_settings(LLM_CACHE={"BACKEND": "django"})
+    def test_django_backend_is_shared_through_cache_alias(self):
+        reset_cache()
+        get_cache().clear()
+        with mock.patch("music.llm.complete", return_value='[{"title": "So What"}]') as complete:
+            self.api.post("/api/recommendations/search/", {"query": "cool jazz"}, format="json")
+            reset_cache()
+            self.api.post("/api/recommendations/search/", {"query": "cool jazz"}, format="json")
+        self.assertEqual(complete.call_count, 1)
+
+
+class AsyncRecommendationTests(RecommenderTestCase):
+
+    async def test_single_flight_coalesces_concurrent_calls(self):
+        flights = llm.SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "done"
+
+        results = await asyncio.gather(*[flights.do("key", work) for _ in range(50)])
+        self.assertEqual(results, ["done"] * 50)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(flights), 0)
+
+    async def test_identical_concurrent_searches_trigger_one_upstream_call(self):
+        async def slow_complete(prompt, model=None, **kwargs):
+            await asyncio.sleep(0.01)
+            return '[{"title": "So What"}]'
+
+        client = AsyncClient()
+        with mock.patch("music.llm.acomplete", side_effect=slow_complete) as acomplete:
+            responses = await asyncio.gather(*[
+                client.post("/api/async/recommendations/search/", {"query": "cool jazz"},
+                            content_type="application/json")
+                for _ in range(10)
+            ])
+        self.assertEqual({r.status_code for r in responses}, {200})
+        self.assertEqual(acomplete.call_count, 1)
+
+    @override_settings(LLM_MAX_CONCURRENCY=2, OPENAI_API_KEY="test")
+    def test_outstanding_llm_calls_are_capped(self):
+        with FakeLLMServer(latency=0.02) as server, override_settings(OPENAI_BASE_URL=server.base_url):
+            with mock.patch("music.llm._async_client", None):
+                async def run():
+                    try:
+                        return await asyncio.gather(*[llm.acomplete(f"prompt {i}") for i in range(6)])
+                    finally:
+                        await llm.get_async_client().close()
+
+                asyncio.run(run())
+        self.assertEqual(server.requests, 6)
+        self.assertEqual(server.peak_in_flight, 2)
+
+    async def test_async_filtered_view_requires_a_filter(self):
+        response = await AsyncClient().get(f"/api/async/recommendations/filter/{self.user.id}/")
+        self.assertEqual(response.status_code, 400)
+
+
+class StreamingTests(RecommenderTestCase):
+    SONGS = [{"title": f"So [What] {i}", "artist": 'Miles "D", {Trio}'} for i in range(5)]
+
+    def completion_chunks(self, size=3):
+        text = "Here are [5] picks:\n```json\n" + json.dumps(self.SONGS) + "\n```"
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def test_parser_emits_each_object_regardless_of_chunking(self):
+        for size in (1, 3, 7, 1000):
+            parser = ArrayStreamParser()
+            emitted = [song for chunk in self.completion_chunks(size) for song in parser.feed(chunk)]
+            self.assertEqual(emitted, self.SONGS)
+            self.assertTrue(parser.done)
+            self.assertEqual(parser.skipped, 0)
+
+    def test_parser_skips_malformed_and_unfinished_elements(self):
+        parser = ArrayStreamParser()
+        emitted = parser.feed('[{"title": "A"}, {"title": B}, 7, {"title": "C"}, {"title": "D')
+        self.assertEqual(emitted, [{"title": "A"}, {"title": "C"}])
+        self.assertEqual(parser.skipped, 2)
+        self.assertFalse(parser.done)
+
+    def test_sync_view_streams_song_events(self):
+        with mock.patch("music.llm.stream", return_value=iter(self.completion_chunks())):
+            response = self.api.post("/api/recommendations/search/?format=sse", {"query": "jazz"}, format="json")
+            body = b"".join(response.streaming_content).decode()
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(body.count("event: song"), 5)
+        self.assertIn('event: done\ndata: {"count": 5}', body)
+
+    def test_sync_view_renders_errors_as_events(self):
+        response = self.api.get("/api/recommendations/filter/999/", HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(response.content.startswith(b"event: error"))
+
+    async def test_async_view_streams_song_events(self):
+        async def astream(prompt, model=None, **kwargs):
+            for chunk in self.completion_chunks():
+                yield chunk
+
+        with mock.patch("music.llm.astream", side_effect=astream):
+            response = await AsyncClient().get(
+                f"/api/async/recommendations/filter/{self.user.id}/",
+                {"genre": "Jazz"}, headers={"Accept": "text/event-stream"},
+            )
+            body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(body.count("event: song"), 5)
+
+
+@mock.patch("music.views.get_time_of_day", return_value="Morning")
+class HistoryQueryTests(RecommenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Many more recent evening listens bury the two morning ones.
+        for i in range(30):
+            ListeningHistory.objects.create(
+                user=self.user, song=self.pop[i % 5], listened_at=EVENING.replace(day=2 + i % 20)
+            )
+        get_grounding_index()
+        # Skipped songs are cached per process, like the grounding index
+        get_feedback(self.user)
+
+    def test_time_of_day_filter_reaches_past_other_slots(self, _):
+        self.assertEqual(recent_songs(self.user, "Morning"), self.jazz[:2])
+        self.assertEqual(len(recent_songs(self.user, "Evening")), 20)
+        self.assertEqual(recent_songs(self.user, "Afternoon"), [])
+
+    def test_filtered_songs_limit_is_applied_in_sql(self, _):
+        self.assertEqual(len(filtered_songs(self.user, genre="Pop", limit=7)), 7)
+        self.assertEqual(filtered_songs(self.user, genre="Jazz", mood="Relaxing"), self.jazz[:2])
+
+    def test_recommendation_view_query_count(self, _):
+        with mock.patch("music.llm.complete", return_value="[]") as complete, self.assertNumQueries(3):
+            self.api.get(f"/api/recommendations/{self.user.id}/")
+        self.assertIn("in the Morning by artist, newest first: Trio: Jazz", complete.call_args.args[0])
+
+    def test_filtered_view_query_count(self, _):
+        # Raw and rolled-up history are both read to merge them by time
+        with mock.patch("music.llm.complete", return_value="[]"), self.assertNumQueries(3):
+            self.api.get(f"/api/recommendations/filter/{self.user.id}/", {"genre": "Pop", "mood": "Happy"})
+
+
+@mock.patch("music.views.get_time_of_day", return_value="Morning")
+class TasteProfileTests(RecommenderTestCase):
+
+    def profile(self, time_of_day="Morning"):
+        return TasteProfile.objects.get(user=self.user, time_of_day=time_of_day)
+
+    def test_listens_update_profile_incrementally(self, _):
+        profile = self.profile()
+        self.assertEqual((profile.listens, profile.genres), (2, {"Jazz": 2.0}))
+        self.assertEqual([entry["id"] for entry in profile.recent_songs], [s.id for s in self.jazz[:2]])
+        ListeningHistory.objects.create(user=self.user, song=self.pop[0], listened_at=EVENING)
+        self.assertEqual(self.profile("Evening").genres, {"Pop": 1.0})
+        self.assertEqual(self.profile().listens, 2)
+
+    @override_settings(TASTE_PROFILE_HALF_LIFE_DAYS=10)
+    def test_older_listens_decay(self, _):
+        ListeningHistory.objects.create(user=self.user, song=self.pop[0], listened_at=MORNING + timedelta(days=10))
+        profile = self.profile()
+        self.assertAlmostEqual(profile.genres["Jazz"], 1.0)
+        self.assertAlmostEqual(profile.genres["Pop"], 1.0)
+        # Late-arriving old listens are weighted by their age too.
+        ListeningHistory.objects.create(user=self.user, song=self.pop[1], listened_at=MORNING - timedelta(days=10))
+        self.assertAlmostEqual(self.profile().genres["Pop"], 1.25)
+
+    def test_rebuild_matches_incremental(self, _):
+        for day in range(1, 25):
+            ListeningHistory.objects.create(
+                user=self.user, song=self.pop[day % 5], listened_at=MORNING + timedelta(days=day % 7, hours=day % 3, minutes=day)
+            )
+        incremental = {p.time_of_day: p for p in TasteProfile.objects.filter(user=self.user)}
+        self.assertEqual(list(rebuild_profiles()), [1])
+        for profile in TasteProfile.objects.filter(user=self.user):
+            expected = incremental[profile.time_of_day]
+            self.assertEqual(profile.listens, expected.listens)
+            self.assertEqual(profile.recent_songs, expected.recent_songs)
+            for key, weight in expected.genres.items():
+                self.assertAlmostEqual(profile.genres[key], weight)
+
+    def test_views_read_profile_instead_of_history(self, _):
+        get_grounding_index()
+        get_feedback(self.user)
+        with mock.patch("music.llm.complete", return_value="[]") as complete, self.assertNumQueries(3):
+            self.api.get(f"/api/recommendations/{self.user.id}/")
+        prompt = complete.call_args.args[0]
+        self.assertIn("Trio: Jazz", prompt)
+        self.assertIn("genres Jazz (100%)", prompt)
+        self.assertEqual(set(recommend_song_ids(self.user, "Morning", k=3)), {s.id for s in self.jazz[2:]})
+
+
+@mock.patch("music.async_views.get_time_of_day", return_value="Morning")
+class BatchRecommendationTests(RecommenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.others = [User.objects.create(name=f"User {i}", username=f"user{i}") for i in range(3)]
+        for i, user in enumerate(self.others):
+            ListeningHistory.objects.bulk_create([
+                ListeningHistory(user=user, song=self.pop[j], listened_at=MORNING + timedelta(minutes=j))
+                for j in range(i + 2)
+            ])
+        self.user.skipped_songs.add(self.jazz[4])
+
+    def test_history_is_windowed_per_user_in_one_query(self, _):
+        with self.assertNumQueries(1):
+            songs = ListeningHistory.objects.filter(user__in=self.others).latest_songs_per_user(limit=2)
+        self.assertEqual(songs[self.others[0].id], [self.pop[1], self.pop[0]])
+        self.assertEqual(songs[self.others[2].id], [self.pop[3], self.pop[2]])
+
+    def test_prompts_take_constant_queries(self, _):
+        user_ids = [self.user.id] + [u.id for u in self.others] + [999]
+        with self.assertNumQueries(4):
+            prompts = batch_prompts(user_ids, "Morning")
+        self.assertEqual(set(prompts), set(user_ids) - {999})
+        self.assertIn("Trio: Jazz", prompts[self.user.id])
+        self.assertIn("Star: Pop 3, Pop 2", prompts[self.others[2].id])
+        with self.assertNumQueries(3):
+            prompts = batch_prompts(user_ids, "Morning", genre="Pop")
+        self.assertIn("genre Pop", prompts[self.others[0].id])
+
+    async def post(self, body):
+        response = await AsyncClient().post("/api/async/recommendations/batch/", body, content_type="application/json")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        content = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        return {line["user_id"]: line for line in map(json.loads, content.splitlines())}
+
+    async def test_streams_each_user_and_reports_errors(self, _):
+        failing = self.others[0].id
+        in_flight, peak = 0, 0
+
+        async def arecommend(prompt, model=None, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            if "Star: Pop 1, Pop 0" in prompt and "Pop 2" not in prompt:
+                raise json.JSONDecodeError("bad", "", 0)
+            return [{"title": "Unknown Song"}, {"title": "Jazz 4", "artist": "Trio"}]
+
+        user_ids = [self.user.id, *[u.id for u in self.others], 999]
+        with mock.patch("music.llm.arecommend", side_effect=arecommend):
+            results = await self.post({"user_ids": user_ids, "concurrency": 2})
+        self.assertEqual(set(results), set(user_ids))
+        self.assertEqual(results[999]["status"], 404)
+        self.assertEqual(results[failing]["status"], 502)
+        self.assertEqual(results[self.user.id]["recommended_songs"], [{"title": "Unknown Song", "id": None}])
+        self.assertEqual(results[self.others[1].id]["recommended_songs"][1], SongSerializer(self.jazz[4]).data)
+        self.assertEqual(peak, 2)
+
+    @override_settings(LLM_DEADLINES={"batch": 0.05}, LLM_BREAKER={"FAILURES": 2, "RESET_TIMEOUT": 60})
+    async def test_slow_llm_is_bounded_and_trips_the_breaker(self, _):
+        async def arecommend(prompt, model=None, **kwargs):
+            await asyncio.sleep(1)
+
+        user_ids = [self.user.id, *[u.id for u in self.others]]
+        with mock.patch("music.llm.arecommend", side_effect=arecommend) as called:
+            started = time.perf_counter()
+            results = await self.post({"user_ids": user_ids, "concurrency": 1})
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, 1.0)
+        # Later users are answered by the open breaker without calling the LLM
+        self.assertEqual(called.call_count, 2)
+        self.assertTrue(all(result["degraded"] for result in results.values()))
+        # The vector engine's songs, without the skipped Jazz 4
+        songs = results[self.user.id]["recommended_songs"]
+        self.assertEqual([song["id"] for song in songs[:1]], [self.jazz[2].id])
+        self.assertNotIn(self.jazz[4].id, [song["id"] for song in songs])
+        with mock.patch("music.llm.arecommend", side_effect=arecommend):
+            results = await self.post({"user_ids": [self.user.id], "genre": "Pop"})
+        self.assertEqual(results[self.user.id]["recommended_songs"][0]["genre"], "Pop")
+
+    @override_settings(AUTH_TOKEN_REQUIRED=True)
+    async def test_tokens_only_cover_their_user(self, _):
+        client, url = AsyncClient(), "/api/async/recommendations/batch/"
+        body = {"user_ids": [self.user.id, self.others[0].id]}
+        response = await client.post(url, body, content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+        headers = {"Authorization": f"Bearer {issue_token(self.user)}"}
+        response = await client.post(url, body, content_type="application/json", headers=headers)
+        self.assertEqual(response.status_code, 403)
+        with mock.patch("music.llm.arecommend", return_value=[]):
+            response = await client.post(url, {"user_ids": [self.user.id]}, content_type="application/json", headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    async def test_rejects_invalid_bodies(self, _):
+        client = AsyncClient()
+        for body in ({}, {"user_ids": ["x"]}, {"user_ids": list(range(6000))}):
+            response = await client.post("/api/async/recommendations/batch/", body, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+
+
+class GroundingTests(RecommenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cover = Song.objects.create(title="Jazz 1", artist="Big Band", genre="Jazz", mood="Happy", popularity=50)
+        self.index = get_grounding_index()
+
+    def test_resolves_variants_and_disambiguates_by_artist(self):
+        self.assertEqual(self.index.resolve("Pop 3", "Star"), self.pop[3].id)
+        self.assertEqual(self.index.resolve("  POP-3!", "star"), self.pop[3].id)
+        self.assertEqual(self.index.resolve("Jazz 1", "Trio"), self.jazz[1].id)
+        self.assertEqual(self.index.resolve("Jazz 1", "The Big Band"), self.cover.id)
+        self.assertIsNone(self.index.resolve("Bohemian Rhapsody", "Queen"))
+
+    def test_fuzzy_match_survives_typos(self):
+        index = GroundingIndex(
+            [1, 2, 3], ["Take Five", "So What", "Blue in Green"], ["Dave Brubeck", "Miles Davis", "Miles Davis"], [1, 1, 1]
+        )
+        self.assertEqual(index.resolve("Take Fife", "Dave Brubek"), 1)
+        self.assertEqual(index.resolve("Blue n Green"), 3)
+        self.assertIsNone(index.resolve("Giant Steps", "John Coltrane"))
+
+    def test_index_refreshes_when_catalog_changes(self):
+        Song.objects.create(title="Giant Steps", artist="Coltrane", genre="Jazz", mood="Energetic", popularity=5)
+        self.assertIsNotNone(get_grounding_index().resolve("Giant Steps"))
+
+    def test_streamed_songs_are_grounded_without_queries(self):
+        items = [
+            {"title": "Pop 2", "artist": "Star"}, {"title": "Imagine"}, {"title": "Jazz 4", "artist": "Trio"},
+            {"title": "jazz 1", "artist": "Big Band"}, {"title": "pop 2"},
+        ]
+        with self.assertNumQueries(0):
+            songs = list(ground_stream(items, exclude={self.jazz[4].id}))
+        self.assertEqual(
+            songs, [SongSerializer(self.pop[2]).data, {"title": "Imagine", "id": None}, SongSerializer(self.cover).data]
+        )
+
+    def test_view_returns_catalog_songs_and_flags_unknown_ones(self):
+        completion = json.dumps([
+            {"title": "Pop 2", "artist": "Star"}, {"title": "pop 2"}, {"title": "Imagine", "artist": "John Lennon"},
+        ])
+        with mock.patch("music.llm.complete", return_value=completion):
+            response = self.api.post("/api/recommendations/search/", {"query": "pop"}, format="json")
+        songs = response.json()["recommended_songs"]
+        self.assertEqual(songs[0], SongSerializer(self.pop[2]).data)
+        self.assertEqual(songs[1], {"title": "Imagine", "artist": "John Lennon", "id": None})
+        self.assertEqual(len(songs), 2)
+
+    @override_settings(LLM_GROUNDING=False)
+    def test_grounding_can_be_disabled(self):
+        with mock.patch("music.llm.complete", return_value='[{"title": "Pop 2"}]'):
+            response = self.api.post("/api/recommendations/search/", {"query": "pop"}, format="json")
+        self.assertEqual(response.json()["recommended_songs"], [{"title": "Pop 2", "artist": ""}])
+
+
+class SearchTests(RecommenderTestCase):
+
+    def search_both(self, query, limit=20):
+        fts = fts_search(query, limit)
+        self.assertEqual(BM25Index.from_database().search(query, limit), fts)
+        return fts
+
+    def test_backends_rank_alike(self):
+        self.assertEqual(self.search_both("Jazz 3")[0], self.jazz[3].id)
+        self.assertEqual(set(self.search_both("songs by star")), {s.id for s in self.pop})
+        self.assertEqual(set(self.search_both("relaxing evening")), {s.id for s in self.jazz})
+        self.assertEqual(self.search_both('"AND (OR* - ^'), [])
+
+    def test_common_terms_are_only_required(self):
+        counts = {"jazz": 5, "relaxing": 5, "3": 2}.get
+        with mock.patch("music.search.COMMON_TERM_DOCS", 3):
+            self.assertEqual(plan_query("jazz 3", lambda terms: {t: counts(t) for t in terms}), (["3"], "any"))
+            self.assertEqual(plan_query("Relaxing jazz", lambda terms: {t: counts(t) for t in terms}), (["relaxing", "jazz"], "all"))
+            self.assertEqual(self.search_both("relaxing jazz", limit=3), [s.id for s in self.jazz[:3]])
+
+    def test_fts_index_follows_writes(self):
+        self.jazz[0].title = "Blue in Green"
+        self.jazz[0].save()
+        Song.objects.filter(id=self.pop[0].id).delete()
+        Song.objects.bulk_create([Song(title="Green Onions", artist="Booker T", genre="Rock", mood="Happy", popularity=1)])
+        self.assertEqual(set(fts_search("green")), {self.jazz[0].id, Song.objects.get(title="Green Onions").id})
+        self.assertNotIn(self.pop[0].id, fts_search("star"))
+        with override_settings(SEARCH_BACKEND="bm25"):
+            self.assertEqual(search_song_ids("blue"), [self.jazz[0].id])
+
+    @override_settings(SEARCH_MODE="local")
+    def test_local_mode_skips_the_llm(self):
+        with mock.patch("music.llm.complete") as complete:
+            response = self.api.post("/api/recommendations/search/", {"query": "pop 2"}, format="json")
+        complete.assert_not_called()
+        self.assertEqual(response.json()["recommended_songs"][0], SongSerializer(self.pop[2]).data)
+
+    def test_candidates_are_injected_into_prompt(self):
+        with mock.patch("music.llm.complete", return_value="[]") as complete:
+            self.api.post("/api/recommendations/search/", {"query": "something relaxing"}, format="json")
+        self.assertIn("matching the request: all Jazz, Relaxing; Trio: Jazz 0", complete.call_args.args[0])
+
+
+class CatalogRebuildTests(RecommenderTestCase):
+
+    @override_settings(CATALOG_REBUILD_IN_BACKGROUND=True)
+    def test_changes_are_rebuilt_in_the_background(self):
+        release = threading.Event()
+        builds = []
+
+        def build():
+            builds.append(len(builds) + 1)
+            if len(builds) > 1:
+                release.wait(5)
+            return builds[-1]
+
+        def wait_for(value):
+            deadline = time.monotonic() + 5
+            while cache.get() != value and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(cache.get(), value)
+
+        cache = CatalogCache(build, "test-catalog")
+        self.assertEqual(cache.get(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.changed()
+            self.assertEqual(builds, [1])
+        # Readers keep the old value while the rebuild runs, and the changes
+        # arriving meanwhile make a single extra rebuild
+        self.assertEqual(cache.get(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.changed()
+            cache.changed()
+        release.set()
+        wait_for(3)
+        self.assertEqual(builds, [1, 2, 3])
+
+        # Nothing is built ahead of the first request
+        cache.reset()
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.changed()
+        self.assertEqual(builds, [1, 2, 3])
+
+
+class SimilarityIndexTests(RecommenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Two other users pair jazz[0] with jazz[3], one also with pop[0].
+        for i, songs in enumerate([[self.jazz[0], self.jazz[3]], [self.jazz[0], self.jazz[3], self.pop[0]]]):
+            other = User.objects.create(name=f"Other {i}", username=f"other{i}")
+            for song in songs:
+                ListeningHistory.objects.create(user=other, song=song, listened_at=MORNING)
+        self.user.liked_songs.add(self.pop[4])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "similarity.npy")
+
+    def build(self, **options):
+        list(build_index(self.path, **options))
+        return SimilarityIndex.open(self.path)
+
+    def test_cosine_neighbors(self):
+        offsets, items = [0, 2, 5], [0, 1, 0, 1, 2]
+        (start, neighbors, scores), = co_listening_neighbors(np.array(offsets), np.array(items), 4, top_k=2)
+        self.assertEqual(neighbors.tolist(), [[1, 2], [0, 2], [0, 1], [-1, -1]])
+        self.assertAlmostEqual(scores[0, 0], 1.0)
+        self.assertAlmostEqual(scores[0, 1], 1 / np.sqrt(2))
+
+    def test_shards_match_single_pass(self):
+        offsets, items = np.array([0, 3, 6, 8]), np.array([0, 1, 2, 1, 2, 3, 0, 3])
+        whole = list(co_listening_neighbors(offsets, items, 4, top_k=3))
+        sharded = list(co_listening_neighbors(offsets, items, 4, top_k=3, max_pairs=1))
+        self.assertEqual(len(sharded), 4)
+        self.assertEqual(np.vstack([n for _, n, _ in sharded]).tolist(), whole[0][1].tolist())
+
+    def test_index_is_memory_mapped_and_ranks_co_listened_songs(self):
+        index = self.build(top_k=5)
+        self.assertIsInstance(index.table, np.memmap)
+        self.assertEqual(len(index), 10)
+        self.assertEqual(index.similar([self.jazz[0].id], k=2), [self.jazz[3].id, self.jazz[1].id])
+        self.assertEqual(index.similar([self.jazz[0].id], k=5, exclude=[self.jazz[3].id])[0], self.jazz[1].id)
+        self.assertEqual(index.similar([12345]), [])
+
+    def test_liked_songs_count_as_interactions(self):
+        index = self.build()
+        self.assertIn(self.pop[4].id, index.similar([self.jazz[1].id]))
+
+    @mock.patch("music.views.get_time_of_day", return_value="Morning")
+    def test_similar_backend_serves_from_index(self, _):
+        self.build()
+        with override_settings(RECOMMENDER_BACKEND="similar", SIMILARITY_INDEX_PATH=self.path):
+            response = self.api.get(f"/api/recommendations/{self.user.id}/")
+        ids = [s["id"] for s in response.json()["recommended_songs"]]
+        # pop[4] is close to both seeds through the user's own like
+        self.assertEqual(ids[:2], [self.pop[4].id, self.jazz[3].id])
+        self.assertEqual(len(ids), 8)
+        self.assertFalse({s.id for s in self.jazz[:2]} & set(ids))
+
+
+@override_settings(RECOMMENDER_BACKEND="vector")
+@mock.patch("music.views.get_time_of_day", return_value="Morning")
+class AuthTests(RecommenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user.set_password("secret-pass")
+
+    def login(self, password="secret-pass"):
+        return self.api.post("/api/login/", {"username": "test", "password": password}, format="json")
+
+    def test_login_returns_token_accepted_by_views(self, _):
+        self.assertEqual(self.login("wrong").status_code, 400)
+        body = self.login().json()
+        self.assertEqual(body["user_id"], self.user.id)
+        self.assertEqual(verify_token(body["token"]), self.user.id)
+
+        url = f"/api/recommendations/{self.user.id}/"
+        self.assertEqual(self.api.get(url, HTTP_AUTHORIZATION=f"Bearer {body['token']}").status_code, 200)
+        self.assertEqual(self.api.get(url, HTTP_AUTHORIZATION=f"Bearer {body['token']}x").status_code, 401)
+        other = User.objects.create(name="Other", username="other")
+        other_url = f"/api/recommendations/filter/{other.id}/"
+        self.assertEqual(
+            self.api.get(other_url, {"genre": "Pop"}, HTTP_AUTHORIZATION=f"Bearer {body['token']}").status_code, 403
+        )
+        self.assertEqual(self.api.get(url).status_code, 200)
+        with override_settings(AUTH_TOKEN_REQUIRED=True):
+            self.assertEqual(self.api.get(url).status_code, 401)
+
+    def test_expired_token_rejected(self, _):
+        token = self.login().json()["token"]
+        with override_settings(AUTH_TOKEN_MAX_AGE=-1):
+            self.assertEqual(token_error(mock.Mock(headers={"Authorization": f"Bearer {token}"}), self.user.id)[0], 401)
+
+    def test_outdated_hash_is_upgraded_on_login(self, _):
+        hasher = PBKDF2PasswordHasher()
+        User.objects.filter(pk=self.user.pk).update(password=hasher.encode("secret-pass", hasher.salt(), iterations=1000))
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(hasher.decode(self.user.password)["iterations"], hasher.iterations)
+        self.assertEqual(self.login().status_code, 200)
+
+    async def test_async_login_hashes_off_the_event_loop(self, _):
+        hasher = PBKDF2PasswordHasher()
+        await User.objects.filter(pk=self.user.pk).aupdate(password=hasher.encode("secret-pass", hasher.salt(), iterations=1000))
+        client = AsyncClient()
+        threads = []
+
+        def verify(*args):
+            threads.append(threading.current_thread().name)
+            return verify_password(*args)
+
+        with mock.patch("music.auth.verify_password", side_effect=verify):
+            response = await client.post("/api/async/login/", {"username": "test", "password": "secret-pass"},
+                                         content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(threads[0].startswith("password-hasher"))
+        token = response.json()["token"]
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertEqual(hasher.decode(user.password)["iterations"], hasher.iterations)
+
+        wrong = await client.post("/api/async/login/", {"username": "test", "password": "nope"},
+                                  content_type="application/json")
+        self.assertEqual(wrong.status_code, 400)
+        with mock.patch("music.async_views.get_time_of_day", return_value="Morning"):
+            ok = await client.get(f"/api/async/recommendations/{self.user.id}/", headers={"Authorization": f"Bearer {token}"})
+            bad = await client.get(f"/api/async/recommendations/{self.user.id}/", headers={"Authorization": "Bearer junk"})
+        self.assertEqual((ok.status_code, bad.status_code), (200, 401))
+
+
+@mock.patch("music.views.get_time_of_day", return_value="Morning")
+@override_settings(RECOMMENDER_BACKEND="llm", LLM_CACHE={"BACKEND": "none"})
+class PrecomputeTests(RecommenderTestCase):
+
+    def precompute(self, *args):
+        completion = json.dumps([{"title": "Jazz 4", "artist": "Trio"}])
+        with mock.patch("music.llm.complete", return_value=completion) as complete:
+            call_command("precompute_recommendations", "--workers", "0", *args, stdout=StringIO())
+        return complete
+
+    def test_command_stores_every_slot(self, _):
+        other = User.objects.create(name="Other", username="other")
+        self.assertEqual(self.precompute().call_count, 6)
+        self.assertEqual(PrecomputedRecommendation.objects.filter(user=other).count(), 3)
+        row = PrecomputedRecommendation.objects.get(user=self.user, time_of_day="Morning")
+        self.assertEqual([song["id"] for song in row.songs], [self.jazz[4].id])
+        self.assertEqual(row.history_last_id, ListeningHistory.objects.filter(user=self.user).latest("id").id)
+
+    def test_view_serves_fresh_rows_without_llm(self, _):
+        self.precompute()
+        with mock.patch("music.llm.complete") as complete:
+            response = self.api.get(f"/api/recommendations/{self.user.id}/")
+        complete.assert_not_called()
+        self.assertEqual([song["id"] for song in response.json()["recommended_songs"]], [self.jazz[4].id])
+
+    def test_new_listens_and_age_make_rows_stale(self, _):
+        self.precompute()
+        ListeningHistory.objects.create(user=self.user, song=self.pop[0], listened_at=EVENING)
+        with mock.patch("music.llm.complete", return_value="[]") as complete:
+            self.api.get(f"/api/recommendations/{self.user.id}/")
+        complete.assert_called_once()
+
+        other = User.objects.create(name="Other", username="other")
+        self.assertEqual(list(changed_users(timedelta(hours=1))), [self.user.id, other.id])
+        self.assertEqual(self.precompute().call_count, 6)
+        self.assertEqual(changed_users(timedelta(hours=1)), {})
+        self.assertEqual(self.precompute().call_count, 0)
+        PrecomputedRecommendation.objects.filter(user=other).update(generated_at=EVENING)
+        self.assertEqual(list(changed_users(timedelta(hours=1))), [other.id])
+        self.assertEqual(self.precompute("--force").call_count, 6)
+
+    @override_settings(PRECOMPUTED_RECOMMENDATIONS=False)
+    def test_disabled(self, _):
+        self.precompute()
+        with mock.patch("music.llm.complete", return_value="[]") as complete:
+            self.api.get(f"/api/recommendations/{self.user.id}/")
+        complete.assert_called_once()
+
+
+@mock.patch("music.views.get_time_of_day", return_value="Morning")
+@override_settings(RECOMMENDER_BACKEND="llm", LLM_CACHE={"BACKEND": "none"}, PRECOMPUTED_RECOMMENDATIONS=False)
+class MetricsTests(RecommenderTestCase):
+
+    def fake_client(self, content):
+        response = mock.Mock(usage=mock.Mock(prompt_tokens=120, completion_tokens=30))
+        response.choices = [mock.Mock(message=mock.Mock(content=content))]
+        client = mock.Mock()
+        client.chat.completions.create.return_value = response
+        return mock.patch("music.llm.get_client", return_value=client)
+
+    def test_histogram_exposition(self, _):
+        histogram = Histogram("h_seconds", "Help.", ("endpoint",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, "a\"b")
+        self.assertEqual(list(histogram.samples()), [
+            'h_seconds_bucket{endpoint="a\\"b",le="0.1"} 1',
+            'h_seconds_bucket{endpoint="a\\"b",le="1.0"} 2',
+            'h_seconds_bucket{endpoint="a\\"b",le="+Inf"} 3',
+            'h_seconds_sum{endpoint="a\\"b"} 5.55',
+            'h_seconds_count{endpoint="a\\"b"} 3',
+        ])
+
+    def test_recommendation_is_instrumented(self, _):
+        get_grounding_index()
+        get_feedback(self.user)
+        before = (
+            REQUEST_DURATION.count("recommendations", "GET", "200"), LLM_DURATION.count("recommendations", "complete"),
+            LLM_TOKENS.sum("recommendations", "prompt"), DB_QUERIES.sum("recommendations"),
+            STAGE_DURATION.count("recommendations", "render"),
+        )
+        with self.fake_client('[{"title": "Jazz 4", "artist": "Trio"}]'), \
+                override_settings(METRICS_SERVER_TIMING=True):
+            response = self.api.get(f"/api/recommendations/{self.user.id}/")
+        after = (
+            REQUEST_DURATION.count("recommendations", "GET", "200"), LLM_DURATION.count("recommendations", "complete"),
+            LLM_TOKENS.sum("recommendations", "prompt"), DB_QUERIES.sum("recommendations"),
+            STAGE_DURATION.count("recommendations", "render"),
+        )
+        self.assertEqual([b - a for a, b in zip(before, after)], [1, 1, 120, 2, 1])
+        timing = response["Server-Timing"]
+        for entry in ('db;desc="2 queries"', "llm;dur=", "parse;dur=", "ground;dur=", "render;dur=", "total;dur="):
+            self.assertIn(entry, timing)
+
+        with self.fake_client("[]"):
+            self.assertNotIn("Server-Timing", self.api.get(f"/api/recommendations/{self.user.id}/"))
+        exposition = self.client.get("/api/metrics").content.decode()
+        self.assertIn('soundify_llm_tokens_sum{endpoint="recommendations",kind="completion"}', exposition)
+        self.assertIn("# TYPE soundify_request_duration_seconds histogram", exposition)
+
+    def test_parse_failures_are_counted(self, _):
+        before = LLM_PARSE_FAILURES.value("recommendations")
+        with self.fake_client("Sorry, no songs today."):
+            response = self.api.get(f"/api/recommendations/{self.user.id}/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(LLM_PARSE_FAILURES.value("recommendations"), before + 1)
+
+
+class PromptTests(RecommenderTestCase):
+
+    def test_repeats_are_listed_once_with_play_count(self):
+        history = [self.jazz[1], self.jazz[0], self.jazz[1], {"title": "jazz 1", "artist": "TRIO"}]
+        entries = song_entries(history)
+        self.assertEqual([(e.title, e.plays) for e in entries], [("Jazz 1", 3), ("Jazz 0", 1)])
+        self.assertIn("newest first: Trio: Jazz 1 x3, Jazz 0.", history_prompt(history, "Morning"))
+
+    def test_long_history_is_summarized_within_budget(self):
+        songs = [
+            Song(title=f"A rather long song title number {i}", artist=f"Artist {i % 3}", genre="Jazz", mood="Calm")
+            for i in range(60)
+        ]
+        full = build_prompt(history=songs, time_of_day="Morning", budget=10_000)
+        self.assertIn("number 59", full)
+        prompt = build_prompt(history=songs, time_of_day="Morning", budget=150)
+        self.assertLessEqual(estimate_tokens(prompt), 150)
+        self.assertIn("Artist 0: A rather long song title number 0,", prompt)
+        self.assertNotIn("number 59", prompt)
+        self.assertRegex(prompt, r"\d+ more songs: artists Artist \d x\d+, .*; genres Jazz x\d+; moods Calm x\d+")
+        self.assertTrue(prompt.endswith(f'Reply with only a JSON object {{"songs":[...]}} holding 20 objects {SONG_SCHEMA}.'))
+
+    def test_prompts_for_each_view(self):
+        self.assertIn("They want genre Pop, mood Happy.", filtered_prompt([], "Pop", "Happy"))
+        self.assertIn("no recent listening history", history_prompt([], "Evening"))
+        self.assertIn('The user asks: "cool jazz".', search_prompt("cool jazz"))
+        prompt = rerank_prompt(self.jazz * 20, "Morning", count=5, budget=120)
+        self.assertLessEqual(estimate_tokens(prompt), 120)
+        self.assertIn(f"{self.jazz[0].id}: Jazz 0 by Trio (Jazz, Relaxing)", prompt)
+        self.assertTrue(prompt.endswith('JSON object {"ids":[...]} holding the ids of the 5 best songs, best first.'))
+
+    def test_candidates_are_listed_in_full_with_default_settings(self):
+        songs = [
+            Song(id=1000 + i, title=f"Candidate song title {i}", artist=f"Artist {i % 7}", genre="Jazz", mood="Calm")
+            for i in range(settings.RECOMMENDER_RERANK_TOP_K)
+        ]
+        prompt = rerank_prompt(songs, "Morning")
+        self.assertTrue(all(f"{song.id}: " in prompt for song in songs))
+        self.assertIn("the ids of the 20 best songs", prompt)
+        prompt = candidate_search_prompt("calm jazz", songs[:settings.SEARCH_CANDIDATES])
+        self.assertIn(f"Candidate song title {settings.SEARCH_CANDIDATES - 1}", prompt)
+        self.assertNotIn("more songs", prompt)
+
+        # A tight budget still lists the songs asked for, and never asks for more than listed
+        prompt = rerank_prompt(songs, "Morning", count=10, budget=50)
+        self.assertEqual(prompt.count(": Candidate"), 10)
+        self.assertIn("the ids of the 10 best songs", prompt)
+        self.assertIn("the ids of the 3 best songs", rerank_prompt(songs[:3], "Morning"))
+        prompt = build_prompt(query="calm jazz", candidates=songs, count=20, budget=50)
+        self.assertIn("Candidate song title 19", prompt)
+        self.assertIn("30 more songs", prompt)
+
+    def test_prompt_tokens_are_reported(self):
+        with mock.patch("music.metrics.observe_prompt") as observe:
+            prompt = search_prompt("cool jazz")
+        observe.assert_called_once_with(estimate_tokens(prompt))
+
+
+class SchemaTests(RecommenderTestCase):
+
+    def test_items_are_extracted_from_objects_prose_and_truncated_arrays(self):
+        song = {"title": "Jazz 1", "artist": "Trio"}
+        self.assertEqual(extract_items(json.dumps({"songs": [song]})), [song])
+        self.assertEqual(extract_items(f"Sure!\n```json\n[{json.dumps(song)}]\n```"), [song])
+        self.assertEqual(extract_items('[{"title": "Jazz 1", "artist": "Trio"}, {"title": "Ja'), [song])
+        self.assertEqual(extract_items('{"ids": [3, 1]}', IDS), [3, 1])
+        with self.assertRaises(json.JSONDecodeError):
+            extract_items("Sorry, no songs today.")
+
+    def test_invalid_items_are_repaired_or_dropped(self):
+        completion = json.dumps([
+            {"title": "  Jazz   1 ", "artist": "Trio"},
+            {"song": "Pop 2", "artists": ["Star", "Guest"]},
+            "Imagine",
+            {"artist": "Nobody"},
+            42,
+        ])
+        with mock.patch("music.llm.complete", return_value=completion), \
+                mock.patch("music.metrics.count_dropped_items") as dropped:
+            songs = llm.parse_completion(completion)
+        self.assertEqual(songs, [
+            {"title": "Jazz 1", "artist": "Trio"},
+            {"title": "Pop 2", "artist": "Star, Guest"},
+            {"title": "Imagine", "artist": ""},
+        ])
+        dropped.assert_called_once_with(2)
+        self.assertEqual(validate_items([3, "4", {"id": 5}, True, "x"], IDS), ([3, 4, 5], 2))
+
+    @override_settings(LLM_CACHE={"BACKEND": "none"})
+    def test_structured_output_is_requested_unless_disabled(self):
+        completion = mock.Mock(content='{"songs": [{"title": "Jazz 1", "artist": "Trio"}]}')
+        response = mock.Mock(choices=[mock.Mock(message=completion)], usage=None)
+        client = mock.Mock()
+        client.chat.completions.create.return_value = response
+        with mock.patch("music.llm.get_client", return_value=client):
+            self.assertEqual(llm.recommend("prompt"), [{"title": "Jazz 1", "artist": "Trio"}])
+            response_format = client.chat.completions.create.call_args.kwargs["response_format"]
+            self.assertEqual(response_format["json_schema"]["name"], "songs")
+            self.assertTrue(response_format["json_schema"]["strict"])
+            with override_settings(LLM_STRUCTURED_OUTPUT=False):
+                llm.recommend("prompt")
+            self.assertNotIn("response_format", client.chat.completions.create.call_args.kwargs)
+
+    def test_renderer_matches_drf_json_renderer(self):
+        data = {"recommended_songs": SongSerializer(self.jazz, many=True).data, "note": "café ✓"}
+        expected = JSONRenderer().render(data)
+        self.assertEqual(ORJSONRenderer().render(data), expected)
+        with mock.patch("music.renderers.orjson", None):
+            self.assertEqual(ORJSONRenderer().render(data), expected)
+            self.assertEqual(dumps(data), expected)
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+    def test_api_responses_use_the_orjson_renderer(self):
+        with mock.patch("music.llm.complete", return_value='[{"title": "Pop 2", "artist": "Star"}]'), \
+                mock.patch("music.renderers.dumps", wraps=dumps) as render:
+            response = self.api.post("/api/recommendations/search/", {"query": "pop"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        render.assert_called_once()
+
+
+class DatabaseRoutingTests(RecommenderTestCase):
+
+    @override_settings(DATABASE_READ_ALIAS=None)
+    def test_reads_without_a_read_alias_use_the_default(self):
+        self.assertIsNone(ReadWriteRouter().db_for_read(Song))
+
+    def outside_transaction(self):
+        # TestCase wraps each test in a transaction, which keeps reads on the primary
+        connections = mock.patch("music.routers.connections").start()
+        self.addCleanup(mock.patch.stopall)
+        connections.__getitem__.return_value.in_atomic_block = False
+
+    @override_settings(DATABASE_READ_ALIAS="replica")
+    def test_history_and_catalog_reads_go_to_the_read_alias(self):
+        self.outside_transaction()
+        router = ReadWriteRouter()
+        self.assertEqual(router.db_for_read(Song), "replica")
+        self.assertEqual(router.db_for_read(ListeningHistory), "replica")
+        self.assertIsNone(router.db_for_read(User))
+        self.assertEqual(router.db_for_write(Song), "default")
+        self.assertFalse(router.allow_migrate("replica", "music"))
+        self.assertIsNone(router.allow_migrate("default", "music"))
+
+    @override_settings(DATABASE_READ_ALIAS="replica")
+    def test_reads_inside_a_transaction_stay_on_the_primary(self):
+        with transaction.atomic():
+            self.assertEqual(ReadWriteRouter().db_for_read(Song), "default")
+
+    def test_reads_continue_during_a_write_storm_on_two_files(self):
+        # The storm's throwaway aliases only exist while it runs
+        storm_databases = {*self.databases, "storm_primary", "storm_replica"}
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(DatabaseRoutingTests, "databases", storm_databases):
+            report = write_storm(directory, seconds=0.5, readers=2, writers=1, songs=50, users=10, events=500)
+            self.assertTrue(os.path.exists(os.path.join(directory, "replica.sqlite3")))
+        self.assertTrue(report["replica"])
+        self.assertGreater(report["reads_per_second"], 0)
+        self.assertGreater(report["rows_written_per_second"], 0)
+        self.assertEqual(report["read_errors"] + report["write_errors"], 0)
+
+
+class IngestTests(RecommenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.buffer = IngestBuffer(capacity=100, flush_rows=50, interval=None, chunk_size=2)
+        patcher = mock.patch("music.views.get_ingest_buffer", return_value=self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_events(self, *events):
+        body = "\n".join(e if isinstance(e, str) else json.dumps(e) for e in events)
+        return self.api.post("/api/listening-events/", body, content_type="application/x-ndjson")
+
+    def test_valid_events_are_buffered_then_written(self):
+        before = ListeningHistory.objects.count()
+        response = self.post_events(
+            {"user_id": self.user.id, "song_id": self.pop[0].id, "listened_at": "2025-01-01T20:00:00Z"},
+            {"user_id": self.user.id, "song_id": self.pop[1].id, "listened_at": EVENING.timestamp()},
+            {"user_id": self.user.id, "song_id": self.pop[2].id},
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {"accepted": 3, "rejected": 0, "errors": []})
+        self.assertEqual(ListeningHistory.objects.count(), before)
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.pending, 0)
+        self.assertEqual(ListeningHistory.objects.count(), before + 3)
+        evening = TasteProfile.objects.get(user=self.user, time_of_day="Evening")
+        self.assertIn("Pop 1", [song["title"] for song in evening.recent_songs])
+
+    @override_settings(INGEST_UPDATE_PROFILES=False)
+    def test_profiles_can_be_left_to_rebuild_profiles(self):
+        profiles = list(TasteProfile.objects.values_list("listens", flat=True))
+        self.buffer.offer([(self.user.id, self.pop[0].id, EVENING)])
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(list(TasteProfile.objects.values_list("listens", flat=True)), profiles)
+        self.assertTrue(ListeningHistory.objects.filter(song=self.pop[0], listened_at=EVENING).exists())
+
+    def test_invalid_events_are_rejected_by_line(self):
+        response = self.post_events(
+            {"user_id": self.user.id, "song_id": self.pop[0].id},
+            "not json",
+            {"user_id": 999_999, "song_id": self.pop[0].id},
+            {"user_id": self.user.id},
+            {"user_id": True, "song_id": self.pop[0].id},
+            {"user_id": self.user.id, "song_id": self.pop[0].id, "listened_at": "2999-01-01T00:00:00"},
+        )
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual((body["accepted"], body["rejected"]), (1, 5))
+        self.assertEqual([error["line"] for error in body["errors"]], [2, 3, 4, 5, 6])
+        self.assertEqual(body["errors"][1]["error"], "Unknown user_id 999999")
+
+        response = self.post_events("{}")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(self.buffer.rows), 1)
+
+    def test_full_buffer_refuses_the_whole_request(self):
+        event = {"user_id": self.user.id, "song_id": self.pop[0].id}
+        self.assertEqual(self.post_events(*[event] * 90).status_code, 202)
+        response = self.post_events(*[event] * 20)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(self.buffer.pending, 90)
+        with override_settings(INGEST_MAX_EVENTS=5):
+            self.assertEqual(self.post_events(*[event] * 6).status_code, 413)
+
+    def test_known_ids_follow_new_users_and_bulk_inserts(self):
+        get_known_ids()
+        created = User.objects.create(name="New", username="new")
+        self.assertIn(created.id, get_known_ids().user_ids)
+        User.objects.bulk_create([User(name="Bulk", username="bulk")])
+        bulk = User.objects.get(username="bulk")
+        self.assertEqual(parse_events([json.dumps({"user_id": bulk.id, "song_id": self.pop[0].id})])[1], 1)
+        with override_settings(INGEST_IDS_MAX_AGE=0):
+            rows, rejected, _ = parse_events([json.dumps({"user_id": bulk.id, "song_id": self.pop[0].id})])
+        self.assertEqual((len(rows), rejected), (1, 0))
+
+    def test_failed_flush_keeps_unwritten_rows(self):
+        rows = [(self.user.id, self.pop[0].id, EVENING)] * 5
+        self.buffer.offer(rows)
+        with mock.patch("music.ingest.write_rows", side_effect=[None, OperationalError("database is locked")]):
+            with self.assertRaises(OperationalError):
+                self.buffer.flush()
+        self.assertEqual((len(self.buffer.rows), self.buffer.pending), (3, 3))
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.pending, 0)
+
+    def test_rows_refused_on_their_own_are_dropped(self):
+        poison = (self.user.id, self.pop[1].id, MORNING)
+        rows = [(self.user.id, self.pop[0].id, EVENING + timedelta(minutes=i)) for i in range(4)]
+        self.buffer.offer(rows[:1] + [poison] + rows[1:])
+
+        def write(chunk):
+            if poison in chunk:
+                raise IntegrityError("CHECK constraint failed")
+            write_rows(chunk)
+
+        before = ListeningHistory.objects.count()
+        with mock.patch("music.ingest.write_rows", side_effect=write):
+            self.assertEqual(self.buffer.flush(), 4)
+        self.assertEqual((len(self.buffer.rows), self.buffer.pending), (0, 0))
+        self.assertEqual(ListeningHistory.objects.count(), before + 4)
+        self.assertFalse(ListeningHistory.objects.filter(song=self.pop[1]).exists())
+
+    def test_background_thread_flushes_by_time(self):
+        buffer = IngestBuffer(capacity=100, flush_rows=50, interval=0.01, chunk_size=10)
+        written = threading.Event()
+        with mock.patch("music.ingest.write_rows", side_effect=lambda rows: written.set()) as write:
+            buffer.offer([(self.user.id, self.pop[0].id, EVENING)])
+            self.assertTrue(written.wait(5))
+            buffer.close()
+        write.assert_called_once()
+        self.assertEqual(buffer.pending, 0)
+
+
+class CompactionTests(RecommenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Three more morning listens on the fixture's day and two a day later
+        ListeningHistory.objects.bulk_create([
+            ListeningHistory(user=self.user, song=self.jazz[0], listened_at=MORNING + timedelta(minutes=1)),
+            ListeningHistory(user=self.user, song=self.jazz[0], listened_at=MORNING + timedelta(minutes=2)),
+            ListeningHistory(user=self.user, song=self.pop[0], listened_at=EVENING),
+            ListeningHistory(user=self.user, song=self.pop[1], listened_at=MORNING + timedelta(days=1)),
+            ListeningHistory(user=self.user, song=self.pop[2], listened_at=MORNING + timedelta(days=1, minutes=1)),
+        ])
+        self.cutoff = MORNING + timedelta(days=1)
+
+    def counts(self):
+        return {
+            (count.song_id, count.day.day, count.time_of_day): count.plays
+            for count in ListeningDailyCount.objects.filter(user=self.user)
+        }
+
+    def test_old_listens_are_rolled_up_and_deleted(self):
+        self.assertEqual(list(compact_history(self.cutoff, batch_size=2)), [2, 4, 5])
+        self.assertEqual(self.counts(), {
+            (self.jazz[0].id, 1, "Morning"): 3,
+            (self.jazz[1].id, 1, "Morning"): 1,
+            (self.pop[0].id, 1, "Evening"): 1,
+        })
+        self.assertEqual(ListeningHistory.objects.filter(user=self.user).count(), 2)
+
+    def test_interrupted_run_resumes_without_double_counting(self):
+        run = compact_history(self.cutoff, batch_size=2)
+        self.assertEqual(next(run), 2)
+        run.close()
+        self.assertEqual(list(compact_history(self.cutoff, batch_size=2)), [2, 3])
+        self.assertEqual(sum(self.counts().values()), 5)
+        # New old listens add to the existing counts
+        ListeningHistory.objects.create(user=self.user, song=self.jazz[0], listened_at=MORNING)
+        list(compact_history(self.cutoff))
+        self.assertEqual(self.counts()[(self.jazz[0].id, 1, "Morning")], 4)
+
+    def test_reads_span_raw_and_rolled_up_history(self):
+        list(compact_history(self.cutoff))
+        self.assertEqual(recent_songs(self.user, "Morning"), [self.pop[2], self.pop[1], self.jazz[0], self.jazz[1]])
+        self.assertEqual(recent_songs(self.user, "Morning", limit=2), [self.pop[2], self.pop[1]])
+        self.assertEqual(filtered_songs(self.user, genre="Jazz"), [self.jazz[0], self.jazz[1]])
+        songs = latest_listened_songs_per_user([self.user.id], limit=3, time_of_day="Morning")
+        self.assertEqual(songs, {self.user.id: [self.pop[2], self.pop[1], self.jazz[0]]})
+
+    def test_backfilled_listens_are_ordered_by_time(self):
+        list(compact_history(self.cutoff))
+        # Arrives after compaction but is older than every rolled-up day
+        ListeningHistory.objects.create(user=self.user, song=self.pop[3], listened_at=MORNING - timedelta(days=1))
+        expected = [self.pop[2], self.pop[1], self.pop[0], self.jazz[0], self.jazz[1], self.pop[3]]
+        self.assertEqual(filtered_songs(self.user), expected)
+        self.assertEqual(latest_listened_songs_per_user([self.user.id], limit=4), {self.user.id: expected[:4]})
+
+    def test_rebuild_profiles_counts_rolled_up_listens(self):
+        list(rebuild_profiles([self.user.id]))
+        before = {p.time_of_day: p for p in TasteProfile.objects.filter(user=self.user)}
+        list(compact_history(self.cutoff))
+        self.assertEqual(list(rebuild_profiles([self.user.id])), [1])
+        for profile in TasteProfile.objects.filter(user=self.user):
+            self.assertEqual(profile.listens, before[profile.time_of_day].listens)
+            self.assertEqual(profile.genres.keys(), before[profile.time_of_day].genres.keys())
+
+    def test_command_uses_retention_window(self):
+        out = StringIO()
+        call_command("compact_history", "--days", "0", stdout=out)
+        self.assertIn("Compacted 7 listens", out.getvalue())
+        self.assertFalse(ListeningHistory.objects.exists())
+        self.assertEqual(sum(self.counts().values()), 7)
+
+
+class FeedbackTests(RecommenderTestCase):
+
+    def test_skipped_songs_are_never_recommended(self):
+        self.user.skipped_songs.add(self.jazz[2])
+        ids = recommend_song_ids(self.user, "Morning", k=3)
+        self.assertNotIn(self.jazz[2].id, ids)
+        self.assertEqual(set(ids[:2]), {self.jazz[3].id, self.jazz[4].id})
+        self.assertEqual(len(ids), 3)
+
+    def test_liked_artists_are_boosted(self):
+        rock = Song.objects.create(title="Rock", artist="Band", genre="Rock", mood="Angry", popularity=0)
+        self.assertNotIn(rock.id, recommend_song_ids(self.user, "Morning", k=3))
+        liked = Song.objects.create(title="Hit", artist="Band", genre="Rock", mood="Angry", popularity=0)
+        self.user.liked_songs.add(liked)
+        ids = recommend_song_ids(self.user, "Morning", k=4)
+        self.assertEqual(ids[3], rock.id)
+        self.assertNotIn(liked.id, ids)
+
+    @override_settings(RECOMMENDER_BACKEND="llm", LLM_CACHE={"BACKEND": "none"}, PRECOMPUTED_RECOMMENDATIONS=False)
+    def test_llm_recommendations_drop_skipped_songs(self):
+        self.user.skipped_songs.add(self.jazz[3])
+        answer = '[{"title": "Jazz 3", "artist": "Trio"}, {"title": "Jazz 4", "artist": "Trio"}]'
+        expected = [SongSerializer(self.jazz[4]).data]
+        with mock.patch("music.views.get_time_of_day", return_value="Morning"), \
+                mock.patch("music.llm.complete", return_value=answer):
+            response = self.api.get(f"/api/recommendations/{self.user.id}/")
+            self.assertEqual(response.json()["recommended_songs"], expected)
+            response = self.api.get(f"/api/recommendations/filter/{self.user.id}/", {"genre": "Jazz"})
+            self.assertEqual(response.json()["recommended_songs"], expected)
+            response = self.api.post(
+                "/api/recommendations/search/", {"query": "jazz"}, format="json",
+                HTTP_AUTHORIZATION=f"Bearer {issue_token(self.user)}",
+            )
+            self.assertEqual(response.json()["recommended_songs"], expected)
+            # Anonymous searches know no skipped songs
+            response = self.api.post("/api/recommendations/search/", {"query": "jazz"}, format="json")
+            self.assertEqual(len(response.json()["recommended_songs"]), 2)
+
+    def test_m2m_changes_invalidate_cached_feedback(self):
+        self.assertEqual(len(get_feedback(self.user).skipped), 0)
+        with self.assertNumQueries(0):
+            get_feedback(self.user)
+        self.user.skipped_songs.add(self.pop[0], self.pop[1])
+        self.assertEqual(get_feedback(self.user).skipped.tolist(), sorted([self.pop[0].id, self.pop[1].id]))
+        self.pop[1].skipped_by.remove(self.user)
+        self.assertEqual(get_feedback(self.user).skipped.tolist(), [self.pop[0].id])
+        self.pop[2].liked_by.add(self.user)
+        self.pop[3].liked_by.clear()
+        self.assertEqual(get_feedback(self.user).liked.tolist(), [self.pop[2].id])
+
+    def test_m2m_changes_drop_precomputed_recommendations(self):
+        PrecomputedRecommendation.objects.create(
+            user=self.user, time_of_day="Morning", songs=[], history_last_id=0, generated_at=MORNING
+        )
+        self.user.skipped_songs.add(self.pop[0])
+        self.assertFalse(PrecomputedRecommendation.objects.filter(user=self.user).exists())
+
+    def test_cache_loads_missing_users_in_one_query_and_evicts(self):
+        others = [User.objects.create(name=f"User {i}", username=f"user{i}") for i in range(3)]
+        others[0].liked_songs.add(self.jazz[0])
+        others[1].skipped_songs.add(self.jazz[1])
+        cache = FeedbackCache(max_users=2)
+        with self.assertNumQueries(1):
+            found = cache.get_many([user.id for user in others])
+        self.assertEqual(found[others[0].id].liked.tolist(), [self.jazz[0].id])
+        self.assertEqual(found[others[1].id].skipped.tolist(), [self.jazz[1].id])
+        self.assertEqual(len(found[others[2].id].liked) + len(found[others[2].id].skipped), 0)
+        self.assertEqual(len(cache), 2)
+
+    def test_cached_feedback_expires(self):
+        clock = mock.Mock(return_value=0.0)
+        cache = FeedbackCache(max_users=2, ttl=30, clock=clock)
+        self.assertEqual(len(cache.get(self.user.id).skipped), 0)
+        # Written by another worker: no signal reaches this process
+        User.skipped_songs.through.objects.create(user=self.user, song=self.jazz[2])
+        clock.return_value = 29.0
+        with self.assertNumQueries(0):
+            self.assertEqual(len(cache.get(self.user.id).skipped), 0)
+        clock.return_value = 30.0
+        self.assertEqual(cache.get(self.user.id).skipped.tolist(), [self.jazz[2].id])
+
+    def test_membership_of_candidate_arrays(self):
+        feedback = SongFeedback(liked=[7, 3], skipped=[2**40, 5])
+        self.assertEqual(feedback.liked.tolist(), [3, 7])
+        self.assertEqual(feedback.is_skipped([5, 3, 2**40, 6]).tolist(), [True, False, True, False])
+        self.assertEqual(feedback.is_liked([]).tolist(), [])
+        self.assertEqual(SongFeedback(skipped=[1, 2]).skipped.dtype, np.uint32)
+
+    def test_footprint_report(self):
+        report = feedback_footprint(users=100, likes=5, skips=5, songs=100000, candidates=100)
+        self.assertEqual(report["kept"], 95)
+        self.assertLess(report["mib_per_million_users"], report["bitmap_mib_per_million_users"])
+
+
+class SongBrowseTests(RecommenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Ties on popularity across pages
+        Song.objects.bulk_create([
+            Song(title=f"Rock {i}", artist="Band", genre="Rock", mood="Angry", popularity=50) for i in range(7)
+        ])
+
+    def pages(self, **params):
+        url, pages = "/api/songs/", []
+        while url:
+            body = self.api.get(url, params if not pages else None).json()
+            pages.append([song["id"] for song in body["results"]])
+            url = body["next"]
+        return pages
+
+    def test_pages_follow_popularity_without_gaps_or_repeats(self):
+        pages = self.pages(limit=4)
+        self.assertEqual([len(page) for page in pages], [4, 4, 4, 4, 1])
+        expected = list(Song.objects.order_by("-popularity", "-id").values_list("id", flat=True))
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(self.pages(genre="Rock", limit=3), [
+            expected[5:8], expected[8:11], expected[11:12],
+        ])
+        self.assertEqual(self.pages(genre="Pop", mood="Happy"), [expected[:5]])
+
+    def test_deep_pages_seek_through_the_index(self):
+        _, cursor = song_page(genre="Rock", limit=5)
+        self.assertEqual(decode_cursor(cursor)[0], 50)
+        for genre, mood, index in [
+            (None, None, "song_popularity_idx"), ("Rock", None, "song_genre_popularity_idx"),
+            (None, "Angry", "song_mood_popularity_idx"), ("Rock", "Angry", "song_genre_mood_popularity_idx"),
+        ]:
+            with CaptureQueriesContext(connection) as queries:
+                song_page(genre, mood, cursor, limit=2)
+            plan = connection.cursor().execute(f"EXPLAIN QUERY PLAN {queries[0]['sql']}").fetchall()
+            plan = " ".join(row[-1] for row in plan)
+            self.assertIn(index, plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_invalid_parameters(self):
+        for params in [{"genre": "Polka"}, {"mood": "Bored"}, {"limit": 0}, {"limit": "x"}, {"cursor": "!!"}]:
+            self.assertEqual(self.api.get("/api/songs/", params).status_code, 400)
+
+    def test_facets_are_cached_until_songs_change(self):
+        self.assertEqual(self.api.get("/api/songs/facets/").json()["genres"]["Rock"], 7)
+        with self.assertNumQueries(0):
+            body = self.api.get("/api/songs/facets/").json()
+        self.assertEqual(body["total"], 17)
+        self.assertEqual(body["genre_moods"]["Jazz"], {"Relaxing": 5})
+        self.assertEqual(body["moods"]["Sad"], 0)
+        Song.objects.create(title="Blue", artist="Trio", genre="Jazz", mood="Sad")
+        self.assertEqual(get_facets().genre_moods["Jazz"], {"Relaxing": 5, "Sad": 1})
+
+    def test_facets_expire_to_show_bulk_inserts(self):
+        self.assertEqual(get_facets().genres["Soul"], 0)
+        Song.objects.bulk_create([Song(title="Soul", artist="Band", genre="Soul", mood="Sad")])
+        self.assertEqual(get_facets().genres["Soul"], 0)
+        later = time.monotonic() + settings.FACETS_CACHE_TTL
+        with mock.patch("music.browse.time.monotonic", return_value=later):
+            self.assertEqual(get_facets().genres["Soul"], 1)
+
+
+class UserProfileTests(RecommenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user.liked_songs.add(*self.pop[:2])
+        self.user.skipped_songs.add(self.jazz[4])
+
+    def listen(self, count):
+        ListeningHistory.objects.bulk_create([
+            ListeningHistory(user=self.user, song=self.pop[i % 5], listened_at=EVENING + timedelta(minutes=i))
+            for i in range(count)
+        ])
+
+    @override_settings(PROFILE_HISTORY_SIZE=3)
+    def test_history_is_capped_to_latest_listens(self):
+        self.listen(10)
+        with self.assertNumQueries(5):
+            body = self.api.get(f"/api/users/{self.user.id}/profile/").json()
+        self.assertEqual([entry["song"]["id"] for entry in body["listening_history"]],
+                         [self.pop[4].id, self.pop[3].id, self.pop[2].id])
+        self.assertEqual([song["id"] for song in body["liked_songs"]], [s.id for s in self.pop[:2]])
+        self.assertEqual(body["skipped_songs"][0]["title"], "Jazz 4")
+        self.assertEqual(body["name"], "Test")
+
+    def test_queries_do_not_grow_with_history(self):
+        self.listen(500)
+        with CaptureQueriesContext(connection) as queries:
+            self.api.get(f"/api/users/{self.user.id}/profile/")
+        self.assertEqual(len(queries), 5)
+        history = next(query["sql"] for query in queries if "music_listeninghistory" in query["sql"])
+        self.assertIn("LIMIT 20", history)
+
+    def test_history_includes_compacted_listens(self):
+        self.listen(3)
+        list(compact_history(EVENING))
+        history = self.api.get(f"/api/users/{self.user.id}/profile/").json()["listening_history"]
+        self.assertEqual([entry["song"]["id"] for entry in history[:3]], [s.id for s in reversed(self.pop[:3])])
+        self.assertEqual({entry["song"]["id"] for entry in history[3:]}, {self.jazz[0].id, self.jazz[1].id})
+        self.assertEqual(history[3]["listened_at"], "2025-01-01T06:00:00Z")
+
+    def test_sparse_fields_skip_unused_relations(self):
+        with self.assertNumQueries(2):
+            body = self.api.get(f"/api/users/{self.user.id}/profile/", {"fields": "id,liked_songs"}).json()
+        self.assertEqual(set(body), {"id", "liked_songs"})
+        response = self.api.get(f"/api/users/{self.user.id}/profile/", {"fields": "id,password"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.api.get("/api/users/999/profile/").status_code, 404)
+
+
+@mock.patch("music.async_views.get_time_of_day", return_value="Morning")
+@mock.patch("music.views.get_time_of_day", return_value="Morning")
+@override_settings(LLM_CACHE={"BACKEND": "none"})
+class ConditionalGetTests(RecommenderTestCase):
+
+    url = "/api/recommendations/{}/"
+
+    def get(self, url=None, etag=None, **params):
+        headers = {"If-None-Match": etag} if etag else {}
+        return self.api.get((url or self.url).format(self.user.id), params, headers=headers)
+
+    def test_unchanged_history_answers_304_without_llm(self, *_):
+        with mock.patch("music.llm.complete", return_value="[]") as complete:
+            first = self.get()
+            etag = first["ETag"]
+            self.assertTrue(etag.startswith('W/"'))
+            self.assertIn("public", first["Cache-Control"])
+            with self.assertNumQueries(1):
+                second = self.get(etag=etag)
+            self.assertEqual(second.status_code, 304)
+            self.assertEqual(second["ETag"], etag)
+            self.assertEqual(complete.call_count, 1)
+            self.assertEqual(self.get(etag=f'"other", {etag[2:]}').status_code, 304)
+
+            ListeningHistory.objects.create(user=self.user, song=self.pop[0], listened_at=EVENING)
+            third = self.get(etag=etag)
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third["ETag"], etag)
+        self.assertEqual(complete.call_count, 2)
+
+    def test_filters_slot_and_feedback_change_the_etag(self, views_time, _):
+        url = "/api/recommendations/filter/{}/"
+        with mock.patch("music.llm.complete", return_value="[]"):
+            pop = self.get(url, genre="Pop")["ETag"]
+            self.assertNotEqual(self.get(url, genre="Jazz")["ETag"], pop)
+            views_time.return_value = "Evening"
+            self.assertNotEqual(self.get(url, genre="Pop")["ETag"], pop)
+            self.assertEqual(self.get(url, genre="Pop").status_code, 200)
+        with override_settings(RECOMMENDER_BACKEND="vector"):
+            vector = self.get()["ETag"]
+            self.user.skipped_songs.add(self.jazz[2])
+            self.assertEqual(self.get(etag=vector).status_code, 200)
+
+    def test_skips_change_the_etag_of_llm_recommendations(self, *_):
+        with mock.patch("music.llm.complete", return_value='[{"title": "Jazz 4", "artist": "Trio"}]'):
+            etag = self.get()["ETag"]
+            self.user.skipped_songs.add(self.jazz[4])
+            response = self.get(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["recommended_songs"], [])
+
+    @override_settings(RECOMMENDER_BACKEND="vector")
+    def test_feedback_from_other_workers_changes_the_etag_once_expired(self, *_):
+        etag = self.get()["ETag"]
+        User.skipped_songs.through.objects.create(user=self.user, song=self.jazz[2])
+        self.assertEqual(self.get(etag=etag).status_code, 304)
+        cache = get_feedback_cache()
+        with mock.patch.object(cache, "_clock", return_value=time.monotonic() + settings.FEEDBACK_CACHE_TTL):
+            self.assertEqual(self.get(etag=etag).status_code, 200)
+
+    def test_errors_and_streams_are_not_cached(self, *_):
+        with mock.patch("music.llm.complete", return_value="not json"):
+            response = self.get()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header("ETag"))
+        with mock.patch("music.llm.stream", return_value=iter(["[]"])):
+            response = self.get(format="sse")
+        self.assertFalse(response.has_header("ETag"))
+
+    async def test_async_views_answer_304(self, *_):
+        client = AsyncClient()
+        url = f"/api/async/recommendations/{self.user.id}/"
+        with mock.patch("music.llm.acomplete", return_value="[]") as acomplete:
+            etag = (await client.get(url))["ETag"]
+            response = await client.get(url, headers={"If-None-Match": etag, "Authorization": "Bearer x"})
+        self.assertEqual(response.status_code, 401)
+        with mock.patch("music.llm.acomplete", return_value="[]") as acomplete:
+            response = await client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        acomplete.assert_not_called()
+
+    @override_settings(RECOMMENDATION_MAX_AGE=600)
+    def test_max_age_ends_with_the_slot(self, *_):
+        self.assertEqual(max_age("Morning", MORNING), 600)
+        self.assertEqual(max_age("Morning", MORNING.replace(hour=11, minute=55)), 300)
+        self.assertEqual(max_age("Morning", EVENING), 0)
+
+
+@mock.patch("music.async_views.get_time_of_day", return_value="Morning")
+@mock.patch("music.views.get_time_of_day", return_value="Morning")
+@override_settings(
+    RECOMMENDER_BACKEND="llm", LLM_CACHE={"BACKEND": "none"}, PRECOMPUTED_RECOMMENDATIONS=False,
+    OPENAI_API_KEY="test", LLM_DEADLINES={"recommendations": 0.1, "filter": 0.1, "search": 0.1},
+    LLM_BREAKER={"FAILURES": 2, "RESET_TIMEOUT": 60},
+)
+class DeadlineTests(RecommenderTestCase):
+
+    @contextmanager
+    def fake_llm(self, **kwargs):
+        with FakeLLMServer(**kwargs) as server, override_settings(OPENAI_BASE_URL=server.base_url):
+            with mock.patch("music.llm._client", None):
+                yield server
+
+    def get(self, url="/api/recommendations/{}/", **params):
+        return self.api.get(url.format(self.user.id), params)
+
+    def assertDegraded(self, response, reason):
+        self.assertEqual(response.status_code, 200)
+        if not response.streaming:
+            self.assertTrue(response.json()["degraded"])
+        self.assertEqual(response["X-Degraded"], reason)
+        self.assertEqual(response["Cache-Control"], "no-store")
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_slow_llm_is_replaced_by_local_songs_at_the_deadline(self, *_):
+        with self.fake_llm(latency=2.0) as server:
+            started = time.perf_counter()
+            response = self.get()
+            elapsed = time.perf_counter() - started
+        self.assertDegraded(response, "timeout")
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(server.requests, 1)
+        # The vector engine's songs: the user's unheard Jazz first
+        songs = response.json()["recommended_songs"]
+        self.assertEqual({song["id"] for song in songs[:3]}, {song.id for song in self.jazz[2:]})
+
+    @override_settings(LLM_DEADLINES={"recommendations": 2.0})
+    def test_answer_within_the_deadline_is_not_degraded(self, *_):
+        with self.fake_llm(latency=0.0, songs=3):
+            response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("degraded", response.json())
+        self.assertFalse(response.has_header("X-Degraded"))
+        self.assertTrue(response.has_header("ETag"))
+
+    def test_filtered_fallback_skips_heard_and_skipped_songs(self, *_):
+        self.user.skipped_songs.add(self.jazz[2])
+        error = openai.APIConnectionError(request=mock.Mock())
+        with mock.patch("music.llm.complete", side_effect=error):
+            response = self.get("/api/recommendations/filter/{}/", genre="Jazz")
+        self.assertDegraded(response, "error")
+        self.assertEqual([song["id"] for song in response.json()["recommended_songs"]],
+                         [self.jazz[4].id, self.jazz[3].id])
+
+    def test_breaker_skips_the_llm_after_repeated_timeouts(self, *_):
+        with self.fake_llm(latency=0.5) as server:
+            for _ in range(2):
+                self.assertDegraded(self.get(), "timeout")
+            self.assertEqual(get_breaker().state, OPEN)
+            self.assertDegraded(self.get(), "circuit_open")
+            self.assertDegraded(self.get(format="sse"), "circuit_open")
+            self.assertEqual(server.requests, 2)
+
+            # Once RESET_TIMEOUT has passed, one request probes the recovered LLM
+            server.latency = 0.0
+            breaker = get_breaker()
+            breaker.clock = mock.Mock(return_value=time.monotonic() + 61)
+            response = self.get()
+        self.assertNotIn("degraded", response.json())
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(server.requests, 3)
+
+    def test_breaker_lets_one_probe_through(self, *_):
+        clock = mock.Mock(return_value=0.0)
+        breaker = CircuitBreaker(failures=3, reset_timeout=10, clock=clock)
+        for _ in range(2):
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+        breaker.record_success()
+        for _ in range(3):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+        clock.return_value = 10.0
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+        clock.return_value = 20.0
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def open_breaker(self):
+        breaker = get_breaker()
+        breaker.clock = mock.Mock(return_value=0.0)
+        for _ in range(2):
+            breaker.record_failure()
+        breaker.clock.return_value = 61.0
+        return breaker
+
+    def test_probe_failing_unexpectedly_reopens_the_breaker(self, *_):
+        breaker = self.open_breaker()
+        with mock.patch("music.llm.recommend", side_effect=ValueError("bug")):
+            with self.assertRaises(ValueError):
+                recommend_within("prompt", "recommendations")
+        self.assertEqual(breaker.state, OPEN)
+        breaker.clock.return_value = 122.0
+        self.assertTrue(breaker.allow())
+
+    async def test_cancelled_probe_reopens_the_breaker(self, *_):
+        breaker = self.open_breaker()
+
+        async def hanging_complete(prompt, model=None, **kwargs):
+            await asyncio.sleep(10)
+
+        with mock.patch("music.llm.acomplete", side_effect=hanging_complete):
+            probe = asyncio.ensure_future(arecommend_within("prompt", "filter"))
+            await asyncio.sleep(0.01)
+            self.assertEqual(breaker.state, HALF_OPEN)
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+            for task in asyncio.all_tasks() - {asyncio.current_task()}:
+                task.cancel()
+        self.assertEqual(breaker.state, OPEN)
+        breaker.clock.return_value = 122.0
+        self.assertTrue(breaker.allow())
+
+    def test_stream_failing_midway_ends_with_fallback_songs(self, *_):
+        def failing_stream(prompt, model=None, **kwargs):
+            yield '[{"title": "Jazz 3", "artist": "Trio"}, '
+            raise openai.APIConnectionError(request=mock.Mock())
+
+        with mock.patch("music.llm.stream", side_effect=failing_stream):
+            for _ in range(2):
+                response = self.get("/api/recommendations/filter/{}/", genre="Pop", format="sse")
+                body = b"".join(response.streaming_content).decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('event: degraded\ndata: {"reason": "error"}', body)
+        # The LLM's song, then the five Pop songs of the fallback
+        self.assertEqual(body.count("event: song"), 6)
+        self.assertTrue(body.endswith('event: done\ndata: {"count": 6}\n\n'))
+        self.assertEqual(get_breaker().state, OPEN)
+
+    def test_streams_settle_the_probe(self, *_):
+        breaker = self.open_breaker()
+        with mock.patch("music.llm.stream", return_value=iter(['[{"title": "Jazz 3", "artist": "Trio"}]'])):
+            response = self.get(format="sse")
+            # Only the probe reaches the LLM while half-open
+            self.assertEqual(self.get(format="sse")["X-Degraded"], "circuit_open")
+            self.assertEqual(breaker.state, HALF_OPEN)
+            b"".join(response.streaming_content)
+        self.assertEqual(breaker.state, CLOSED)
+
+    async def test_async_stream_failing_midway_ends_with_fallback_songs(self, *_):
+        async def failing_astream(prompt, model=None, **kwargs):
+            yield "["
+            raise openai.APIConnectionError(request=mock.Mock())
+
+        with mock.patch("music.llm.astream", side_effect=failing_astream):
+            response = await AsyncClient().get(
+                f"/api/async/recommendations/filter/{self.user.id}/", {"genre": "Pop", "format": "sse"},
+            )
+            body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn("event: degraded", body)
+        self.assertEqual(body.count("event: song"), 5)
+        self.assertEqual(get_breaker().consecutive_failures, 1)
+
+    async def test_async_view_falls_back_at_the_deadline(self, *_):
+        async def slow_complete(prompt, model=None, **kwargs):
+            await asyncio.sleep(0.3)
+            return "[]"
+
+        with mock.patch("music.llm.acomplete", side_effect=slow_complete) as acomplete:
+            response = await AsyncClient().get(f"/api/async/recommendations/filter/{self.user.id}/", {"mood": "Happy"})
+            # The upstream call keeps running past the deadline
+            await asyncio.sleep(0.3)
+        self.assertDegraded(response, "timeout")
+        self.assertEqual(len(response.json()["recommended_songs"]), 5)
+        acomplete.assert_called_once()
+
+
+class GenerateDataTests(TestCase):
+
+    def generate(self, **options):
+        call_command("generate_data", "--until=2025-06-01T12:00", stdout=StringIO(), **options)
+        return list(ListeningHistory.objects.order_by("id").values_list("user__username", "song__title", "listened_at"))
+
+    def test_seeded_runs_are_reproducible(self):
+        first = self.generate(songs=50, users=5, events=300, chunk_size=64, seed=3)
+        ListeningHistory.objects.all().delete()
+        User.objects.all().delete()
+        Song.objects.all().delete()
+        second = self.generate(songs=50, users=5, events=300, chunk_size=64, seed=3)
+        self.assertEqual(first, second)
+        self.assertEqual((Song.objects.count(), User.objects.count(), len(first)), (50, 5, 300))
+
+    def test_history_covers_every_time_of_day(self):
+        history = self.generate(songs=10, users=2, events=500, seed=1)
+        self.assertEqual({listened_at.hour // 6 for _, _, listened_at in history}, {0, 1, 2, 3})
+        self.assertTrue(all(listened_at <= datetime(2025, 6, 1, 12, tzinfo=timezone.utc) for *_, listened_at in history))
+        self.assertTrue(User.objects.first().check_password("password123"))
+        self.assertEqual(sum(TasteProfile.objects.values_list("listens", flat=True)), 500)
+
+
+class BenchmarkTests(TestCase):
+
+    def test_percentile_interpolates(self):
+        samples = [float(v) for v in range(1, 101)]
+        self.assertEqual(percentile(samples, 50), 50.5)
+        self.assertAlmostEqual(percentile(samples, 99), 99.01)
+        self.assertEqual(percentile([], 95), 0.0)
@@ -1,6 +1,19 @@
 from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+from .async_views import (
+    AsyncBatchRecommendationView,
+    AsyncRecommendationView,
+    AsyncSearchRecommendationView,
+    AsyncFilteredRecommendationView,
+    AsyncLoginView,
+)
+from .metrics import MetricsView
 from .views import (
+    ListeningEventsView,
     RecommendationView,
+    SongFacetsView,
+    SongListView,
+    UserProfileView,
     SearchRecommendationView,
     FilteredRecommendationView,
     LoginView
@@ -8,9 +21,22 @@ from .views import (
 
 # URL patterns for the music recommendation API
 urlpatterns = [
+    # Request and LLM metrics in the Prometheus text format
+    path("metrics", MetricsView.as_view(), name="metrics"),
+
     # User login endpoint
     path("login/", LoginView.as_view(), name="login"),
 
+    # Browse the catalog by popularity, and song counts for its filters
+    path("songs/", SongListView.as_view(), name="songs"),
+    path("songs/facets/", SongFacetsView.as_view(), name="song-facets"),
+
+    # A user's preferences, liked and skipped songs and latest listens
+    path("users/<int:user_id>/profile/", UserProfileView.as_view(), name="user-profile"),
+
+    # Record listening events in bulk, as NDJSON
+    path("listening-events/", ListeningEventsView.as_view(), name="listening-events"),
+
     # Get personalized recommendations based on time of day and listening history
     path("recommendations/<int:user_id>/", RecommendationView.as_view(), name="recommendations"),
 
@@ -20,5 +46,16 @@ urlpatterns = [
 
     # Natural language search-based recommendations
     path("recommendations/search/", SearchRecommendationView.as_view(), name="search-recommendations"),
-]
 
+    # Async variants of the login and recommendation endpoints, meant to be served under ASGI
+    path("async/login/", csrf_exempt(AsyncLoginView.as_view()), name="async-login"),
+    path("async/recommendations/<int:user_id>/", AsyncRecommendationView.as_view(), name="async-recommendations"),
+    path("async/recommendations/filter/<int:user_id>/", AsyncFilteredRecommendationView.as_view(),
+         name="async-filtered-recommendations"),
+    path("async/recommendations/search/", csrf_exempt(AsyncSearchRecommendationView.as_view()),
+         name="async-search-recommendations"),
+
+    # Recommendations for many users at once, streamed as NDJSON
+    path("async/recommendations/batch/", csrf_exempt(AsyncBatchRecommendationView.as_view()),
+         name="async-batch-recommendations"),
+]
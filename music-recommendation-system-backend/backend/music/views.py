@@ -1,20 +1,53 @@
 import json
-import os
+import math
+from itertools import islice
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.http import Http404
 from django.utils.timezone import now
-from dotenv import load_dotenv
-from openai import OpenAI
 from rest_framework import status
 from rest_framework.generics import get_object_or_404
 from rest_framework.parsers import JSONParser
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
-from .models import User, ListeningHistory
-
-# Load OpenAI API key
-load_dotenv()
-client = OpenAI()
-client.api_key = os.getenv('OPENAI_API_KEY')
+from . import llm, metrics, schemas
+from .auth import request_user_id, token_error, token_payload
+from .browse import get_facets, popular_songs, song_page
+from .conditional import cache_headers, etag_matches, history_version, not_modified, recommendation_etag
+from .deadline import CIRCUIT_OPEN, LLMUnavailable, get_breaker, mark_degraded, recommend_within, stream_events
+from .feedback import get_feedback, skipped_ids
+from .grounding import ground_items, ground_stream
+from .ingest import get_ingest_buffer, iter_lines, parse_events
+from .models import (
+    GENRES,
+    MOODS,
+    User,
+    ListeningHistory,
+    PrecomputedRecommendation,
+    TasteProfile,
+    latest_listened_songs,
+    time_of_day_for_hour,
+)
+from .prompts import (
+    candidate_search_prompt,
+    filtered_prompt,
+    history_prompt,
+    rerank_prompt,
+    search_prompt,
+    taste_prompt,
+)
+from .recommender import recommend_song_ids, songs_in_order
+from .search import search_song_ids
+from .serializers import SongSerializer, UserSerializer
+from .similarity import similar_song_ids
+from .sse import ServerSentEventRenderer, event_stream_response, song_events
+
+# Recommendation views also negotiate text/event-stream (Accept header or ?format=sse)
+# to stream songs as server-sent events while the LLM is still generating.
+RECOMMENDATION_RENDERERS = [*api_settings.DEFAULT_RENDERER_CLASSES, ServerSentEventRenderer]
 
 
 def get_time_of_day():
@@ -24,12 +57,342 @@ def get_time_of_day():
     Returns:
         str: One of "Morning", "Afternoon", or "Evening".
     """
-    current_hour = now().hour
-    if current_hour < 12:
-        return "Morning"
-    elif current_hour < 18:
-        return "Afternoon"
-    return "Evening"
+    return time_of_day_for_hour(now().hour)
+
+
+def recent_songs(user, current_time_of_day, limit=20):
+    """
+    Return the songs of the user's last `limit` listens in the given time of day.
+
+    Args:
+        user (User): The user.
+        current_time_of_day (str): One of "Morning", "Afternoon", or "Evening".
+        limit (int): Number of listens to fetch.
+
+    Returns:
+        list[Song]: The matching songs, most recent first.
+    """
+    return latest_listened_songs(limit, time_of_day=current_time_of_day, user=user)
+
+
+def filtered_songs(user, genre=None, mood=None, limit=20):
+    """
+    Return the songs of the user's last `limit` listens matching a genre and/or mood.
+
+    Args:
+        user (User): The user.
+        genre (str): Genre to match, optional.
+        mood (str): Mood to match, optional.
+        limit (int): Number of listens to fetch.
+
+    Returns:
+        list[Song]: The matching songs, most recent first.
+    """
+    return latest_listened_songs(limit, genre=genre, mood=mood, user=user)
+
+
+def time_of_day_prompt(user, current_time_of_day):
+    """
+    Build the RecommendationView prompt for a user's current time-of-day slot.
+
+    Reads the user's materialized TasteProfile for the slot (one indexed row)
+    and falls back to scanning recent history when none exists yet.
+
+    Args:
+        user (User): The user.
+        current_time_of_day (str): One of "Morning", "Afternoon", or "Evening".
+
+    Returns:
+        str: The prompt.
+    """
+    taste = TasteProfile.objects.filter(user=user, time_of_day=current_time_of_day).first()
+    if taste is None:
+        return history_prompt(recent_songs(user, current_time_of_day), current_time_of_day)
+    return taste_prompt(taste, current_time_of_day)
+
+
+def rerank_candidates(user, current_time_of_day):
+    """
+    Return the vector engine's top settings.RECOMMENDER_RERANK_TOP_K songs for the LLM to re-rank.
+
+    Args:
+        user (User): The user to recommend for.
+        current_time_of_day (str): The current time-of-day slot.
+
+    Returns:
+        list[Song]: Candidates in engine order.
+    """
+    return songs_in_order(recommend_song_ids(user, current_time_of_day, k=settings.RECOMMENDER_RERANK_TOP_K))
+
+
+def merge_ranking(candidates, ranked_ids, count=20):
+    """
+    Order candidates by the LLM's ranking, appending those it left out in engine order.
+
+    Args:
+        candidates (list[Song]): Candidates in vector engine order.
+        ranked_ids (list): Ids returned by the LLM; unknown ids and non-integers are ignored.
+        count (int): Number of songs to return.
+
+    Returns:
+        list[Song]: Up to `count` songs.
+    """
+    by_id = {s.id: s for s in candidates}
+    ordered = []
+    for song_id in ranked_ids:
+        song = by_id.pop(song_id, None) if isinstance(song_id, int) else None
+        if song is not None:
+            ordered.append(song)
+    ordered.extend(by_id.values())
+    return ordered[:count]
+
+
+def rerank_recommendations(user, current_time_of_day, count=20):
+    """
+    Let the LLM re-rank the vector engine's top candidates.
+
+    Args:
+        user (User): The user to recommend for.
+        current_time_of_day (str): The current time-of-day slot.
+        count (int): Number of songs to return.
+
+    Returns:
+        list[dict]: The re-ranked songs serialized with SongSerializer. Candidates
+        the LLM left out or an unparseable completion fall back to engine order.
+    """
+    candidates = rerank_candidates(user, current_time_of_day)
+    try:
+        ranked_ids = llm.recommend(rerank_prompt(candidates, current_time_of_day, count), kind=schemas.IDS)
+    except json.JSONDecodeError:
+        ranked_ids = []
+
+    ordered = merge_ranking(candidates, ranked_ids, count)
+    return SongSerializer(ordered, many=True).data
+
+
+def local_recommendations(user, current_time_of_day):
+    """
+    Recommend with the catalog-based backends of settings.RECOMMENDER_BACKEND.
+
+    Args:
+        user (User): The user to recommend for.
+        current_time_of_day (str): The current time-of-day slot.
+
+    Returns:
+        list[dict] | None: Songs serialized with SongSerializer, or None for the
+        "llm" backend, whose free-form completion the caller requests itself.
+    """
+    backend = settings.RECOMMENDER_BACKEND
+    if backend == "vector":
+        return SongSerializer(songs_in_order(recommend_song_ids(user, current_time_of_day)), many=True).data
+    if backend == "similar":
+        return SongSerializer(songs_in_order(similar_song_ids(user, current_time_of_day)), many=True).data
+    if backend == "hybrid":
+        return rerank_recommendations(user, current_time_of_day)
+    return None
+
+
+def fallback_recommendations(user, current_time_of_day, count=20):
+    """
+    Recommend without the LLM for the time-of-day views when it is unavailable.
+
+    The vector engine scores the catalog against the user's history in the
+    slot with a popularity prior, so users without history get the most
+    popular songs.
+
+    Args:
+        user (User): The user to recommend for.
+        current_time_of_day (str): The current time-of-day slot.
+        count (int): Number of songs to return.
+
+    Returns:
+        list[dict]: Songs serialized with SongSerializer.
+    """
+    return SongSerializer(songs_in_order(recommend_song_ids(user, current_time_of_day, k=count)), many=True).data
+
+
+def fallback_filtered(user, genre, mood, history, count=20):
+    """
+    Recommend without the LLM for the filtered views when it is unavailable.
+
+    Args:
+        user (User): The user to recommend for.
+        genre (str): Genre to match, optional.
+        mood (str): Mood to match, optional.
+        history (list[Song]): The user's recent listens matching the filters,
+            from filtered_songs().
+        count (int): Number of songs to return.
+
+    Returns:
+        list[dict]: The most popular matching songs the user has neither
+        listened to recently nor skipped, serialized with SongSerializer.
+    """
+    exclude = {song.id for song in history} | set(get_feedback(user).skipped.tolist())
+    return SongSerializer(popular_songs(genre, mood, exclude, count), many=True).data
+
+
+def search_candidates(query, skipped=(), limit=None):
+    """
+    Return the catalog songs matching a search query best.
+
+    Args:
+        query (str): The natural language query.
+        skipped (Collection[int]): Ids of songs to leave out.
+        limit (int): Number of songs, settings.SEARCH_CANDIDATES by default.
+
+    Returns:
+        list[Song]: Up to `limit` songs, best match first.
+    """
+    limit = limit or settings.SEARCH_CANDIDATES
+    song_ids = [song_id for song_id in search_song_ids(query, limit=limit + len(skipped)) if song_id not in skipped]
+    return songs_in_order(song_ids[:limit])
+
+
+def fallback_search(query, skipped=(), count=20):
+    """
+    Recommend without the LLM for the search views when it is unavailable.
+
+    Args:
+        query (str): The natural language query.
+        skipped (Collection[int]): Ids of songs to leave out.
+        count (int): Number of songs to return.
+
+    Returns:
+        list[dict]: Best full-text matches of the query in the catalog,
+        serialized with SongSerializer.
+    """
+    return SongSerializer(search_candidates(query, skipped, count), many=True).data
+
+
+def compute_recommendations(user, current_time_of_day):
+    """
+    Compute what RecommendationView would return live, without streaming.
+
+    Args:
+        user (User): The user to recommend for.
+        current_time_of_day (str): The time-of-day slot.
+
+    Returns:
+        list[dict]: The recommended songs.
+
+    Raises:
+        json.JSONDecodeError: If the LLM completion cannot be parsed.
+    """
+    songs = local_recommendations(user, current_time_of_day)
+    if songs is not None:
+        return songs
+    songs = llm.recommend(time_of_day_prompt(user, current_time_of_day))
+    return ground_items(songs, skipped_ids(user)) if settings.LLM_GROUNDING else songs
+
+
+def fresh_precomputed(user, current_time_of_day):
+    """
+    Return the user's precomputed recommendations for a slot if still fresh.
+
+    A row is fresh when it is younger than settings.PRECOMPUTED_MAX_AGE and
+    the user has not listened to anything since it was computed. Both are
+    checked in the same query.
+
+    Args:
+        user (User): The user.
+        current_time_of_day (str): The time-of-day slot.
+
+    Returns:
+        PrecomputedRecommendation | None: The row, or None if missing or stale.
+    """
+    if not settings.PRECOMPUTED_RECOMMENDATIONS:
+        return None
+    newer_listens = ListeningHistory.objects.filter(user_id=OuterRef("user_id"), id__gt=OuterRef("history_last_id"))
+    return PrecomputedRecommendation.objects.filter(
+        user=user, time_of_day=current_time_of_day, generated_at__gte=now() - settings.PRECOMPUTED_MAX_AGE,
+    ).exclude(Exists(newer_listens)).first()
+
+
+def wants_stream(request):
+    """Tell whether a DRF request negotiated server-sent events."""
+    return request.accepted_renderer.format == ServerSentEventRenderer.format
+
+
+def songs_response(request, songs):
+    """
+    Return already computed songs as JSON, or as events if a stream was requested.
+
+    Args:
+        request (Request): The DRF request.
+        songs (list[dict]): Serialized songs.
+
+    Returns:
+        Response | StreamingHttpResponse: The response.
+    """
+    if wants_stream(request):
+        return event_stream_response(song_events(songs))
+    return Response({"recommended_songs": songs}, status=200)
+
+
+def degraded_response(request, songs, reason):
+    """
+    Return fallback songs in place of the LLM's, marked as degraded.
+
+    JSON bodies carry "degraded": true; see deadline.mark_degraded() for the headers.
+
+    Args:
+        request (Request): The DRF request.
+        songs (list[dict]): Serialized fallback songs.
+        reason (str): Why the LLM was not used, see music.deadline.
+
+    Returns:
+        Response | StreamingHttpResponse: The response.
+    """
+    metrics.count_fallback(reason)
+    if wants_stream(request):
+        response = event_stream_response(song_events(songs))
+    else:
+        response = Response({"recommended_songs": songs, "degraded": True}, status=200)
+    return mark_degraded(response, reason)
+
+
+def llm_response(request, prompt, endpoint, fallback, skipped=()):
+    """
+    Ask the LLM for recommendations, streaming them as events if requested.
+
+    With settings.LLM_GROUNDING the songs are matched against the catalog, see
+    grounding.ground_items(), and `skipped` songs dropped. The LLM gets settings.LLM_DEADLINES[endpoint]
+    seconds to answer and is skipped while its circuit breaker is open; the
+    songs of `fallback` are returned instead, see degraded_response(). Streams
+    have no deadline and switch to `fallback` if the LLM fails mid-stream,
+    see deadline.stream_events().
+
+    Args:
+        request (Request): The DRF request.
+        prompt (str): The prompt to send.
+        endpoint (str): Key of settings.LLM_DEADLINES.
+        fallback (Callable[[], list[dict]]): Computes local recommendations.
+        skipped (Collection[int]): Ids of songs to leave out, the user's skipped songs.
+
+    Returns:
+        Response | StreamingHttpResponse: The recommendations, or 400 if the
+        completion cannot be parsed.
+    """
+    grounding = settings.LLM_GROUNDING
+    if wants_stream(request):
+        breaker = get_breaker()
+        if not breaker.allow():
+            return degraded_response(request, fallback(), CIRCUIT_OPEN)
+        songs = llm.stream_recommend(prompt)
+        if grounding:
+            songs = ground_stream(songs, skipped)
+        return event_stream_response(stream_events(breaker, songs, fallback))
+
+    try:
+        recommendations = recommend_within(prompt, endpoint)
+    except LLMUnavailable as exc:
+        return degraded_response(request, fallback(), exc.reason)
+    except json.JSONDecodeError:
+        return Response({"error": "Failed to parse recommendations as JSON"}, status=400)
+
+    if grounding:
+        recommendations = ground_items(recommendations, skipped)
+    return Response({"recommended_songs": recommendations}, status=200)
 
 
 class LoginView(APIView):
@@ -41,7 +404,8 @@ class LoginView(APIView):
         - password: str
 
     Returns:
-        - 200 OK with user_id if credentials are valid.
+        - 200 OK with user_id and a bearer token for the recommendation
+          endpoints if credentials are valid.
         - 400 Bad Request if invalid credentials.
     """
 
@@ -51,7 +415,7 @@ class LoginView(APIView):
 
         user = get_object_or_404(User, username=username)
         if user.check_password(password):
-            return Response({"user_id": user.id}, status=status.HTTP_200_OK)
+            return Response(token_payload(user), status=status.HTTP_200_OK)
         return Response({"error": "Invalid credentials"}, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -60,50 +424,80 @@ class RecommendationView(APIView):
     API endpoint for recommending songs based on user's listening history
     at the current time of day (Morning, Afternoon, Evening).
 
+    The backend is chosen by settings.RECOMMENDER_BACKEND:
+        - "llm": the LLM recommends songs from the user's recent history.
+        - "vector": the local vector engine scores the whole catalog.
+        - "hybrid": the LLM re-ranks the vector engine's top candidates.
+        - "similar": songs co-listened with the user's latest ones, from the
+          offline item-item index.
+
+    Fresh rows written by the precompute_recommendations command are served
+    instead of computing recommendations live.
+
     GET:
         - user_id: int
 
     Returns:
         - 200 OK with a list of recommended songs in JSON.
+        - 200 OK text/event-stream of "song" events and a final "done" event when
+          requested with Accept: text/event-stream or ?format=sse.
+        - 304 Not Modified, without recomputing, when If-None-Match holds the
+          current ETag (see music.conditional); JSON responses carry ETag and
+          Cache-Control.
+        - 200 OK with "degraded": true and an X-Degraded header, not cacheable,
+          when the LLM misses settings.LLM_DEADLINES["recommendations"] or is
+          unavailable: the vector engine's songs instead (see music.deadline).
         - 400 if recommendation parsing fails.
     """
 
+    renderer_classes = RECOMMENDATION_RENDERERS
+
     def get(self, request, user_id):
-        user = get_object_or_404(User, id=user_id)
+        denied = token_error(request, user_id)
+        if denied:
+            return Response({"error": denied[1]}, status=denied[0])
+        user = get_object_or_404(User.objects.annotate(history_version=history_version()), id=user_id)
         current_time_of_day = get_time_of_day()
 
-        # Filter last 20 songs and retain only those from the current time of day
-        history = ListeningHistory.objects.filter(user=user).order_by("-listened_at")[:20]
-        songs = [h.song for h in history if h.time_of_day() == current_time_of_day]
+        if wants_stream(request):
+            return self.recommend(request, user, current_time_of_day)
+        etag = recommendation_etag(user, current_time_of_day)
+        if etag_matches(request, etag):
+            return not_modified(request, etag, current_time_of_day)
+        return cache_headers(request, self.recommend(request, user, current_time_of_day), etag, current_time_of_day)
 
-        # Construct LLM prompt
-        if not songs:
-            prompt = (
-                f"This is a music recommender system. The user has no recent listening history at this time. "
-                f"Please recommend 20 songs that are generally popular and diverse across different genres and moods in JSON format."
-            )
-        else:
-            song_list = ', '.join([f"{s.title} by {s.artist}" for s in songs])
-            prompt = (
-                f"This is a music recommender system. The user has listened to these songs in the {current_time_of_day}: "
-                f"{song_list}. Recommend 20 similar songs in JSON format."
-            )
+    def recommend(self, request, user, current_time_of_day):
+        precomputed = fresh_precomputed(user, current_time_of_day)
+        if precomputed is not None:
+            return songs_response(request, precomputed.songs)
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": prompt}]
-        )
+        if settings.RECOMMENDER_BACKEND == "hybrid":
+            return self.rerank(request, user, current_time_of_day)
+
+        songs = local_recommendations(user, current_time_of_day)
+        if songs is not None:
+            return songs_response(request, songs)
+
+        # Taste profile and last 20 songs listened to at the current time of day
+        prompt = time_of_day_prompt(user, current_time_of_day)
 
-        recommendations = response.choices[0].message.content
-        start_index = recommendations.find("[")
-        end_index = recommendations.rfind("]") + 1
+        return llm_response(
+            request, prompt, "recommendations", lambda: fallback_recommendations(user, current_time_of_day),
+            skipped_ids(user),
+        )
 
+    def rerank(self, request, user, current_time_of_day):
+        candidates = rerank_candidates(user, current_time_of_day)
         try:
-            recommendations = json.loads(recommendations[start_index:end_index])
+            ranked_ids = recommend_within(
+                rerank_prompt(candidates, current_time_of_day), "recommendations", kind=schemas.IDS,
+            )
         except json.JSONDecodeError:
-            return Response({"error": "Failed to parse recommendations as JSON"}, status=400)
-
-        return Response({"recommended_songs": recommendations}, status=200)
+            ranked_ids = []
+        except LLMUnavailable as exc:
+            # Engine order
+            return degraded_response(request, SongSerializer(merge_ranking(candidates, []), many=True).data, exc.reason)
+        return songs_response(request, SongSerializer(merge_ranking(candidates, ranked_ids), many=True).data)
 
 
 class FilteredRecommendationView(APIView):
@@ -117,73 +511,77 @@ class FilteredRecommendationView(APIView):
 
     Returns:
         - 200 OK with filtered recommendations.
+        - 200 OK text/event-stream of "song" events and a final "done" event when
+          requested with Accept: text/event-stream or ?format=sse.
+        - 304 Not Modified, without recomputing, when If-None-Match holds the
+          current ETag (see music.conditional); JSON responses carry ETag and
+          Cache-Control.
+        - 200 OK with "degraded": true and an X-Degraded header, not cacheable,
+          when the LLM misses settings.LLM_DEADLINES["filter"] or is
+          unavailable: the most popular matching songs the user has neither
+          listened to recently nor skipped.
         - 400 if no filters or JSON parsing fails.
     """
 
+    renderer_classes = RECOMMENDATION_RENDERERS
+
     def get(self, request, user_id):
-        user = get_object_or_404(User, id=user_id)
+        denied = token_error(request, user_id)
+        if denied:
+            return Response({"error": denied[1]}, status=denied[0])
+        user = get_object_or_404(User.objects.annotate(history_version=history_version()), id=user_id)
         genre = request.query_params.get("genre")
         mood = request.query_params.get("mood")
 
         if not genre and not mood:
             return Response({"error": "At least one filter (genre or mood) is required."}, status=400)
 
-        history = ListeningHistory.objects.filter(user=user)
-        if genre:
-            history = history.filter(song__genre=genre)
-        if mood:
-            history = history.filter(song__mood=mood)
-
-        history = history.order_by("-listened_at")[:20]
-        songs = [h.song for h in history]
-
-        # Construct prompt for LLM
-        if not songs:
-            prompt = "This is a music recommender system. "
-            if genre:
-                prompt += f"The user prefers the genre {genre}. "
-            if mood:
-                prompt += f"The user enjoys songs with a {mood} mood. "
-            prompt += "Recommend 20 songs that match these preferences in JSON format."
-        else:
-            song_list = ', '.join([f"{s.title} by {s.artist}" for s in songs])
-            prompt = "This is a music recommender system. "
-            if genre:
-                prompt += f"The user enjoys the genre {genre}. "
-            if mood:
-                prompt += f"The user likes songs with a {mood} mood. "
-            prompt += f"Here are some recently listened songs: {song_list}. Recommend 20 similar songs in JSON format."
-
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": prompt}]
-        )
-
-        recommendations = response.choices[0].message.content
-        start_index = recommendations.find("[")
-        end_index = recommendations.rfind("]") + 1
+        if wants_stream(request):
+            return self.recommend(request, user, genre, mood)
+        # The prompt does not depend on the slot, but responses are reused
+        # within one slot at most, like unfiltered ones
+        current_time_of_day = get_time_of_day()
+        etag = recommendation_etag(user, current_time_of_day, genre=genre, mood=mood)
+        if etag_matches(request, etag):
+            return not_modified(request, etag, current_time_of_day)
+        return cache_headers(request, self.recommend(request, user, genre, mood), etag, current_time_of_day)
 
-        try:
-            recommendations = json.loads(recommendations[start_index:end_index])
-        except json.JSONDecodeError:
-            return Response({"error": "Failed to parse recommendations as JSON"}, status=400)
+    def recommend(self, request, user, genre, mood):
+        songs = filtered_songs(user, genre, mood)
+        prompt = filtered_prompt(songs, genre, mood)
 
-        return Response({"recommended_songs": recommendations}, status=200)
+        return llm_response(
+            request, prompt, "filter", lambda: fallback_filtered(user, genre, mood, songs), skipped_ids(user),
+        )
 
 
 class SearchRecommendationView(APIView):
     """
     API endpoint for generating recommendations using a natural language query.
 
+    Catalog songs matching the query are retrieved with the local full-text
+    index (music.search). settings.SEARCH_MODE chooses what happens next:
+        - "candidates": the matches are listed in the prompt for the LLM to pick from.
+        - "local": the matches are returned directly, without calling the LLM.
+        - "llm": the query is sent to the LLM alone.
+
+    Requests carrying a valid bearer token never get the user's skipped songs.
+
     POST:
         - query: str (e.g., "Relaxing music for evening walks")
 
     Returns:
         - 200 OK with song recommendations based on query.
+        - 200 OK text/event-stream of "song" events and a final "done" event when
+          requested with Accept: text/event-stream or ?format=sse.
+        - 200 OK with "degraded": true and an X-Degraded header when the LLM
+          misses settings.LLM_DEADLINES["search"] or is unavailable: the best
+          full-text matches instead.
         - 400 if query is missing or parsing fails.
     """
     permission_classes = [AllowAny]
     parser_classes = [JSONParser]
+    renderer_classes = RECOMMENDATION_RENDERERS
 
     def post(self, request):
         query = request.data.get("query", "")
@@ -191,23 +589,158 @@ class SearchRecommendationView(APIView):
         if not query:
             return Response({"error": "Query is required."}, status=400)
 
-        prompt = (
-            f"This is a music recommender system. The user asks: '{query}'. "
-            f"Provide up to 20 relevant song recommendations in JSON format."
-        )
+        mode = settings.SEARCH_MODE
+        # Requests with a token leave out the user's skipped songs
+        skipped = skipped_ids(request_user_id(request))
+        if mode == "llm":
+            return llm_response(
+                request, search_prompt(query), "search", lambda: fallback_search(query, skipped), skipped,
+            )
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": prompt}]
+        candidates = search_candidates(query, skipped)
+        if mode == "local":
+            return songs_response(request, SongSerializer(candidates, many=True).data)
+        return llm_response(
+            request, candidate_search_prompt(query, candidates), "search",
+            lambda: SongSerializer(candidates[:20], many=True).data, skipped,
         )
 
-        recommendations = response.choices[0].message.content
-        start_index = recommendations.find("[")
-        end_index = recommendations.rfind("]") + 1
 
+class ListeningEventsView(APIView):
+    """
+    API endpoint for recording listening events in bulk.
+
+    Events are validated against cached user and song ids and buffered; they
+    are written within settings.INGEST_FLUSH_INTERVAL seconds (see music.ingest).
+
+    POST (application/x-ndjson), one event per line:
+        - user_id: int
+        - song_id: int
+        - listened_at: ISO 8601 str or Unix seconds (optional, defaults to now)
+
+    Returns:
+        - 202 Accepted with the numbers of accepted and rejected events and the
+          first errors by line number.
+        - 400 if no event is valid.
+        - 413 if the request holds more than settings.INGEST_MAX_EVENTS lines.
+        - 429 with Retry-After if the buffer is full; none of the events were
+          accepted and the whole request can be retried.
+    """
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        limit = settings.INGEST_MAX_EVENTS
+        lines = list(islice(iter_lines(request.stream), limit + 1)) if request.stream else []
+        if len(lines) > limit:
+            return Response({"error": f"At most {limit} events per request."}, status=413)
+
+        rows, rejected, errors = parse_events(lines)
+        metrics.count_ingested("rejected", rejected)
+        if not rows:
+            return Response({"error": "No valid events.", "rejected": rejected, "errors": errors}, status=400)
+
+        if not get_ingest_buffer().offer(rows):
+            metrics.count_ingested("throttled", len(rows))
+            retry_after = str(math.ceil(settings.INGEST_FLUSH_INTERVAL or 1))
+            return Response({"error": "Too many pending events, retry later."}, status=429,
+                            headers={"Retry-After": retry_after})
+        metrics.count_ingested("accepted", len(rows))
+        return Response({"accepted": len(rows), "rejected": rejected, "errors": errors}, status=202)
+
+
+class SongListView(APIView):
+    """
+    API endpoint for browsing the catalog by descending popularity.
+
+    Pages are keyset-paginated (see music.browse): follow `next` to get the
+    following page, which costs the same however deep it is.
+
+    GET:
+        - genre: str (optional), one of GENRES
+        - mood: str (optional), one of MOODS
+        - limit: int (optional), songs per page, at most settings.SONGS_MAX_PAGE_SIZE
+        - cursor: str (optional), from the previous page's `next`
+
+    Returns:
+        - 200 OK with the songs in `results` and the URL of the next page in
+          `next`, null on the last page.
+        - 400 if a filter, the limit or the cursor is invalid.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        genre = request.query_params.get("genre")
+        mood = request.query_params.get("mood")
+        if genre and genre not in GENRES:
+            return Response({"error": f"Unknown genre: {genre}"}, status=400)
+        if mood and mood not in MOODS:
+            return Response({"error": f"Unknown mood: {mood}"}, status=400)
         try:
-            recommendations = json.loads(recommendations[start_index:end_index])
-        except json.JSONDecodeError:
-            return Response({"error": "Failed to parse recommendations as JSON"}, status=400)
+            limit = int(request.query_params.get("limit", settings.SONGS_PAGE_SIZE))
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=400)
+        if not 1 <= limit <= settings.SONGS_MAX_PAGE_SIZE:
+            return Response({"error": f"limit must be between 1 and {settings.SONGS_MAX_PAGE_SIZE}."}, status=400)
+
+        try:
+            songs, cursor = song_page(genre, mood, request.query_params.get("cursor"), limit)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
+        next_url = replace_query_param(request.build_absolute_uri(), "cursor", cursor) if cursor else None
+        return Response({"results": SongSerializer(songs, many=True).data, "next": next_url})
 
-        return Response({"recommended_songs": recommendations}, status=200)
\ No newline at end of file
+
+class SongFacetsView(APIView):
+    """
+    API endpoint for the song counts shown next to the catalog filters.
+
+    Counts are cached per process until a song is saved or deleted, or
+    settings.FACETS_CACHE_TTL seconds have passed.
+
+    GET:
+        No parameters.
+
+    Returns:
+        - 200 OK with `total` and the counts per genre, per mood and per
+          genre/mood pair.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response(get_facets().as_dict())
+
+
+class UserProfileView(APIView):
+    """
+    API endpoint for a user's profile: preferences, liked and skipped songs and
+    the latest settings.PROFILE_HISTORY_SIZE listens.
+
+    The number of queries and the response time do not depend on the length of
+    the user's history.
+
+    GET:
+        - user_id: int
+        - fields: str (optional), comma-separated subset of the profile fields;
+          relations left out are not queried
+
+    Returns:
+        - 200 OK with the profile.
+        - 400 if `fields` names an unknown field.
+        - 404 if the user does not exist.
+    """
+
+    def get(self, request, user_id):
+        denied = token_error(request, user_id)
+        if denied:
+            return Response({"error": denied[1]}, status=denied[0])
+        fields = request.query_params.get("fields")
+        if fields is not None:
+            fields = [name.strip() for name in fields.split(",") if name.strip()]
+            unknown = set(fields) - set(UserSerializer.Meta.fields)
+            if unknown:
+                return Response({"error": f"Unknown fields: {', '.join(sorted(unknown))}"}, status=400)
+        try:
+            user = UserSerializer.load(user_id, fields, history_size=settings.PROFILE_HISTORY_SIZE)
+        except User.DoesNotExist:
+            raise Http404("No User matches the given query.")
+        return Response(UserSerializer(user, fields=fields).data)